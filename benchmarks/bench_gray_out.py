@@ -0,0 +1,98 @@
+'''
+gray-out of non-problematic nodes: equivalence with the previous per-node ancestor
+search on small cyclic graphs, and timing on filtered graphs of 1k/10k/50k nodes
+
+Usage: python3 benchmarks/bench_gray_out.py [<seed>(0)] [--previous-max <nodes>(50000)]
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import random
+import sys
+import time
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import networkx as nx
+from bench_ripple import random_dependency_graph
+from rem_filter import gray_out_non_problematics
+from utils import is_valid_key, pop_option
+
+
+def gray_out_previous(G: nx.Graph, root: str, keyword: str):
+    '''
+    previous implementation: ancestors of every node
+    '''
+    dir_dependencies = list(G.neighbors(root))
+    for node in G.nodes():
+        if is_valid_key(G.nodes()[node], 'deprecated') and G.nodes()[node]['deprecated'] == True:
+            continue
+        if (node in dir_dependencies+[root]):
+            continue
+        if not is_valid_key(G.nodes()[node], keyword):
+            continue
+        predecessors_in_dir = [G.nodes()[n][keyword] for n in nx.ancestors(G, node) \
+            if n in dir_dependencies and is_valid_key(G.nodes()[n], keyword)]
+        if predecessors_in_dir and round(G.nodes()[node][keyword], 1) >= round(max(predecessors_in_dir), 1):
+            G.nodes()[node]['non_problematic'] = True
+    return
+
+
+def scored_graph(num_nodes: int, num_direct: int, cycle_rate: float, rnd: random.Random, cycle_span: int = None):
+    '''
+    random dependency graph with scores like the NPM graph, some missing or zero
+    '''
+    G, deprecated = random_dependency_graph(num_nodes=num_nodes, num_direct=num_direct, max_deps=3,
+        cycle_rate=cycle_rate, deprecated_rate=0.05, rnd=rnd, cycle_span=cycle_span)
+    for n in G.nodes():
+        if n == 'app':
+            G.nodes()[n]['type'] = 'GITHUB'
+            continue
+        r = rnd.random()
+        score = None if r < 0.05 else 0 if r < 0.08 else round(rnd.random(), 2)
+        G.nodes()[n].update(type='NPM', deprecated=n in deprecated, final=score)
+    return G
+
+
+def marked(G: nx.Graph) -> set:
+    return {n for n, m in G.nodes(data=True) if m.get('non_problematic')}
+
+
+def check_equivalence(rnd: random.Random, rounds: int = 500):
+    for r in range(rounds):
+        G = scored_graph(num_nodes=rnd.randint(3, 30), num_direct=rnd.randint(1, 4), cycle_rate=0.3, rnd=rnd)
+        H = G.copy()
+        gray_out_previous(G, 'app', 'final')
+        gray_out_non_problematics(H, 'app', 'final')
+        if marked(G) != marked(H):
+            sys.exit(f'mismatch on round {r}: {sorted(G.edges())}')
+    print(f'equivalence: {rounds} random cyclic graphs match the previous gray-out')
+
+
+def time_large_graphs(rnd: random.Random, previous_max: int):
+    print('{:>8} {:>8} {:>8} {:>14} {:>14}'.format('nodes', 'edges', 'marked', 'previous (s)', 'condensed (s)'))
+    # about 1k/10k/50k nodes are reachable from the application
+    for num_nodes in [1700, 25000, 155000]:
+        G = scored_graph(num_nodes=num_nodes, num_direct=40, cycle_rate=0.02, rnd=rnd, cycle_span=5)
+        H = G.copy()
+        previous = '-'
+        if G.number_of_nodes() <= previous_max:
+            start = time.perf_counter()
+            gray_out_previous(G, 'app', 'final')
+            previous = '{:.3f}'.format(time.perf_counter() - start)
+        start = time.perf_counter()
+        gray_out_non_problematics(H, 'app', 'final')
+        elapsed = time.perf_counter() - start
+        if previous != '-' and marked(G) != marked(H):
+            sys.exit(f'mismatch on {num_nodes} nodes')
+        print('{:>8,} {:>8,} {:>8,} {:>14} {:>14.3f}'.format(H.number_of_nodes(), H.number_of_edges(),
+            len(marked(H)), previous, elapsed))
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    # the previous implementation is quadratic, skip it on larger graphs
+    previous_max = int(pop_option(argv, '--previous-max', 50000))
+    seed = int(argv[0]) if argv else 0
+    rnd = random.Random(seed)
+    check_equivalence(rnd)
+    time_large_graphs(rnd, previous_max)
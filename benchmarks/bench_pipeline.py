@@ -0,0 +1,225 @@
+'''
+stage timings of the REM pipeline on a generated NPM database, runs offline
+
+every NPM graph backend is prepared and loaded from the same generated database,
+then for every generated application: dependency closure, ripple effect, subtree
+minimums, filter, gray-out, layout and html rendering are timed separately. the
+layout is skipped if the pydot layout engine is configured and graphviz (dot) is not
+installed.
+
+results are written as json, --compare prints the change of every stage against
+the results of an earlier run (e.g. of another commit).
+
+Usage: python3 benchmarks/bench_pipeline.py [--packages <n>(20000)] [--applications <n>(10)]
+    [--seed <seed>(0)] [--backends <snapshot,json,sqlite>] [--keyword <final>]
+    [--out <json>(bench_pipeline.json)] [--compare <json>]
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import contextlib # redirect_stdout
+import io
+import json
+import os
+import platform
+import random
+import shutil # which
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import networkx as nx
+import rem_layout
+import utils
+from npm_generator import generate_applications, generate_npm_db
+from rem_filter import filter_post_order_minimum, gray_out_non_problematics, stored_subtree_minimums, \
+    subgraph_minimums
+from rem_graphics import assign_graph_node_symbol, plotly_graph_to_html
+from rem_ripple import ripple_effect
+
+STAGES = ['prepare', 'load', 'closure', 'ripple', 'minimums', 'filter', 'gray_out', 'layout', 'render']
+
+
+class StageTimer:
+    '''
+    collects one record per timed stage, the output of the timed code is discarded
+    '''
+
+    def __init__(self):
+        self.records = []
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, **fields):
+        record = dict(stage=stage, **fields)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield record
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        self.records.append(record)
+
+
+def dependency_type_graph(G: nx.DiGraph, root: str, flag: str) -> nx.DiGraph:
+    '''
+    runtime or development part of an application graph, like prepare_project_analysis
+    '''
+    sub_G = G.edge_subgraph([(u, v) for u, v, m in G.edges(data=True) if m.get(flag) is True]).copy()
+    sub_G.add_node(root, **G.nodes()[root])
+    return sub_G
+
+
+def layout_available() -> bool:
+    return rem_layout.LAYOUT_ENGINE != 'pydot' or shutil.which('dot') is not None
+
+
+def run_application(timer: StageTimer, npm_G, backend: str, name: str, package_json: dict,
+    keyword: str, out_folder: str, analysis: bool):
+    with timer.stage('closure', backend=backend, application=name) as record:
+        G = utils.create_application_graph(npm_G, name, package_json['dependencies'], package_json['devDependencies'])
+        record.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    if not analysis:
+        return
+    subs, filtered = [], []
+    for flag in ['runtime', 'development']:
+        sub_G = dependency_type_graph(G, name, flag)
+        size = dict(backend=backend, application=name, dependency=flag, nodes=sub_G.number_of_nodes(),
+            edges=sub_G.number_of_edges())
+        deprecated = [n for n, m in sub_G.nodes(data=True) if m.get('deprecated')]
+        with timer.stage('ripple', **size):
+            ripple_nodes, ripple_edges = ripple_effect(sub_G, name, deprecated)
+        for u, v, m in sub_G.edges(data=True):
+            m['color'] = '#8b0000' if (u, v) in ripple_edges else 'lightgrey'
+        with timer.stage('minimums', **size) as record:
+            minimum = stored_subtree_minimums(sub_G, [keyword])
+            record['stored'] = minimum is not None
+            minimum = minimum or subgraph_minimums(sub_G, [keyword])
+        with timer.stage('filter', **size) as record:
+            filtered_G = filter_post_order_minimum(G=sub_G, ripples=ripple_edges, root=name, keyword=keyword,
+                minimum=minimum[keyword])
+            record['filtered_nodes'] = filtered_G.number_of_nodes()
+        subs.append(sub_G)
+        filtered.append(filtered_G)
+    G = nx.compose(*subs)
+    filtered_G = nx.compose(*filtered)
+    size = dict(backend=backend, application=name, nodes=filtered_G.number_of_nodes(), edges=filtered_G.number_of_edges())
+    with timer.stage('gray_out', **size):
+        gray_out_non_problematics(G=filtered_G, root=name, keyword=keyword)
+    size = dict(backend=backend, application=name, nodes=G.number_of_nodes(), edges=G.number_of_edges())
+    if layout_available():
+        with timer.stage('layout', engine=rem_layout.LAYOUT_ENGINE, **size):
+            pos = rem_layout.graph_layout(G, root=name, prog='dot')
+    else:
+        rnd = random.Random(name)
+        pos = {n: (rnd.uniform(0, 5000), rnd.uniform(0, 2000)) for n in G.nodes()}
+    assign_graph_node_symbol(G, filtered_G)
+    for view, view_G in [('full', G), ('filtered', filtered_G)]:
+        with timer.stage('render', view=view, **dict(size, nodes=view_G.number_of_nodes(), edges=view_G.number_of_edges())):
+            plotly_graph_to_html(G=view_G, pos=pos, title=name, key=keyword,
+                outfile=os.path.join(out_folder, f'{name}_{view}.html'))
+
+
+def run_benchmark(num_packages: int, num_applications: int, seed: int, backends: list, keyword: str) -> dict:
+    timer = StageTimer()
+    # layouts are computed, not read from the cache
+    rem_layout.LAYOUT_CACHE_ENABLE = False
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'npm.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            tools = generate_npm_db(db_path, num_packages, seed)
+        applications = generate_applications(num_applications, num_packages, tools, random.Random(seed + 1))
+        utils.NPMDB = db_path
+        utils.NPMJSON = os.path.join(folder, 'npm_graph.json')
+        utils.NPMSNAPSHOT = os.path.join(folder, 'npm_graph.snap')
+        for i, backend in enumerate(backends):
+            print(f'{backend} backend..')
+            utils.NPMGRAPH_BACKEND = backend
+            with timer.stage('prepare', backend=backend):
+                utils.prepare_npm_graph()
+            with timer.stage('load', backend=backend):
+                npm_G = utils.load_npm_graph()
+            # the analysis stages do not depend on the backend, they run with the first one
+            for name, package_json in applications:
+                run_application(timer, npm_G, backend, name, package_json, keyword, folder, analysis=(i == 0))
+            del npm_G
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'networkx': nx.__version__,
+            'machine': platform.machine(),
+            'packages': num_packages,
+            'applications': num_applications,
+            'seed': seed,
+            'keyword': keyword,
+            'layout': rem_layout.LAYOUT_ENGINE if layout_available() else 'skipped, graphviz dot not found'
+        },
+        'summary': summarize(timer.records),
+        'records': timer.records
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=dirname(dirname(abspath(__file__))),
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def summarize(records: list) -> dict:
+    '''
+    {stage: {backend: total seconds}}, the analysis stages are summed over applications
+    '''
+    summary = {}
+    for r in records:
+        by_backend = summary.setdefault(r['stage'], {})
+        by_backend[r['backend']] = round(by_backend.get(r['backend'], 0) + r['seconds'], 6)
+    return {s: summary[s] for s in STAGES if s in summary}
+
+
+def print_summary(summary: dict, previous: dict = None):
+    if previous is None:
+        print('{:>10} {:>10} {:>12}'.format('stage', 'backend', 'seconds'))
+    else:
+        print('{:>10} {:>10} {:>12} {:>12} {:>8}'.format('stage', 'backend', 'seconds', 'previous', 'change'))
+    for stage, by_backend in summary.items():
+        for backend, seconds in by_backend.items():
+            if previous is None:
+                print('{:>10} {:>10} {:>12.3f}'.format(stage, backend, seconds))
+                continue
+            before = previous.get(stage, {}).get(backend)
+            change = '{:+.1f}%'.format(100 * (seconds - before) / before) if before else '-'
+            print('{:>10} {:>10} {:>12.3f} {:>12} {:>8}'.format(stage, backend, seconds,
+                '{:.3f}'.format(before) if before is not None else '-', change))
+
+
+def main():
+    argv = sys.argv[1:]
+    num_packages = int(utils.pop_option(argv, '--packages', 20000))
+    num_applications = int(utils.pop_option(argv, '--applications', 10))
+    seed = int(utils.pop_option(argv, '--seed', 0))
+    backends = utils.pop_option(argv, '--backends', 'snapshot,json,sqlite').split(',')
+    keyword = utils.pop_option(argv, '--keyword', 'final')
+    out_path = utils.pop_option(argv, '--out', 'bench_pipeline.json')
+    compare_path = utils.pop_option(argv, '--compare')
+    if argv or any(b not in ['snapshot', 'json', 'sqlite'] for b in backends):
+        sys.exit('Usage: python3 benchmarks/bench_pipeline.py [--packages <n>(20000)] [--applications <n>(10)] '
+            '[--seed <seed>(0)] [--backends <snapshot,json,sqlite>] [--keyword <final>] '
+            '[--out <json>(bench_pipeline.json)] [--compare <json>]')
+    previous = None
+    if compare_path:
+        with open(compare_path, 'r') as pfile:
+            previous = json.load(pfile)
+        if previous['meta']['packages'] != num_packages or previous['meta']['seed'] != seed:
+            print('warning: {} was generated with other parameters'.format(compare_path))
+
+    results = run_benchmark(num_packages, num_applications, seed, backends, keyword)
+    print_summary(results['summary'], previous['summary'] if previous else None)
+    with open(out_path, 'w') as rfile:
+        json.dump(results, rfile, indent=1)
+    print(f'results stored at {out_path}')
+
+
+if __name__ == '__main__':
+    main()
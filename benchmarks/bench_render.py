@@ -0,0 +1,89 @@
+'''
+rendering of REM graphs: one trace per edge (previous renderer) against
+one trace per edge color, time of plotly_graph_to_html and size of the html file
+
+Usage: python3 benchmarks/bench_render.py [<seed>(0)]
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import plotly.graph_objects as go
+import rem_graphics
+from bench_ripple import random_dependency_graph
+from rem_graphics import plotly_graph_to_html
+
+
+def per_edge_traces(edges: list, pos: dict, legendgroup: str, name: str, width: float, scatter=go.Scatter) -> list:
+    '''
+    previous renderer: one svg trace per edge, the last one carries the legend entry
+    '''
+    traces = []
+    for i, (u, v, color) in enumerate(edges):
+        last = (i == len(edges)-1)
+        traces.append(go.Scatter(
+            x=[pos[u][0], pos[v][0]],
+            y=[pos[u][1], pos[v][1]],
+            mode='lines',
+            legendgroup=legendgroup,
+            showlegend=last,
+            name=name if last else None,
+            line=dict(color=color, width=width)
+        ))
+    return traces
+
+
+def rem_graph(num_nodes: int, rnd: random.Random) -> tuple:
+    '''
+    random REM graph with the attributes set by rem_graph_analysis, half runtime half development
+    returns (graph, positions)
+    '''
+    G, deprecated = random_dependency_graph(num_nodes=num_nodes, num_direct=20, max_deps=4,
+        cycle_rate=0.0, deprecated_rate=0.02, rnd=rnd)
+    G.nodes()['app'].update(type='GITHUB', symbol='circle')
+    for n in G.nodes():
+        if n != 'app':
+            G.nodes()[n].update(version='1.0.0', deprecated=n in deprecated, final=round(rnd.random(), 2),
+                type='NPM', symbol='circle')
+    for u, v, m in G.edges(data=True):
+        m['runtime' if rnd.random() < 0.5 else 'development'] = True
+        m['color'] = 'darkred' if rnd.random() < 0.1 else 'lightgrey'
+    pos = {n: (rnd.uniform(0, 5000), rnd.uniform(0, 2000)) for n in G.nodes()}
+    return (G, pos)
+
+
+def render(G, pos, outfile: str) -> tuple:
+    start = time.perf_counter()
+    plotly_graph_to_html(G=G, pos=pos, title='benchmark', key='final', outfile=outfile)
+    return (time.perf_counter() - start, os.path.getsize(outfile))
+
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    rnd = random.Random(seed)
+    batched_edge_traces, scatter_type = rem_graphics.edge_traces, rem_graphics.scatter_type
+    rows = []
+    with tempfile.TemporaryDirectory() as out_folder:
+        outfile = os.path.join(out_folder, 'bench.html')
+        for num_nodes in [500, 2000, 5000, 10000]:
+            G, pos = rem_graph(num_nodes, rnd)
+            rem_graphics.edge_traces, rem_graphics.scatter_type = per_edge_traces, lambda G: go.Scatter
+            before = render(G, pos, outfile)
+            rem_graphics.edge_traces, rem_graphics.scatter_type = batched_edge_traces, scatter_type
+            after = render(G, pos, outfile)
+            rows.append((G.number_of_nodes(), G.number_of_edges(), before, after))
+    print('{:>8} {:>8} {:>12} {:>12} {:>14} {:>14}'.format('nodes', 'edges', 'before (s)', 'after (s)',
+        'before (KB)', 'after (KB)'))
+    for nodes, edges, before, after in rows:
+        print('{:>8,} {:>8,} {:>12.2f} {:>12.2f} {:>14,.0f} {:>14,.0f}'.format(nodes, edges,
+            before[0], after[0], before[1]/1024, after[1]/1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+ripple effect engine: equivalence with simple path enumeration on small graphs,
+and timing on large development dependency trees
+
+Usage: python3 benchmarks/bench_ripple.py [<seed>(0)]
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import random
+import sys
+import time
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+import networkx as nx
+from rem_ripple import ripple_effect, ripple_effect_simple_paths
+
+
+def random_dependency_graph(num_nodes: int, num_direct: int, max_deps: int, 
+    cycle_rate: float, deprecated_rate: float, rnd: random.Random, cycle_span: int = None) -> tuple:
+    '''
+    layered dependency tree rooted at 'app' with a few back edges (cycles)
+    cycle_span limits how far back an edge may point, None for anywhere
+    returns (graph, deprecated package list)
+    '''
+    G = nx.DiGraph()
+    G.add_node('app')
+    # direct dependencies are the first packages, which reach most of the tree
+    for i in range(num_direct):
+        G.add_edge('app', f'p{i}')
+    for i in range(num_nodes):
+        # mostly forward edges to nearby packages, some back edges to create cycles
+        for _ in range(rnd.randint(0, max_deps)):
+            if rnd.random() < cycle_rate:
+                j = rnd.randrange(max(0, i-cycle_span) if cycle_span else 0, i+1)
+            else:
+                j = rnd.randrange(i+1, min(num_nodes, i+1+num_nodes//10)+1)
+            if j < num_nodes and j != i:
+                G.add_edge(f'p{i}', f'p{j}')
+    G = G.subgraph(list(nx.descendants(G, 'app'))+['app']).copy()
+    deprecated = [n for n in G.nodes() if n != 'app' and rnd.random() < deprecated_rate]
+    return (G, deprecated)
+
+
+def check_equivalence(rnd: random.Random, rounds: int = 300):
+    for r in range(rounds):
+        G, deprecated = random_dependency_graph(num_nodes=rnd.randint(3, 14), num_direct=rnd.randint(1, 3), 
+            max_deps=3, cycle_rate=0.3, deprecated_rate=0.2, rnd=rnd)
+        expected = ripple_effect_simple_paths(G, 'app', deprecated)
+        result = ripple_effect(G, 'app', deprecated)
+        if expected != result:
+            sys.exit(f'mismatch on round {r}: {sorted(G.edges())} deprecated={deprecated}')
+    print(f'equivalence: {rounds} random cyclic graphs match simple path enumeration')
+
+
+def time_large_trees(rnd: random.Random):
+    print('{:>8} {:>8} {:>11} {:>14} {:>10}'.format('nodes', 'edges', 'deprecated', 'ripple edges', 'seconds'))
+    for num_nodes in [1000, 5000, 20000, 50000]:
+        G, deprecated = random_dependency_graph(num_nodes=num_nodes, num_direct=40, max_deps=6, 
+            cycle_rate=0.02, deprecated_rate=0.02, rnd=rnd, cycle_span=5)
+        start = time.perf_counter()
+        nodes, edges = ripple_effect(G, 'app', deprecated)
+        elapsed = time.perf_counter() - start
+        print('{:>8,} {:>8,} {:>11,} {:>14,} {:>10.3f}'.format(G.number_of_nodes(), G.number_of_edges(), 
+            len(deprecated), len(edges), elapsed))
+
+
+if __name__ == '__main__':
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    rnd = random.Random(seed)
+    check_equivalence(rnd)
+    time_large_trees(rnd)
@@ -0,0 +1,160 @@
+'''
+seeded generator of npm-like dependency databases for offline benchmarks
+
+packages are numbered by popularity: a package depends mostly on more popular
+(lower numbered) packages, with a power-law number of dependencies, and partly
+on packages close to it, which gives deep development tool trees. rings of
+neighbouring packages create cycles, some packages are deprecated, have no scores or
+depend on names that are not in the packages table, as in the real registry.
+the database has the schema of preprocess.create_tables.
+
+Usage: python3 benchmarks/npm_generator.py [--packages <n>(20000)] [--seed <seed>(0)]
+    [--applications <package_json_folder>] [--num-applications <n>(20)] <out_db_file>
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import json
+import os
+import random
+import sqlite3
+import sys
+from os.path import abspath, dirname
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from npm_sqlite import create_indexes, update_subtree_minimums
+from preprocess import create_tables
+from utils import pop_option
+
+
+def package_name(i: int) -> str:
+    # every 7th package is scoped, like @types/..
+    return '@scope{}/pkg-{}'.format(i % 13, i) if i % 7 == 3 else f'pkg-{i}'
+
+
+def out_degree(rnd: random.Random, tool: bool, max_deps: int) -> int:
+    '''
+    power-law number of dependencies, most packages have a few, some have many
+    '''
+    deg = int(rnd.paretovariate(1.2)) - 1
+    if tool:
+        deg = deg * 3 + rnd.randint(2, 6)
+    return min(deg, max_deps)
+
+
+def generate_packages(num_packages: int, rnd: random.Random, max_deps: int = 60, tool_rate: float = 0.05,
+    local_rate: float = 0.3, cycle_rate: float = 0.005, deprecated_rate: float = 0.03,
+    missing_score_rate: float = 0.1, dangling_rate: float = 0.01) -> tuple:
+    '''
+    returns (package rows, dependency rows, score rows, tool package ids)
+    package rows have the columns of the packages table
+    '''
+    versions = ['{}.{}.{}'.format(rnd.randint(0, 12), rnd.randint(0, 30), rnd.randint(0, 20))
+        for i in range(num_packages)]
+    tools = set()
+    deps = [set() for i in range(num_packages)]
+    dangling = [set() for i in range(num_packages)]
+    for i in range(1, num_packages):
+        tool = i > 100 and rnd.random() < tool_rate
+        if tool:
+            tools.add(i)
+        for _ in range(out_degree(rnd, tool, max_deps)):
+            r = rnd.random()
+            if r < dangling_rate:
+                dangling[i].add('unpublished-{}'.format(rnd.randrange(num_packages)))
+            elif tool or r < dangling_rate + local_rate:
+                deps[i].add(rnd.randrange(max(0, i - 200), i))
+            else:
+                deps[i].add(int(i * rnd.random() ** 3))
+    # cycles: rings of a few neighbouring packages that depend on each other
+    for _ in range(int(num_packages * cycle_rate)):
+        start = rnd.randrange(100, max(101, num_packages - 10))
+        ring = list(range(start, min(start + rnd.randint(2, 8), num_packages)))
+        for u, v in zip(ring, ring[1:] + ring[:1]):
+            deps[u].add(v)
+
+    packages, depends, scores = [], [], []
+    for i in range(num_packages):
+        name = package_name(i)
+        deprecated = 1 if rnd.random() < deprecated_rate else 0
+        packages.append((name, versions[i], None, None, None, None, 'git', None, None, 'MIT',
+            deprecated, 'this package is no longer maintained' if deprecated else None))
+        for j in sorted(deps[i] - {i}):
+            depends.append((name, versions[i], package_name(j), '^' + versions[j]))
+        for dep in sorted(dangling[i]):
+            depends.append((name, versions[i], dep, '^1.0.0'))
+        if rnd.random() >= missing_score_rate:
+            popularity = rnd.betavariate(1, 6 if i > 1000 else 1)
+            quality = rnd.betavariate(5, 2)
+            maintenance = rnd.betavariate(2, 2) if not deprecated else rnd.random() * 0.2
+            scores.append((name, (popularity + quality + maintenance) / 3, popularity, quality, maintenance))
+    return (packages, depends, scores, tools)
+
+
+def generate_applications(num_applications: int, num_packages: int, tools: set, rnd: random.Random) -> list:
+    '''
+    returns [(application name, package.json dict)], development dependencies are mostly tools
+    '''
+    tool_list = sorted(tools) or list(range(num_packages))
+    applications = []
+    for a in range(num_applications):
+        runtime = {package_name(int(num_packages * rnd.random() ** 2)) for _ in range(rnd.randint(3, 30))}
+        development = {package_name(rnd.choice(tool_list)) for _ in range(rnd.randint(2, 15))}
+        development |= {package_name(int(num_packages * rnd.random() ** 2)) for _ in range(rnd.randint(0, 20))}
+        applications.append((f'app{a}', {
+            'name': f'app{a}',
+            'dependencies': {n: '*' for n in sorted(runtime)},
+            'devDependencies': {n: '*' for n in sorted(development - runtime)}
+        }))
+    return applications
+
+
+def generate_npm_db(db_path: str, num_packages: int, seed: int) -> set:
+    '''
+    write a generated NPM dependency database, returns the tool package ids
+    '''
+    rnd = random.Random(seed)
+    packages, depends, scores, tools = generate_packages(num_packages, rnd)
+    if os.path.isfile(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    create_tables(conn)
+    conn.executemany(''' INSERT INTO packages VALUES (?,?,?,?,?,?,?,?,?,?,?,?); ''', packages)
+    conn.executemany(''' INSERT INTO depend VALUES (?,?,?,?); ''', depends)
+    conn.executemany(''' INSERT INTO scores VALUES (?,?,?,?,?); ''', scores)
+    conn.commit()
+    create_indexes(conn)
+    update_subtree_minimums(conn)
+    conn.close()
+    print('{:,} NPM packages, {:,} NPM dependency relationships, {:,} scores stored at {}'
+        .format(len(packages), len(depends), len(scores), db_path))
+    return tools
+
+
+def write_applications(folder: str, applications: list):
+    '''
+    <name>_package.json files, the input of rem_graph_run_batch.py
+    '''
+    os.makedirs(folder, exist_ok=True)
+    for name, package_json in applications:
+        with open(os.path.join(folder, name+'_package.json'), 'w') as pfile:
+            json.dump(package_json, pfile, indent=2)
+    print('{:,} applications stored at {}'.format(len(applications), folder))
+
+
+def main():
+    argv = sys.argv[1:]
+    num_packages = int(pop_option(argv, '--packages', 20000))
+    seed = int(pop_option(argv, '--seed', 0))
+    folder = pop_option(argv, '--applications')
+    num_applications = int(pop_option(argv, '--num-applications', 20))
+    if len(argv) != 1:
+        sys.exit('Usage: python3 benchmarks/npm_generator.py [--packages <n>(20000)] [--seed <seed>(0)] '
+            '[--applications <package_json_folder>] [--num-applications <n>(20)] <out_db_file>')
+    tools = generate_npm_db(argv[0], num_packages, seed)
+    if folder:
+        write_applications(folder, generate_applications(num_applications, num_packages, tools,
+            random.Random(seed + 1)))
+
+
+if __name__ == '__main__':
+    main()
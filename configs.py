@@ -3,9 +3,44 @@ print(f'os platform: {platform}')
 if platform == 'win32':
   NPMDB='data\\dep_network_npm_search.db' # sqlite3 NPM dependency database
   NPMJSON='data\\npm_graph.json'
+  NPMSNAPSHOT='data\\npm_graph.snap' # memory-mapped binary snapshot of the NPM graph
+  LAYOUT_CACHE_DIR='data\\layout_cache' # graph layouts keyed by graph content
+  INCREMENTAL_STATE_DIR='data\\incremental' # analysis state of every application (--incremental)
 else:
   NPMDB='data/dep_network_npm_search.db'
   NPMJSON='data/npm_graph.json'
+  NPMSNAPSHOT='data/npm_graph.snap'
+  LAYOUT_CACHE_DIR='data/layout_cache'
+  INCREMENTAL_STATE_DIR='data/incremental'
 NPMGRAPH_LOAD=False
-JSONMODE=False
-FILTER_ENABLE=True
\ No newline at end of file
+NPMGRAPH_BACKEND='snapshot' # snapshot | sqlite | json
+JSONMODE=False # graphs are written to d3_test/ as json instead of html
+JSONMODE_FORMAT='columnar' # columnar (one file with positions, d3_test/canvas.html) | node_link (networkx node_link_data and _pos.json)
+JSONMODE_GZIP=False # columnar files are written gzip'd (.json.gz)
+FILTER_ENABLE=True
+KEYWORDS=['final', 'popularity', 'quality', 'maintenance'] # metrics of health
+WEBGL_NODE_THRESHOLD=2000 # graphs with more nodes are drawn with WebGL
+LAYOUT_ENGINE='layered' # layered (in process) | pydot (graphviz dot, needs graphviz installed)
+LAYOUT_CACHE_ENABLE=True
+LAYOUT_CACHE_MAX_BYTES=512*1024*1024 # least recently used layouts are evicted above this size
+PROFILE_TRACEMALLOC=False # --profile also traces python allocations per stage (slower)
+
+# registry dump ingestion (preprocess.py)
+INGEST_WORKERS=None # parsing processes, None: all cores
+INGEST_CHUNK_SIZE=500 # docs per parsing task
+INGEST_COMMIT_DOCS=100000 # docs per transaction
+
+# npm search score harvesting (preprocess.py)
+NPM_REGISTRY_URL='http://registry.npmjs.org'
+SCORES_MAX_INFLIGHT=32 # concurrent requests
+SCORES_RATE_LIMIT=50 # requests per second
+SCORES_MAX_RETRIES=5 # retries on 429/5xx and connection errors
+SCORES_TIMEOUT=30 # seconds per request
+SCORES_CHECKPOINT=1000 # scores committed to the database at a time
+
+# REM analysis service (rem_server.py)
+REM_SERVER_HOST='127.0.0.1'
+REM_SERVER_PORT=8000
+REM_SERVER_WORKERS=4 # analyses running at the same time
+REM_SERVER_QUEUE=16 # requests waiting for a worker before new ones are rejected
+REM_SERVER_TIMEOUT=300 # seconds a request waits for its analysis
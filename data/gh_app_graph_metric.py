@@ -19,12 +19,15 @@ average (median) direct and transitive (run time and development) dependencies f
 import sys
 import json
 import networkx as nx
+import numpy as np
 import sqlite3
 import statistics
 import csv
-from os import listdir
+from os import listdir, replace, stat
 from os.path import isfile, isdir, join
 
+INDEX_SUFFIX = '.reach.npz' # reachability index, stored next to the database
+
 def get_package_json(project_path: str):
     if isfile(project_path):
         file_content = open(project_path, 'r')
@@ -67,6 +70,159 @@ def get_npm_lists(db_path: str) -> tuple:
     return (node_list, rel_list)
 
 
+def db_fingerprint(db_path: str) -> np.ndarray:
+    st = stat(db_path)
+    return np.array([st.st_size, int(st.st_mtime)], dtype=np.int64)
+
+
+class ReachabilityIndex:
+    '''
+    transitive dependencies of every package over the SCC condensation of the NPM graph
+    packages of a strongly connected component share the same descendants, the descendants
+    of a component are a sorted array of component ids, computed on first use and kept
+    with the index so later runs only look them up
+    '''
+
+    def __init__(self, names: list, comp: np.ndarray, sizes: np.ndarray, indptr: list, indices: list, 
+        fingerprint: np.ndarray, memo: dict = None):
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.comp = comp
+        self.sizes = sizes
+        self.indptr = indptr
+        self.indices = indices
+        self.fingerprint = fingerprint
+        self.memo = memo if memo is not None else {}
+        self.updated = False
+
+    @classmethod
+    def build(cls, rel_list: list, fingerprint: np.ndarray):
+        '''
+        nodes are the packages of the dependency relationships, like create_graph
+        '''
+        ids = {}
+        src = np.empty(len(rel_list), dtype=np.int64)
+        dst = np.empty(len(rel_list), dtype=np.int64)
+        for j, (name, ver, dep_name, dep_cons) in enumerate(rel_list):
+            src[j] = ids.setdefault(name, len(ids))
+            dst[j] = ids.setdefault(dep_name, len(ids))
+        G = nx.DiGraph()
+        G.add_nodes_from(range(len(ids)))
+        G.add_edges_from(zip(src.tolist(), dst.tolist()))
+        comp = np.empty(len(ids), dtype=np.int64)
+        num_comps = 0
+        for scc in nx.strongly_connected_components(G):
+            comp[list(scc)] = num_comps
+            num_comps += 1
+        del G
+        sizes = np.bincount(comp, minlength=num_comps)
+        # condensation edges in CSR form
+        cu, cv = comp[src], comp[dst]
+        keep = cu != cv
+        pairs = np.unique(cu[keep] * num_comps + cv[keep])
+        cu, cv = pairs // num_comps, pairs % num_comps
+        indptr = np.zeros(num_comps+1, dtype=np.int64)
+        np.cumsum(np.bincount(cu, minlength=num_comps), out=indptr[1:])
+        return cls(list(ids), comp, sizes, indptr.tolist(), cv.tolist(), fingerprint)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: np.ndarray):
+        '''
+        returns None if the index is missing or was built from another database
+        '''
+        if not isfile(path):
+            return None
+        with np.load(path) as data:
+            if not np.array_equal(data['fingerprint'], fingerprint):
+                return None
+            offsets = data['name_offsets']
+            blob = data['name_data'].tobytes()
+            names = [blob[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets)-1)]
+            memo_offsets = data['memo_offsets']
+            memo_data = data['memo_data']
+            memo = {int(c): memo_data[memo_offsets[i]:memo_offsets[i+1]] for i, c in enumerate(data['memo_comps'])}
+            return cls(names, data['comp'], data['sizes'], data['indptr'].tolist(), data['indices'].tolist(), 
+                fingerprint, memo)
+
+    def save(self, path: str):
+        encoded = [name.encode('utf-8') for name in self.names]
+        name_offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=name_offsets[1:])
+        memo_comps = np.array(sorted(self.memo), dtype=np.int64)
+        memo_offsets = np.zeros(len(memo_comps)+1, dtype=np.int64)
+        np.cumsum([len(self.memo[c]) for c in memo_comps], out=memo_offsets[1:])
+        memo_data = np.concatenate([self.memo[c] for c in memo_comps]) if len(memo_comps) else np.zeros(0, dtype=np.int64)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, fingerprint=self.fingerprint, 
+            name_offsets=name_offsets, name_data=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            comp=self.comp, sizes=self.sizes, indptr=np.array(self.indptr, dtype=np.int64), 
+            indices=np.array(self.indices, dtype=np.int64),
+            memo_comps=memo_comps, memo_offsets=memo_offsets, memo_data=memo_data)
+        replace(tmp_path, path)
+        self.updated = False
+
+    def descendants(self, c: int) -> np.ndarray:
+        '''
+        sorted ids of the components reachable from component c, c included
+        '''
+        if c in self.memo:
+            return self.memo[c]
+        parts = []
+        found = [c]
+        seen = {c}
+        stack = [c]
+        indptr, indices = self.indptr, self.indices
+        while stack:
+            x = stack.pop()
+            for y in indices[indptr[x]:indptr[x+1]]:
+                if y in seen:
+                    continue
+                seen.add(y)
+                if y in self.memo:
+                    # everything below y is known
+                    parts.append(self.memo[y])
+                else:
+                    found.append(y)
+                    stack.append(y)
+        reach = np.unique(np.concatenate([np.array(found, dtype=np.int64)] + parts))
+        self.memo[c] = reach
+        self.updated = True
+        return reach
+
+    def dep_stat(self, dlist: list) -> tuple:
+        '''
+        same as get_dep_stat_by_list: (#direct, #transitive)
+        '''
+        if not dlist:
+            return (0, 0)
+        num_direct = len(dlist)
+        reached = []
+        missing = set() # not in the NPM graph, reachable only as a direct dependency
+        for dep in dlist:
+            i = self.ids.get(str(dep))
+            if i is None:
+                missing.add(str(dep))
+            else:
+                reached.append(self.descendants(int(self.comp[i])))
+        num_reached = int(self.sizes[np.unique(np.concatenate(reached))].sum()) if reached else 0
+        num_tran = max(num_reached + len(missing) - num_direct, 0)
+        return (num_direct, num_tran)
+
+
+def load_reachability_index(db_path: str) -> ReachabilityIndex:
+    fingerprint = db_fingerprint(db_path)
+    index = ReachabilityIndex.load(db_path+INDEX_SUFFIX, fingerprint)
+    if index is None:
+        print('building reachability index..', end='')
+        node_list, rel_list = get_npm_lists(db_path)
+        index = ReachabilityIndex.build(rel_list, fingerprint)
+        index.updated = True
+        print('done. [{:,}] packages, [{:,}] components'.format(len(index.names), len(index.sizes)))
+    else:
+        print('read reachability index from {}{}'.format(db_path, INDEX_SUFFIX))
+    return index
+
+
 '''
 G: nx.DiGraph
 dlist: list
@@ -75,6 +231,9 @@ root: str
 -> tuple: (#direct, #transitive)
 '''
 def get_dep_stat_by_list(G: nx.DiGraph, dlist: list, root: str) -> tuple:
+    '''
+    reference implementation, a traversal of the NPM graph per call, see ReachabilityIndex
+    '''
     if not dlist:
         return (0, 0)
     num_direct = len(dlist)
@@ -96,14 +255,19 @@ def test_files(path: str):
         print(fi)
 
 
-def get_dep_size_lists(path: str) -> tuple:
+def get_dep_size_lists(path: str, legacy: bool = False) -> tuple:
     file_count = 0
     # tracker = ([0,0], [0,0]) # ([direct runtime, transitive runtime], [direct dev, transitive dev])
     pkg_names = []
     runtime_dep = ([],[]) # ()
     dev_dep = ([],[])
-    node_list, rel_list = get_npm_lists(npm_db)
-    npm_G = create_graph(node_list, rel_list)
+    if legacy:
+        node_list, rel_list = get_npm_lists(npm_db)
+        npm_G = create_graph(node_list, rel_list)
+        dep_stat = lambda dep_list: get_dep_stat_by_list(npm_G, dep_list, 'application_root')
+    else:
+        index = load_reachability_index(npm_db)
+        dep_stat = index.dep_stat
 
     for fi in listdir(path):
         if not fi.endswith('package.json') or not isfile(join(path, fi)):
@@ -120,7 +284,7 @@ def get_dep_size_lists(path: str) -> tuple:
         num_transitive_rt = 0
         if 'dependencies' in mdata and mdata['dependencies'] is not None:
             dep_list = list(mdata['dependencies'])
-            num_direct_rt, num_transitive_rt = get_dep_stat_by_list(npm_G, dep_list, 'application_root')
+            num_direct_rt, num_transitive_rt = dep_stat(dep_list)
         runtime_dep[0].append(num_direct_rt)
         runtime_dep[1].append(num_transitive_rt)
         # development dependencies
@@ -128,13 +292,16 @@ def get_dep_size_lists(path: str) -> tuple:
         num_transitive_dev = 0
         if 'devDependencies' in mdata and mdata['devDependencies'] is not None:
             dep_list = list(mdata['devDependencies'])
-            num_direct_dev, num_transitive_dev = get_dep_stat_by_list(npm_G, dep_list, 'application_root')
+            num_direct_dev, num_transitive_dev = dep_stat(dep_list)
         dev_dep[0].append(num_direct_dev)
         dev_dep[1].append(num_transitive_dev)
         print('[{ind}] name[{name}] #dir_rt[{dr}] #tran_rt[{tr}] #dir_dev[{dd}] #tran_dd[{td}]'
         .format(ind=file_count, name=name, dr=num_direct_rt, tr=num_transitive_rt,
         dd=num_direct_dev, td=num_transitive_dev))
 
+    if not legacy and index.updated:
+        index.save(npm_db+INDEX_SUFFIX)
+        print('reachability index stored at {}{}'.format(npm_db, INDEX_SUFFIX))
     return (pkg_names, runtime_dep, dev_dep)
 
 
@@ -168,11 +335,16 @@ def export_csv(names: list, rt_dep: tuple, dev_dep: tuple):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        sys.exit('Usage: python3 gh_app_graph_metric.py <repo_path> <npm_db>')
-    out_path = sys.argv[1]
-    npm_db = sys.argv[2]
-    name_list, runtime_dep, dev_dep = get_dep_size_lists(out_path)
+    argv = sys.argv[1:]
+    # traverse the NPM graph for every application instead of using the reachability index
+    legacy = '--legacy' in argv
+    if legacy:
+        argv.remove('--legacy')
+    if len(argv) < 2:
+        sys.exit('Usage: python3 gh_app_graph_metric.py [--legacy] <repo_path> <npm_db>')
+    out_path = argv[0]
+    npm_db = argv[1]
+    name_list, runtime_dep, dev_dep = get_dep_size_lists(out_path, legacy)
     report_stats(runtime_dep, dev_dep)
     export_csv(name_list, runtime_dep, dev_dep)
 
@@ -0,0 +1,201 @@
+'''
+resolved dependency trees of package-lock.json (lockfileVersion 1, 2 and 3),
+npm-shrinkwrap.json and yarn.lock (classic and berry)
+
+a lockfile pins the packages an application actually installs, REM graphs built from
+it (see utils.lockfile_closure) are exact instead of the closure over the latest versions
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import json
+import os
+import re
+
+LOCKFILE_NAMES = ['package-lock.json', 'npm-shrinkwrap.json', 'yarn.lock']
+# dependency fields of an installed package, devDependencies are only installed for the application
+_DEPENDENCY_FIELDS = ['dependencies', 'optionalDependencies', 'peerDependencies']
+_YARN_ENTRY = re.compile(r'^("[^"]+"|[^\s:]+):?\s+(.*)$')
+
+
+class Lockfile:
+    '''
+    packages: {key: (name, version)}, a key is an install location (package-lock.json)
+        or an entry (yarn.lock), the same package name can be installed in several versions
+    dependencies: {key: [(dependency name, constraint, key)]}, dependencies that are
+        not installed (e.g. optional dependencies of other platforms) are left out
+    '''
+
+    def __init__(self, packages: dict, dependencies: dict, descriptors: dict, top_level: dict):
+        self.packages = packages
+        self.dependencies = dependencies
+        self._descriptors = descriptors
+        self._top_level = top_level
+
+    def resolve(self, name: str, constraint: str):
+        '''
+        key of a direct dependency of the application, None if it is not in the lockfile
+        '''
+        key = self._descriptors.get(_descriptor(name, constraint))
+        return key if key is not None else self._top_level.get(name)
+
+    def names(self) -> set:
+        return {name for name, version in self.packages.values()}
+
+    def number_of_packages(self) -> int:
+        return len(self.packages)
+
+
+def _descriptor(name: str, constraint) -> str:
+    constraint = str(constraint)
+    return name + '@' + (constraint[4:] if constraint.startswith('npm:') else constraint)
+
+
+def _installed_name(path: str) -> str:
+    return path.rsplit('node_modules/', 1)[-1]
+
+
+def _resolve_location(packages: dict, path: str, name: str):
+    '''
+    node module resolution: <path>/node_modules/<name>, then the node_modules of every parent folder
+    '''
+    while True:
+        candidate = (path + '/' if path else '') + 'node_modules/' + name
+        if candidate in packages:
+            return candidate
+        if not path:
+            return None
+        path = path.rsplit('/', 1)[0] if '/' in path else ''
+
+
+def _flatten_v1(dependencies: dict, path: str, packages: dict):
+    '''
+    nested dependencies of lockfileVersion 1 as install locations of lockfileVersion 2
+    '''
+    for name, meta in dependencies.items():
+        location = (path + '/' if path else '') + 'node_modules/' + name
+        version = str(meta.get('version', ''))
+        if version.startswith('npm:'):
+            # alias, npm:<name>@<version>
+            name, version = version[4:].rsplit('@', 1)
+        packages[location] = {'name': name, 'version': version, 'dependencies': meta.get('requires', {})}
+        _flatten_v1(meta.get('dependencies', {}), location, packages)
+
+
+def parse_package_lock(data: dict) -> Lockfile:
+    '''
+    package-lock.json or npm-shrinkwrap.json, lockfileVersion 2 and 3 list every install location
+    in packages, lockfileVersion 1 nests them in dependencies
+    '''
+    if 'packages' in data:
+        packages = data['packages']
+    else:
+        packages = {}
+        _flatten_v1(data.get('dependencies', {}), '', packages)
+    lock_packages, dependencies = {}, {}
+    for path, meta in packages.items():
+        if not path or meta.get('link'):
+            continue # the application itself, workspace links are followed through their target
+        lock_packages[path] = (meta.get('name') or _installed_name(path), str(meta.get('version', '')))
+    for path in lock_packages:
+        deps = []
+        for field in _DEPENDENCY_FIELDS:
+            for name, constraint in packages[path].get(field, {}).items():
+                location = _resolve_location(packages, path, name)
+                if location is not None and packages[location].get('link'):
+                    location = packages[location].get('resolved')
+                if location in lock_packages:
+                    deps.append((name, str(constraint), location))
+        dependencies[path] = deps
+    top_level = {}
+    for path in lock_packages:
+        if path.startswith('node_modules/') and '/node_modules/' not in path:
+            top_level[_installed_name(path)] = path
+    for path, meta in packages.items():
+        # workspaces are installed as links to their folder
+        if path.startswith('node_modules/') and meta.get('link') and meta.get('resolved') in lock_packages:
+            top_level[_installed_name(path)] = meta['resolved']
+    return Lockfile(lock_packages, dependencies, {}, top_level)
+
+
+def _yarn_value(value: str) -> str:
+    value = value.strip()
+    return value[1:-1] if len(value) > 1 and value[0] == '"' and value[-1] == '"' else value
+
+
+def _yarn_descriptor_name(descriptor: str) -> tuple:
+    '''
+    (name, range) of name@range, scoped names start with @
+    '''
+    i = descriptor.index('@', 1)
+    return (descriptor[:i], descriptor[i+1:])
+
+
+def parse_yarn_lock(text: str) -> Lockfile:
+    '''
+    yarn.lock of yarn classic (v1) and berry (2+), every entry is listed under the
+    descriptors (name@range) that resolve to it
+    '''
+    entries = [] # (descriptors, version, [(dependency name, constraint)])
+    section = None
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        line = line.strip()
+        if indent == 0:
+            # classic quotes every descriptor, berry the whole list
+            descriptors = [d.strip().strip('"') for d in line.rstrip(':').split(',')]
+            entries.append(([d for d in descriptors if '@' in d[1:]], None, []))
+            section = None
+            continue
+        if not entries:
+            continue
+        match = _YARN_ENTRY.match(line)
+        if indent <= 2:
+            section = line.rstrip(':') if line.endswith(':') and match is None else None
+            if match is not None and _yarn_value(match.group(1)) == 'version':
+                entries[-1] = (entries[-1][0], _yarn_value(match.group(2)), entries[-1][2])
+        elif section in _DEPENDENCY_FIELDS and match is not None:
+            entries[-1][2].append((_yarn_value(match.group(1)), _yarn_value(match.group(2))))
+
+    packages, descriptors, top_level = {}, {}, {}
+    for key, (entry_descriptors, version, deps) in enumerate(entries):
+        if not entry_descriptors or version is None:
+            continue # __metadata
+        name, constraint = _yarn_descriptor_name(entry_descriptors[0])
+        if constraint.startswith('workspace:'):
+            continue # the application and its workspaces
+        if constraint.startswith('npm:') and '@' in constraint[5:]:
+            # alias, npm:<name>@<range>
+            name = constraint[4:constraint.rindex('@')]
+        packages[key] = (name, version)
+        for d in entry_descriptors:
+            d_name, d_constraint = _yarn_descriptor_name(d)
+            descriptors[_descriptor(d_name, d_constraint)] = key
+            top_level.setdefault(d_name, key)
+    dependencies = {}
+    for key in packages:
+        deps = []
+        for name, constraint in entries[key][2]:
+            dep_key = descriptors.get(_descriptor(name, constraint))
+            if dep_key is not None:
+                deps.append((name, constraint, dep_key))
+        dependencies[key] = deps
+    return Lockfile(packages, dependencies, descriptors, top_level)
+
+
+def parse_lockfile(filename: str, text: str) -> Lockfile:
+    '''
+    yarn.lock if the file name ends with .lock, package-lock.json otherwise
+    '''
+    if filename.endswith('.lock'):
+        return parse_yarn_lock(text)
+    return parse_package_lock(json.loads(text))
+
+
+def read_lockfile(filepath: str) -> Lockfile:
+    with open(filepath, 'r', encoding='utf-8') as lfile:
+        lock = parse_lockfile(os.path.basename(filepath), lfile.read())
+    print('read {:,} packages from {}'.format(lock.number_of_packages(), filepath))
+    return lock
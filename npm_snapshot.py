@@ -0,0 +1,452 @@
+'''
+binary memory-mappable snapshot of the NPM dependency graph
+
+layout (little-endian):
+    magic            8 bytes   b'REMSNAP\\0'
+    format version   uint32
+    header length    uint32
+    header           json, describes the database fingerprint and every section
+    sections         8-byte aligned numpy arrays
+
+sections:
+    name_offsets/name_data              interned package names, sorted by utf-8 bytes
+    version_offsets/version_data        latest version per package
+    known                               bit array, set if the package has a row in the packages table
+    deprecated                          bit array, set if the package is deprecated
+    final/popularity/quality/maintenance  float32 scores, NaN if missing
+    min_final/min_popularity/...        float32 subtree minimums (see subtree_minimums), NaN if missing
+    indptr/indices                      CSR adjacency (package -> dependency)
+    edge_constraint                     index into the constraint string pool
+    constraint_offsets/constraint_data  interned dependency constraints
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import json
+import os
+import struct
+import numpy as np
+
+SNAPSHOT_MAGIC = b'REMSNAP\x00'
+SNAPSHOT_VERSION = 3
+SCORE_KEYS = ['final', 'popularity', 'quality', 'maintenance']
+MINIMUM_KEYS = ['min_'+k for k in SCORE_KEYS]
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGN = 8
+
+
+def db_fingerprint(db_path: str) -> dict:
+    '''
+    size and modification time of the database the snapshot was built from
+    '''
+    st = os.stat(db_path)
+    return {'db_size': st.st_size, 'db_mtime': int(st.st_mtime)}
+
+
+def _string_table(strings: list) -> tuple:
+    '''
+    pack a list of strings into (offsets: int64, data: uint8)
+    '''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    if encoded:
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, data
+
+
+def _bit_array(flags: np.ndarray) -> np.ndarray:
+    '''
+    pack one flag per node into bits, node i is bit i % 8 of byte i // 8
+    '''
+    return np.packbits(np.asarray(flags, dtype=bool), bitorder='little')
+
+
+class NPMSnapshot:
+    '''
+    read-only view over a snapshot, every array is backed by the memory-mapped file
+    (or by in-memory arrays when created with NPMSnapshot.from_rows)
+    '''
+
+    def __init__(self, arrays: dict, header: dict):
+        self.header = header
+        self.name_offsets = arrays['name_offsets']
+        self.name_data = arrays['name_data']
+        self.version_offsets = arrays['version_offsets']
+        self.version_data = arrays['version_data']
+        self.known = arrays['known']
+        self.deprecated = arrays['deprecated']
+        self.scores = {k: arrays[k] for k in SCORE_KEYS}
+        self.minimums = {k: arrays[k] for k in MINIMUM_KEYS}
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.edge_constraint = arrays['edge_constraint']
+        self.constraint_offsets = arrays['constraint_offsets']
+        self.constraint_data = arrays['constraint_data']
+        self._constraint_cache = {}
+
+    @classmethod
+    def from_rows(cls, node_list: list, dep_rel_list: list, fingerprint: dict = None):
+        '''
+        build a snapshot in memory from the rows used by utils.create_graph
+        node_list: (name, latest, deprecated, final, popularity, quality, maintenance[, min_final, 
+            min_popularity, min_quality, min_maintenance])
+        dep_rel_list: (project_name, project_ver, depend_name, depend_constraints)
+        '''
+        # last row wins, same as repeated add_node calls
+        meta = {}
+        minimums = False
+        for row in node_list:
+            meta[row[0]] = row
+            minimums = minimums or len(row) > 7
+        names = set(meta)
+        for name, ver, dep_name, dep_cons in dep_rel_list:
+            names.add(name)
+            names.add(dep_name)
+        names = sorted(names, key=lambda s: s.encode('utf-8'))
+        ids = {name: i for i, name in enumerate(names)}
+        n = len(names)
+
+        known = np.zeros(n, dtype=np.uint8)
+        deprecated = np.zeros(n, dtype=np.uint8)
+        scores = {k: np.full(n, np.nan, dtype=np.float32) for k in SCORE_KEYS + MINIMUM_KEYS}
+        versions = [''] * n
+        for name, row in meta.items():
+            i = ids[name]
+            latest, dep_flag = row[1], row[2]
+            known[i] = 1
+            deprecated[i] = 1 if dep_flag == 1 else 0
+            versions[i] = latest if latest else ''
+            for k, val in zip(SCORE_KEYS + MINIMUM_KEYS, row[3:11]):
+                if val is not None:
+                    scores[k][i] = round(val, 2)
+
+        # edges, duplicated (u, v) pairs keep the last constraint like nx.DiGraph.add_edge
+        pool = {}
+        m = len(dep_rel_list)
+        src = np.empty(m, dtype=np.int64)
+        dst = np.empty(m, dtype=np.int64)
+        cons = np.empty(m, dtype=np.int32)
+        for j, (name, ver, dep_name, dep_cons) in enumerate(dep_rel_list):
+            src[j] = ids[name]
+            dst[j] = ids[dep_name]
+            cons[j] = pool.setdefault(dep_cons, len(pool))
+        order = np.lexsort((dst, src)) # stable
+        src, dst, cons = src[order], dst[order], cons[order]
+        if m > 0:
+            last = np.ones(m, dtype=bool)
+            last[:-1] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+            src, dst, cons = src[last], dst[last], cons[last]
+        indptr = np.zeros(n+1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        constraints = [None] * len(pool)
+        for s, i in pool.items():
+            constraints[i] = s
+        # None constraints are stored as an empty string with a negative index
+        none_id = pool.get(None)
+        if none_id is not None:
+            constraints[none_id] = ''
+            cons = np.where(cons == none_id, -1, cons).astype(np.int32)
+
+        arrays = {}
+        arrays['name_offsets'], arrays['name_data'] = _string_table(names)
+        arrays['version_offsets'], arrays['version_data'] = _string_table(versions)
+        arrays['known'] = _bit_array(known)
+        arrays['deprecated'] = _bit_array(deprecated)
+        arrays.update(scores)
+        arrays['indptr'] = indptr
+        arrays['indices'] = dst.astype(np.int32)
+        arrays['edge_constraint'] = cons
+        arrays['constraint_offsets'], arrays['constraint_data'] = _string_table(constraints)
+        header = dict(fingerprint or {})
+        header['num_nodes'] = n
+        header['num_edges'] = int(len(dst))
+        # rows without subtree minimums (older json graphs) leave the min_* attributes out
+        header['minimums'] = minimums
+        return cls(arrays, header)
+
+    @classmethod
+    def from_node_link(cls, data: dict):
+        '''
+        build a snapshot in memory from the node_link_data of a utils.create_graph graph
+        (the npm_graph.json of the json backend), no networkx graph is created
+        '''
+        node_list = []
+        for meta in data['nodes']:
+            if 'type' not in meta:
+                continue # only referenced as a dependency
+            row = (meta['id'], meta.get('version'), 1 if meta.get('deprecated') else 0) \
+                + tuple(meta.get(k) for k in SCORE_KEYS)
+            if all(k in meta for k in MINIMUM_KEYS):
+                row += tuple(meta[k] for k in MINIMUM_KEYS)
+            node_list.append(row)
+        # networkx writes the edges as 'links' before 3.4 and as 'edges' after
+        links = data['links'] if 'links' in data else data['edges']
+        dep_rel_list = [(e['source'], None, e['target'], e.get('dep_constraint')) for e in links]
+        return cls.from_rows(node_list, dep_rel_list)
+
+    ''' size '''
+    def number_of_nodes(self) -> int:
+        return len(self.name_offsets) - 1
+
+    def number_of_edges(self) -> int:
+        return len(self.indices)
+
+    ''' interned strings '''
+    def name(self, i: int) -> str:
+        return bytes(self.name_data[self.name_offsets[i]:self.name_offsets[i+1]]).decode('utf-8')
+
+    def node_id(self, name: str) -> int:
+        '''
+        binary search over the sorted name table, -1 if not found
+        '''
+        key = name.encode('utf-8')
+        lo, hi = 0, self.number_of_nodes()
+        offs, data = self.name_offsets, self.name_data
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = bytes(data[offs[mid]:offs[mid+1]])
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    ''' flags '''
+    def is_known(self, i: int) -> bool:
+        return bool(self.known[i >> 3] >> (i & 7) & 1)
+
+    def is_deprecated(self, i: int) -> bool:
+        return bool(self.deprecated[i >> 3] >> (i & 7) & 1)
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.node_id(name) >= 0
+
+    def constraint(self, c: int):
+        if c < 0:
+            return None
+        if c not in self._constraint_cache:
+            s, e = self.constraint_offsets[c], self.constraint_offsets[c+1]
+            self._constraint_cache[c] = bytes(self.constraint_data[s:e]).decode('utf-8')
+        return self._constraint_cache[c]
+
+    ''' attributes, same shape as utils.create_graph node/edge dicts '''
+    def node_attributes(self, i: int) -> dict:
+        if not self.is_known(i):
+            return {}
+        s, e = self.version_offsets[i], self.version_offsets[i+1]
+        version = bytes(self.version_data[s:e]).decode('utf-8') if e > s else None
+        meta = {'version': version, 'deprecated': self.is_deprecated(i)}
+        for k in SCORE_KEYS:
+            val = float(self.scores[k][i])
+            meta[k] = None if val != val else round(val, 2)
+        if self.header.get('minimums', True):
+            for k in MINIMUM_KEYS:
+                val = float(self.minimums[k][i])
+                meta[k] = None if val != val else round(val, 2)
+        meta['type'] = 'NPM'
+        return meta
+
+    def successor_ids(self, i: int):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def successor_items(self, i: int):
+        '''
+        yields (dependency id, edge attributes)
+        '''
+        start, end = self.indptr[i], self.indptr[i+1]
+        for j in range(start, end):
+            yield int(self.indices[j]), {'dep_constraint': self.constraint(int(self.edge_constraint[j]))}
+
+    def to_networkx(self):
+        '''
+        materialise the snapshot as the networkx graph utils.create_graph would build
+        '''
+        import networkx as nx
+        G = nx.DiGraph()
+        names = [self.name(i) for i in range(self.number_of_nodes())]
+        for i, name in enumerate(names):
+            G.add_node(name, **self.node_attributes(i))
+        for i, name in enumerate(names):
+            for j, attrs in self.successor_items(i):
+                G.add_edge(name, names[j], **attrs)
+        return G
+
+
+def strongly_connected_components(indptr: np.ndarray, indices: np.ndarray) -> tuple:
+    '''
+    iterative Tarjan over a CSR graph
+    returns (component id of every node, number of components), components are numbered
+    in reverse topological order: a component only reaches components with smaller ids
+    '''
+    ptr = indptr.tolist()
+    adj = indices.tolist()
+    n = len(ptr) - 1
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    comp = [-1] * n
+    stack = []
+    counter = 0
+    num_comps = 0
+    for s in range(n):
+        if index[s] >= 0:
+            continue
+        index[s] = low[s] = counter
+        counter += 1
+        stack.append(s)
+        on_stack[s] = True
+        work = [(s, ptr[s])]
+        while work:
+            v, i = work[-1]
+            end = ptr[v+1]
+            while i < end:
+                w = adj[i]
+                i += 1
+                if index[w] < 0:
+                    work[-1] = (v, i)
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, ptr[w]))
+                    break
+                if on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        comp[w] = num_comps
+                        if w == v:
+                            break
+                    num_comps += 1
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+    return (np.array(comp, dtype=np.int64), num_comps)
+
+
+def subtree_minimums(indptr: np.ndarray, indices: np.ndarray, scores: dict) -> dict:
+    '''
+    minimum score reachable from every node (the node included) for every key of scores,
+    same as rem_filter.subgraph_minimums over the whole graph: missing or zero scores are 
+    ignored and nodes without a score have no minimum (NaN)
+    packages of a cycle reach the same packages, the minimums are propagated over the 
+    condensation in one pass
+    '''
+    comp, num_comps = strongly_connected_components(indptr, indices)
+    keys = list(scores)
+    vals = np.stack([np.asarray(scores[k], dtype=np.float64) for k in keys], axis=1)
+    valid = (vals == vals) & (vals != 0)
+    reach = np.full((num_comps, len(keys)), np.inf)
+    np.minimum.at(reach, comp, np.where(valid, vals, np.inf))
+    # condensation edges in CSR form
+    src = np.repeat(np.arange(len(comp)), np.diff(indptr))
+    cu, cv = comp[src], comp[np.asarray(indices, dtype=np.int64)]
+    keep = cu != cv
+    pairs = np.unique(cu[keep] * num_comps + cv[keep])
+    cu, cv = pairs // num_comps, pairs % num_comps
+    cptr = np.zeros(num_comps+1, dtype=np.int64)
+    np.cumsum(np.bincount(cu, minlength=num_comps), out=cptr[1:])
+    # successors have smaller ids, they are final when a component is reached
+    for c in np.flatnonzero(cptr[1:] > cptr[:-1]).tolist():
+        np.minimum(reach[c], reach[cv[cptr[c]:cptr[c+1]]].min(axis=0), out=reach[c])
+    minimum = reach[comp]
+    minimum[~valid] = np.nan
+    return {k: minimum[:, j] for j, k in enumerate(keys)}
+
+
+def write_snapshot(snap: NPMSnapshot, filepath: str):
+    '''
+    serialise the snapshot, the file is written next to the target and renamed
+    so that readers never see a partially written snapshot
+    '''
+    arrays = {
+        'name_offsets': snap.name_offsets, 'name_data': snap.name_data,
+        'version_offsets': snap.version_offsets, 'version_data': snap.version_data,
+        'known': snap.known, 'deprecated': snap.deprecated,
+        'indptr': snap.indptr, 'indices': snap.indices, 'edge_constraint': snap.edge_constraint,
+        'constraint_offsets': snap.constraint_offsets, 'constraint_data': snap.constraint_data,
+    }
+    arrays.update(snap.scores)
+    arrays.update(snap.minimums)
+    # section offsets are relative to the end of the header
+    sections = {}
+    offset = 0
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        arrays[key] = arr
+        sections[key] = [arr.dtype.str, offset, int(arr.size)]
+        offset += arr.nbytes
+        offset += (-offset) % _ALIGN
+    header = dict(snap.header)
+    header['sections'] = sections
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * ((-(_PREAMBLE.size + len(header_bytes))) % _ALIGN)
+
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, 'wb') as sfile:
+        sfile.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header_bytes)))
+        sfile.write(header_bytes)
+        for key, arr in arrays.items():
+            sfile.write(arr.tobytes())
+            sfile.write(b'\0' * ((-arr.nbytes) % _ALIGN))
+    os.replace(tmp_path, filepath)
+    print(f'snapshot file stored at {filepath}')
+
+
+def read_snapshot_header(filepath: str):
+    '''
+    returns the header dict, or None if the file is not a snapshot of the current format version
+    '''
+    with open(filepath, 'rb') as sfile:
+        preamble = sfile.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            return None
+        magic, version, header_len = _PREAMBLE.unpack(preamble)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None
+        header = json.loads(sfile.read(header_len).decode('utf-8'))
+    header['data_offset'] = _PREAMBLE.size + header_len
+    return header
+
+
+def is_snapshot_stale(filepath: str, db_path: str) -> bool:
+    '''
+    a snapshot is stale if it is missing, has another format version,
+    or was built from a different database file
+    '''
+    if not os.path.isfile(filepath):
+        return True
+    header = read_snapshot_header(filepath)
+    if header is None:
+        return True
+    if not os.path.isfile(db_path):
+        return False # nothing to rebuild from, keep using it
+    fingerprint = db_fingerprint(db_path)
+    return any(header.get(k) != v for k, v in fingerprint.items())
+
+
+def read_snapshot(filepath: str) -> NPMSnapshot:
+    '''
+    memory-map a snapshot file, pages are loaded lazily and shared between processes
+    '''
+    header = read_snapshot_header(filepath)
+    if header is None:
+        raise ValueError(f'{filepath} is not a REM snapshot (version {SNAPSHOT_VERSION})')
+    buf = np.memmap(filepath, dtype=np.uint8, mode='r')
+    base = header['data_offset']
+    arrays = {}
+    for key, (dtype, offset, count) in header['sections'].items():
+        dt = np.dtype(dtype)
+        start = base + offset
+        arrays[key] = buf[start:start + count * dt.itemsize].view(dt)
+    print(f'read from {filepath}')
+    return NPMSnapshot(arrays, header)
@@ -0,0 +1,185 @@
+'''
+out-of-core access to the NPM dependency database
+
+instead of loading the whole NPM graph, the transitive closure of an application's
+direct dependencies is resolved with a recursive CTE against NPMDB, and only the
+reachable packages and their dependency relationships are read.
+
+the minimum metric reachable from every package (its subtree minimum) is a property
+of the NPM graph, it is computed once per database into the subtree_minimums table
+and read with the package metadata.
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import os
+import sqlite3
+from npm_snapshot import NPMSnapshot, SCORE_KEYS, subtree_minimums
+
+CLOSURE_QUERY = '''
+    WITH RECURSIVE closure(name) AS (
+        SELECT name FROM temp.closure_roots
+        UNION
+        SELECT d.depend_name FROM depend AS d
+        JOIN closure AS c ON d.project_name = c.name
+    )
+    INSERT INTO temp.closure_names SELECT name FROM closure;
+'''
+
+
+def create_indexes(conn: sqlite3.Connection):
+    '''
+    lookups by package name, created after the bulk load
+    '''
+    dncur = conn.cursor()
+    dncur.execute(''' CREATE INDEX IF NOT EXISTS depend_project_name ON depend(project_name); ''')
+    dncur.execute(''' CREATE INDEX IF NOT EXISTS scores_name ON scores(name); ''')
+    conn.commit()
+
+
+def has_subtree_minimums(conn: sqlite3.Connection) -> bool:
+    row = conn.execute(''' SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='subtree_minimums'; ''').fetchone()
+    return row[0] > 0
+
+
+def drop_subtree_minimums(conn: sqlite3.Connection):
+    '''
+    the table is stale once packages, dependencies or scores change
+    '''
+    conn.execute(''' DROP TABLE IF EXISTS subtree_minimums; ''')
+    conn.commit()
+
+
+def update_subtree_minimums(conn: sqlite3.Connection) -> int:
+    '''
+    (re)compute the subtree minimum of every scored package for every metric
+    returns the number of rows
+    '''
+    print('computing subtree minimums..', end='')
+    c = conn.cursor()
+    c.execute(
+        '''
+        SELECT n.name, n.latest, n.deprecated,
+        s.final, s.popularity, s.quality, s.maintenance
+        FROM packages AS n
+        LEFT JOIN scores AS s
+        USING (name);
+        '''
+    )
+    node_rows = c.fetchall()
+    c.execute(''' SELECT * FROM depend; ''')
+    snap = NPMSnapshot.from_rows(node_rows, c.fetchall())
+    minimum = subtree_minimums(snap.indptr, snap.indices, snap.scores)
+    c.execute(''' DROP TABLE IF EXISTS subtree_minimums; ''')
+    c.execute(
+        '''
+        CREATE TABLE subtree_minimums (
+            name text PRIMARY KEY,
+            final real,
+            popularity real,
+            quality real,
+            maintenance real
+        );
+        '''
+    )
+    rows = []
+    for i in range(snap.number_of_nodes()):
+        values = [float(minimum[k][i]) for k in SCORE_KEYS]
+        if all(v != v for v in values):
+            continue # no scores
+        rows.append([snap.name(i)] + [None if v != v else round(v, 2) for v in values])
+    c.executemany(''' INSERT INTO subtree_minimums VALUES (?,?,?,?,?); ''', rows)
+    conn.commit()
+    print('done. [{:,}]'.format(len(rows)))
+    return len(rows)
+
+
+class NPMDatabase:
+    '''
+    read-only NPM graph backed by NPMDB, memory is proportional to the queried closures
+    a connection is opened lazily in every process, so instances can be shared with forked workers
+    '''
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            uri = 'file:{}?mode=ro'.format(os.path.abspath(self.db_path))
+            self._conn = sqlite3.connect(uri, uri=True)
+            self._conn.execute(''' CREATE TEMP TABLE IF NOT EXISTS closure_roots (name text PRIMARY KEY); ''')
+            self._conn.execute(''' CREATE TEMP TABLE IF NOT EXISTS closure_names (name text PRIMARY KEY); ''')
+            self._pid = os.getpid()
+        return self._conn
+
+    ''' size '''
+    def number_of_nodes(self) -> int:
+        '''
+        number of packages, names only referenced as dependencies are not counted
+        '''
+        return self.connection().execute(''' SELECT COUNT(*) FROM packages; ''').fetchone()[0]
+
+    def number_of_edges(self) -> int:
+        return self.connection().execute(''' SELECT COUNT(*) FROM depend; ''').fetchone()[0]
+
+    def closure_rows(self, names) -> tuple:
+        '''
+        rows of the packages reachable from names (names included), in the format of
+        utils.fetch_npm_rows: (package metadata rows, dependency relationship rows)
+        '''
+        conn = self.connection()
+        c = conn.cursor()
+        c.execute(''' DELETE FROM temp.closure_roots; ''')
+        c.execute(''' DELETE FROM temp.closure_names; ''')
+        c.executemany(''' INSERT OR IGNORE INTO temp.closure_roots VALUES (?); ''', [(str(n),) for n in names])
+        c.execute(CLOSURE_QUERY)
+        c.execute(
+            '''
+            SELECT n.name, n.latest, n.deprecated,
+            s.final, s.popularity, s.quality, s.maintenance,
+            m.final, m.popularity, m.quality, m.maintenance
+            FROM temp.closure_names AS r
+            JOIN packages AS n ON n.name = r.name
+            LEFT JOIN scores AS s ON s.name = n.name
+            LEFT JOIN subtree_minimums AS m ON m.name = n.name
+            ORDER BY n.rowid;
+            '''
+        )
+        node_rows = c.fetchall()
+        c.execute(
+            '''
+            SELECT d.project_name, d.project_ver, d.depend_name, d.depend_constraints
+            FROM temp.closure_names AS r
+            JOIN depend AS d ON d.project_name = r.name
+            ORDER BY d.rowid;
+            '''
+        )
+        dep_rows = c.fetchall()
+        conn.rollback()
+        return (node_rows, dep_rows)
+
+    def package_rows(self, names) -> list:
+        '''
+        metadata rows of the packages in names (without subtree minimums), in the format of 
+        utils.fetch_npm_rows, dependencies are not read
+        '''
+        conn = self.connection()
+        c = conn.cursor()
+        c.execute(''' DELETE FROM temp.closure_names; ''')
+        c.executemany(''' INSERT OR IGNORE INTO temp.closure_names VALUES (?); ''', [(str(n),) for n in names])
+        c.execute(
+            '''
+            SELECT n.name, n.latest, n.deprecated,
+            s.final, s.popularity, s.quality, s.maintenance
+            FROM temp.closure_names AS r
+            JOIN packages AS n ON n.name = r.name
+            LEFT JOIN scores AS s ON s.name = n.name
+            ORDER BY n.rowid;
+            '''
+        )
+        node_rows = c.fetchall()
+        conn.rollback()
+        return node_rows
+
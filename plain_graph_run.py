@@ -1,4 +1,5 @@
 from rem_graphics import plain_plotly_graph_to_html
+from rem_layout import graph_layout
 import networkx as nx # DiGraph
 import sys
 
@@ -20,5 +21,5 @@ def draw_plain_dependency_graph(G: nx.Graph, pname: str, outfile: str):
             project_dev_sub_G.add_node(v, **G.nodes()[v])
             project_dev_sub_G.add_edge(u,v, **m)
     project_sub_G = nx.compose(project_rt_sub_G, project_dev_sub_G)
-    pos = nx.nx_pydot.graphviz_layout(project_sub_G, prog='dot', root=pname)
+    pos = graph_layout(project_sub_G, root=pname, prog='dot')
     plain_plotly_graph_to_html(G=G, pname=pname, pos=pos, title=f'{pname} dependency graph', outfile=outfile)
\ No newline at end of file
@@ -9,8 +9,20 @@ with packages info, dependency relationships, and npms.io scores
 import sys # args
 import sqlite3 # connection
 import json # dump
+import multiprocessing # docs parsing pool
+import os # cpu_count
+import random # backoff jitter
 import requests
-from utils import is_valid_key
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
+from utils import is_valid_key, pop_flag, pop_option
+from npm_sqlite import create_indexes, drop_subtree_minimums, update_subtree_minimums
+from rem_profile import enable_profile, stage
+from configs import NPMDB, NPMJSON, NPMSNAPSHOT, NPM_REGISTRY_URL, SCORES_MAX_INFLIGHT, SCORES_RATE_LIMIT, SCORES_MAX_RETRIES, \
+    SCORES_TIMEOUT, SCORES_CHECKPOINT, INGEST_WORKERS, INGEST_CHUNK_SIZE, INGEST_COMMIT_DOCS
 
 
 def beautify_json(data:dict) -> str:
@@ -72,14 +84,181 @@ def create_tables(conn: sqlite3.Connection):
         '''
     )
     print('scores table created')
+    dncur.execute(''' DROP TABLE IF EXISTS meta; ''')
+    dncur.execute(''' DROP TABLE IF EXISTS stale_scores; ''')
+    dncur.execute(''' DROP TABLE IF EXISTS subtree_minimums; ''')
+    create_refresh_tables(conn)
     return conn.commit()
 
 
-def update_packages_table(doc_file: str, conn: sqlite3.Connection) -> int:
+def create_refresh_tables(conn: sqlite3.Connection):
     '''
-    packages table stores the metadata extracted from NPM replicate registry
+    tables used by the incremental refresh, created on demand for older databases
+    meta - key/value state, e.g. the registry update_seq the database is synchronised to
+    stale_scores - packages that changed since their scores were fetched
     '''
     dncur = conn.cursor()
+    dncur.execute(''' CREATE TABLE IF NOT EXISTS meta (key text PRIMARY KEY, value text); ''')
+    dncur.execute(''' CREATE TABLE IF NOT EXISTS stale_scores (name text PRIMARY KEY); ''')
+
+
+def get_meta(conn: sqlite3.Connection, key: str):
+    row = conn.execute(''' SELECT value FROM meta WHERE key = ?; ''', (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value):
+    conn.execute(''' INSERT OR REPLACE INTO meta VALUES (?, ?); ''', (key, str(value)))
+
+
+def parse_registry_doc(line: str) -> tuple:
+    '''
+    parse one row of the registry dump, see registry_doc_rows
+    '''
+    return registry_doc_rows(json.loads(line))
+
+
+def registry_doc_rows(rawdata: dict) -> tuple:
+    '''
+    rows of a registry dump row or changes feed entry ({key|id, doc})
+    returns (package row in packages table column order, dependency rows of its latest version),
+    (None, []) if the row has no doc
+    '''
+    # package to be inserted
+    package = {
+        "name": None,
+        "latest": None,
+        "author": None,
+        "authoremail": None,
+        "maintainers": None,
+        "versions": None,
+        "repotype": None,
+        "repourl": None,
+        "homepage": None,
+        "license": None,
+        "deprecated": 0,
+        "deprecatemessage": None
+    }
+    dep_rows = []
+    if not is_valid_key(rawdata, 'doc'):
+        return (None, dep_rows)
+    docdata = rawdata['doc'] # fetched doc data
+    # package name
+    if is_valid_key(docdata, 'name'):
+        package['name'] = str(docdata['name'])
+    else:
+        package['name'] = str(rawdata['key'] if 'key' in rawdata else rawdata['id'])
+    # latest in dist-tags
+    if is_valid_key(docdata, 'dist-tags') and is_valid_key(docdata['dist-tags'], 'latest'):
+        package['latest'] = str(docdata['dist-tags']['latest'])
+    # author and author email
+    if is_valid_key(docdata, 'author') and type(docdata['author']) is not str:
+        packageAuthor = docdata['author']
+        if is_valid_key(packageAuthor, 'name'):
+            package['author'] = str(packageAuthor['name'])
+        if is_valid_key(packageAuthor, 'email'):
+            package['authoremail'] = str(packageAuthor['email'])
+    elif is_valid_key(docdata, 'author') and type(docdata['author']) is str:
+        package['author'] = str(docdata['author'])
+    # maintainers: list of people who created this package
+    if is_valid_key(docdata, 'maintainers'):
+        package['maintainers'] = str(docdata['maintainers'])
+    # versions: only the dependency list of latest version
+    # Alternative: list of all published versions (requires larger space)
+    if is_valid_key(docdata, 'versions'):
+        versions = docdata['versions']
+        if is_valid_key(versions, package['latest']):
+            package_json = versions[package['latest']]
+        else:
+            # retrieve the last metadata from the versions
+            package_json = versions[list(versions.keys())[-1]]
+        if is_valid_key(package_json, 'dependencies'):
+            package['versions'] = json.dumps(package_json['dependencies'])
+            # dependency relationships, see update_depend_table
+            for k, v in package_json['dependencies'].items():
+                dep_rows.append((package['name'], package['latest'], str(k), str(v)))
+    # repo type and url
+    if is_valid_key(docdata, 'repository') and type(docdata['repository']) is not str:
+        repo = docdata['repository']
+        if is_valid_key(repo, 'type'):
+            package['repotype'] = str(repo['type'])
+        if is_valid_key(repo, 'url'):
+            package['repourl'] = str(repo['url'])
+    elif is_valid_key(docdata, 'repository') and type(docdata['repository']) is str:
+        package['repourl'] = str(docdata['repository'])
+    # homepage
+    if is_valid_key(docdata, 'homepage'):
+        package['homepage'] = str(docdata['homepage'])
+    # license(s)
+    if is_valid_key(docdata, 'license'):
+        package['license'] = str(docdata['license'])
+    # deprecate state: 0: False, 1: True
+    if is_valid_key(docdata, 'versions'):
+        latestdata = docdata['versions'][list(docdata['versions'].keys())[-1]]
+        if is_valid_key(latestdata, 'deprecated'):
+            package['deprecated'] = 1
+            package['deprecatemessage'] = str(latestdata['deprecated'])
+    return (list(package.values()), dep_rows)
+
+
+def parse_registry_chunk(lines: list) -> tuple:
+    '''
+    runs in a worker: returns (package rows, dependency rows) of a chunk of dump rows
+    '''
+    package_rows = []
+    dep_rows = []
+    for line in lines:
+        package, deps = parse_registry_doc(line)
+        if package is not None:
+            package_rows.append(package)
+            dep_rows.extend(deps)
+    return (package_rows, dep_rows)
+
+
+def read_registry_chunks(infile, chunk_size: int):
+    '''
+    yields the document rows of a CouchDB _all_docs dump in chunks of chunk_size lines,
+    the first yielded value is the header of the dump (total_rows, optional update_seq)
+    '''
+    index = 0
+    total_num = 0
+    chunk = []
+    for line in infile:
+        index += 1
+        # total number of packages from first line
+        if index == 1:
+            header = json.loads(line[:-10]+'}')
+            total_num = header['total_rows']
+            yield header
+            continue
+        # line limiter
+        if index > total_num+1:
+            break
+        # trim
+        if index < total_num+1:
+            line = line[:-2]
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def update_packages_and_depend_tables(doc_file: str, conn: sqlite3.Connection, workers: int = INGEST_WORKERS,
+    chunk_size: int = INGEST_CHUNK_SIZE, commit_docs: int = INGEST_COMMIT_DOCS) -> tuple:
+    '''
+    packages and depend tables from the NPM replicate registry dump in a single pass
+    docs are parsed by a process pool in chunks, rows are written in order with executemany
+    and committed every <commit_docs> docs, with WAL and synchronous=OFF during the bulk load
+    returns (number of packages, number of dependency relationships)
+    '''
+    workers = workers if workers else os.cpu_count()
+    dncur = conn.cursor()
+    synchronous = dncur.execute(''' PRAGMA synchronous; ''').fetchone()[0]
+    journal_mode = dncur.execute(''' PRAGMA journal_mode; ''').fetchone()[0]
+    dncur.execute(''' PRAGMA journal_mode=WAL; ''')
+    dncur.execute(''' PRAGMA synchronous=OFF; ''')
     insert_query = ''' 
     INSERT INTO 
     packages(name, latest, author, authoremail, maintainers, 
@@ -87,97 +266,188 @@ def update_packages_table(doc_file: str, conn: sqlite3.Connection) -> int:
     deprecatemessage) 
     VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '''
 
-    index = 0
-    total_num = 0
-    with open(doc_file, 'r', encoding='utf-8') as infile:
-        for line in infile:
-            index += 1
-            # total number of packages from first line
-            if index == 1:
-                total_num = json.loads(line[:-10]+'}')['total_rows']
-                continue
-            # line limiter
-            if index > total_num+1:
+    num_docs = 0
+    num_packages = 0
+    num_deps = 0
+    uncommitted = 0
+    start = time.monotonic()
+    with open(doc_file, 'r', encoding='utf-8') as infile, multiprocessing.Pool(processes=workers) as pool:
+        chunks = read_registry_chunks(infile, chunk_size)
+        header = next(chunks, {})
+        total_num = header.get('total_rows', 0)
+        # dumps requested with update_seq=true tell where the changes feed continues
+        if 'update_seq' in header:
+            set_meta(conn, 'update_seq', header['update_seq'])
+        # results are consumed in submission order, at most 2 chunks per worker are in flight
+        in_flight = deque()
+        while True:
+            for chunk in chunks:
+                in_flight.append((len(chunk), pool.apply_async(parse_registry_chunk, (chunk,))))
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
                 break
-            # trim
-            if index < total_num+1:
-                line = line[:-2]
-            # package to be inserted
-            package = {
-                "name": None,
-                "latest": None,
-                "author": None,
-                "authoremail": None,
-                "maintainers": None,
-                "versions": None,
-                "repotype": None,
-                "repourl": None,
-                "homepage": None,
-                "license": None,
-                "deprecated": 0,
-                "deprecatemessage": None
-            }
-            rawdata = json.loads(line)
-            print("updating NPM packages metadata [{}/{}]".format(index-1, total_num), end='\r')
-            if is_valid_key(rawdata, 'doc'):
-                docdata = rawdata['doc'] # fetched doc data
-                # print(beautifyJson(docdata))
-                # package name
-                if is_valid_key(docdata, 'name'):
-                    package['name'] = str(docdata['name'])
+            num_lines, result = in_flight.popleft()
+            package_rows, dep_rows = result.get()
+            dncur.executemany(insert_query, package_rows)
+            dncur.executemany(''' INSERT INTO depend VALUES (?, ?, ?, ?); ''', dep_rows)
+            num_docs += num_lines
+            num_packages += len(package_rows)
+            num_deps += len(dep_rows)
+            uncommitted += num_lines
+            if uncommitted >= commit_docs:
+                conn.commit()
+                uncommitted = 0
+            print("updating NPM packages and dependency relationships [{}/{}] [{:.0f} docs/s]"
+                .format(num_docs, total_num, num_docs / max(time.monotonic() - start, 1e-9)), end='\r')
+    conn.commit()
+    dncur.execute(''' PRAGMA synchronous={}; '''.format(int(synchronous)))
+    dncur.execute(''' PRAGMA journal_mode={}; '''.format(journal_mode))
+    print()
+    elapsed = time.monotonic() - start
+    print('parsed {:,} docs in {:.1f}s [{:.0f} docs/s, {} workers]'
+        .format(num_docs, elapsed, num_docs / max(elapsed, 1e-9), workers))
+    return (num_packages, num_deps)
+
+
+def read_changes_feed(lines):
+    '''
+    yields the entries of a CouchDB _changes feed with include_docs=true, either the normal
+    feed ({"results": [...], "last_seq": ...}, one change per line or all on one line) or the
+    continuous feed (one json object per line), a {"last_seq": ...} entry marks the end
+    '''
+    for line in lines:
+        line = line.strip().rstrip(',')
+        if not line:
+            continue
+        try:
+            change = json.loads(line)
+        except ValueError:
+            if not line.startswith('"'):
+                continue # opening {"results":[ or closing ] of a normal feed
+            change = json.loads('{'+line) # "last_seq":...} of a normal feed
+        if 'results' in change:
+            yield from change['results']
+            if 'last_seq' in change:
+                yield {'last_seq': change['last_seq']}
+        else:
+            yield change
+
+
+def seq_number(seq) -> int:
+    '''
+    numeric prefix of a CouchDB sequence (1234 or "1234-g1AAAA..."), None if it has none
+    '''
+    try:
+        return int(str(seq).split('-')[0])
+    except ValueError:
+        return None
+
+
+def open_changes_feed(source: str, since):
+    '''
+    lines of a changes feed from a file or a http(s) endpoint, requested from <since>
+    '''
+    if source.startswith('http://') or source.startswith('https://'):
+        params = {'include_docs': 'true'}
+        if since is not None:
+            params['since'] = since
+        resp = requests.get(source, params=params, stream=True, timeout=SCORES_TIMEOUT)
+        resp.raise_for_status()
+        return resp.iter_lines(decode_unicode=True)
+    return open(source, 'r', encoding='utf-8')
+
+
+def update_tables_from_changes(source: str, conn: sqlite3.Connection, since=None,
+    commit_docs: int = INGEST_COMMIT_DOCS) -> tuple:
+    '''
+    incremental refresh from a registry changes feed, starting after <since>
+    (default: the update_seq stored in the meta table)
+    changed packages are upserted with their depend rows replaced and their scores marked
+    stale, deleted packages are removed. the sequence is stored with every commit so an
+    interrupted refresh continues from the last committed change
+    returns (number of upserted packages, number of deleted packages)
+    '''
+    create_refresh_tables(conn)
+    create_indexes(conn)
+    dncur = conn.cursor()
+    if since is None:
+        since = get_meta(conn, 'update_seq')
+    since_num = seq_number(since) if since is not None else None
+    insert_query = ''' 
+    INSERT OR REPLACE INTO 
+    packages(name, latest, author, authoremail, maintainers, 
+    versions, repotype, repourl, homepage, license, deprecated, 
+    deprecatemessage) 
+    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '''
+
+    num_changes = 0
+    num_updated = 0
+    num_deleted = 0
+    uncommitted = 0
+    last_seq = since
+    start = time.monotonic()
+    feed = open_changes_feed(source, since)
+    try:
+        for change in read_changes_feed(feed):
+            if 'id' not in change:
+                if 'last_seq' in change:
+                    last_seq = change['last_seq']
+                continue
+            seq = change.get('seq')
+            # file feeds are not filtered by the registry
+            if since_num is not None and seq_number(seq) is not None and seq_number(seq) <= since_num:
+                continue
+            num_changes += 1
+            name = str(change['id'])
+            if not name.startswith('_design/'):
+                package, dep_rows = (None, [])
+                if not change.get('deleted'):
+                    package, dep_rows = registry_doc_rows(change)
+                # a package's rows are keyed by its id, the doc name may differ
+                names = {(name,)} | ({(package[0],)} if package else set())
+                dncur.executemany(''' DELETE FROM depend WHERE project_name = ?; ''', names)
+                if package is None:
+                    dncur.executemany(''' DELETE FROM packages WHERE name = ?; ''', names)
+                    dncur.executemany(''' DELETE FROM scores WHERE name = ?; ''', names)
+                    dncur.executemany(''' DELETE FROM stale_scores WHERE name = ?; ''', names)
+                    num_deleted += 1
                 else:
-                    package['name'] = str(rawdata['key'])
-                # latest in dist-tags
-                if is_valid_key(docdata, 'dist-tags') and is_valid_key(docdata['dist-tags'], 'latest'):
-                    package['latest'] = str(docdata['dist-tags']['latest'])
-                # author and author email
-                if is_valid_key(docdata, 'author') and type(docdata['author']) is not str:
-                    packageAuthor = docdata['author']
-                    if is_valid_key(packageAuthor, 'name'):
-                        package['author'] = str(packageAuthor['name'])
-                    if is_valid_key(packageAuthor, 'email'):
-                        package['authoremail'] = str(packageAuthor['email'])
-                elif is_valid_key(docdata, 'author') and type(docdata['author']) is str:
-                    package['author'] = str(docdata['author'])
-                # maintainers: list of people who created this package
-                if is_valid_key(docdata, 'maintainers'):
-                    package['maintainers'] = str(docdata['maintainers'])
-                # versions: only the dependency list of latest version
-                # Alternative: list of all published versions (requires larger space)
-                if is_valid_key(docdata, 'versions'):
-                    versions = docdata['versions']
-                    if is_valid_key(versions, package['latest']):
-                        package_json = versions[package['latest']]
-                    else:
-                        # retrieve the last metadata from the versions
-                        package_json = versions[list(versions.keys())[-1]]
-                    if is_valid_key(package_json, 'dependencies'):
-                        package['versions'] = json.dumps(package_json['dependencies'])
-                # repo type and url
-                if is_valid_key(docdata, 'repository') and type(docdata['repository']) is not str:
-                    repo = docdata['repository']
-                    if is_valid_key(repo, 'type'):
-                        package['repotype'] = str(repo['type'])
-                    if is_valid_key(repo, 'url'):
-                        package['repourl'] = str(repo['url'])
-                elif is_valid_key(docdata, 'repository') and type(docdata['repository']) is str:
-                    package['repourl'] = str(docdata['repository'])
-                # homepage
-                if is_valid_key(docdata, 'homepage'):
-                    package['homepage'] = str(docdata['homepage'])
-                # license(s)
-                if is_valid_key(docdata, 'license'):
-                    package['license'] = str(docdata['license'])
-                # deprecate state: 0: False, 1: True
-                if is_valid_key(docdata, 'versions'):
-                    latestdata = docdata['versions'][list(docdata['versions'].keys())[-1]]
-                    if is_valid_key(latestdata, 'deprecated'):
-                        package['deprecated'] = 1
-                        package['deprecatemessage'] = str(latestdata['deprecated'])
-                # do insert
-                dncur.execute(insert_query, list(package.values()))
+                    dncur.execute(insert_query, package)
+                    dncur.executemany(''' INSERT INTO depend VALUES (?, ?, ?, ?); ''', dep_rows)
+                    dncur.execute(''' INSERT OR IGNORE INTO stale_scores VALUES (?); ''', (package[0],))
+                    num_updated += 1
+            if seq is not None:
+                last_seq = seq
+            uncommitted += 1
+            if uncommitted >= commit_docs:
+                set_meta(conn, 'update_seq', last_seq)
+                conn.commit()
+                uncommitted = 0
+            print("applying NPM registry changes [{}] [{:.0f} changes/s]"
+                .format(num_changes, num_changes / max(time.monotonic() - start, 1e-9)), end='\r')
+    finally:
+        if hasattr(feed, 'close'):
+            feed.close()
+    if last_seq is not None:
+        set_meta(conn, 'update_seq', last_seq)
+    conn.commit()
     print()
-    return total_num
+    print('{:,} changes: {:,} packages updated, {:,} deleted, now at sequence {}'
+        .format(num_changes, num_updated, num_deleted, last_seq))
+    return (num_updated, num_deleted)
+
+
+def invalidate_npm_graph(db_path: str):
+    '''
+    remove the npm graph json and snapshot derived from NPMDB, they are rebuilt on the next run
+    '''
+    if os.path.abspath(db_path) != os.path.abspath(NPMDB):
+        return
+    for derived in [NPMJSON, NPMSNAPSHOT]:
+        if os.path.isfile(derived):
+            os.remove(derived)
+            print(f'removed outdated {derived}')
 
 
 def update_depend_table(conn: sqlite3.Connection) -> int:
@@ -190,23 +460,22 @@ def update_depend_table(conn: sqlite3.Connection) -> int:
     project_name  project_version  depend_name  depend_constraint
     a             v                b            ~1.0.0
     a             v                c            ^1.0.0
+    update_packages_and_depend_tables fills both tables in one pass, this rebuilds
+    the depend table from an existing packages table
     '''
     dncur = conn.cursor()
     # get full list of package versions
     dncur.execute(''' SELECT name, latest, versions FROM packages; ''')
-    num_deps = 0
+    dep_rows = []
     for deps in dncur.fetchall():
         name, latest, version = deps
         if version:
             packagejson_dep = json.loads(version)
             for k, v in packagejson_dep.items():
-                num_deps += 1
-                k = str(k)
-                v = str(v)
-                dncur.execute(''' INSERT INTO depend VALUES (?, ?, ?, ?); ''', (name, latest, k, v))
-                print('updating NPM dependency relationships [{}]'.format(num_deps), end='\r')
-    print()
-    return num_deps
+                dep_rows.append((name, latest, str(k), str(v)))
+    dncur.executemany(''' INSERT INTO depend VALUES (?, ?, ?, ?); ''', dep_rows)
+    print('updating NPM dependency relationships [{}]'.format(len(dep_rows)))
+    return len(dep_rows)
 
 
 def post_api_data(url: str, data: str):
@@ -255,38 +524,177 @@ def get_chunk_list(length: int, chunk: int = 100) -> list:
     return ret_list
 
 
-def update_scores_table_from_npm_search_criteria(conn: sqlite3.Connection) -> int:
-    npm_registry_api = 'http://registry.npmjs.org/-/v1/search?text={name}'
+class TokenBucket:
+    '''
+    thread-safe token bucket, allows <rate> requests per second with bursts of <capacity>
+    '''
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size: int) -> requests.Session:
+    '''
+    http session with a connection pool large enough for every in-flight request
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Content-Type': 'application/json',
+        'User-Agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.108 Safari/537.36"
+    })
+    return session
+
+
+def get_with_retry(session: requests.Session, url: str, bucket: TokenBucket, 
+    max_retries: int = SCORES_MAX_RETRIES, timeout: int = SCORES_TIMEOUT):
+    '''
+    rate-limited GET request, retried with exponential backoff on 429/5xx and connection errors
+    returns the response, or None if every attempt failed
+    '''
+    for attempt in range(max_retries+1):
+        bucket.acquire()
+        try:
+            resp = session.get(url, timeout=timeout)
+            if resp.status_code != 429 and resp.status_code < 500:
+                return resp
+            retry_after = resp.headers.get('Retry-After')
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+        except requests.RequestException:
+            delay = 2 ** attempt
+        if attempt < max_retries:
+            time.sleep(min(delay, 60) * (0.5 + random.random()))
+    return None
+
+
+def parse_npm_search_scores(pname: str, data: dict) -> list:
+    '''
+    scores of a package from an npm search response
+    returns [final, popularity, quality, maintenance], None if the package was not found
+    '''
+    scores = [None, None, None, None] # final, popularity,quality, maintenance
+    if is_valid_key(data=data, key='objects'):
+        objects = data['objects']
+        if len(objects) > 0:
+            pdata = objects[0]
+            if is_valid_key(data=pdata, key='package'):
+                package = pdata['package']
+                if package['name'] == pname or \
+                    (is_valid_key(package, 'keywords') and pname in package['keywords']):
+                    if is_valid_key(pdata, 'score'):
+                        score = pdata['score']
+                        if is_valid_key(score, 'final'):
+                            scores[0] = score['final']
+                        if is_valid_key(score, 'detail'):
+                            detail = score['detail']
+                            scores[1] = detail['popularity'] if is_valid_key(detail, 'popularity') else 0
+                            scores[2] = detail['quality'] if is_valid_key(detail, 'quality') else 0
+                            scores[3] = detail['maintenance'] if is_valid_key(detail, 'maintenance') else 0
+                        return scores
+    return None
+
+
+def fetch_npm_search_scores(session: requests.Session, bucket: TokenBucket, registry: str, pname: str) -> tuple:
+    '''
+    returns (pname, scores, found), scores is None if the request failed and should be retried later
+    '''
+    url = '{registry}/-/v1/search?text={name}'.format(registry=registry.rstrip('/'), name=quote(pname, safe='@/'))
+    response = get_with_retry(session, url, bucket)
+    if response is None or response.status_code != 200:
+        return (pname, None, False)
+    try:
+        scores = parse_npm_search_scores(pname, response.json())
+    except ValueError:
+        return (pname, None, False)
+    if scores is None:
+        return (pname, [None, None, None, None], False)
+    return (pname, scores, True)
+
+
+def update_scores_table_from_npm_search_criteria(conn: sqlite3.Connection, registry: str = NPM_REGISTRY_URL,
+    max_inflight: int = SCORES_MAX_INFLIGHT, rate: float = SCORES_RATE_LIMIT, checkpoint: int = SCORES_CHECKPOINT) -> int:
+    '''
+    scores table stores the npm search scores of every package
+    requests run concurrently (at most max_inflight, at most rate per second), results are 
+    committed every <checkpoint> packages, packages that already have a scores row are skipped
+    so an interrupted run resumes where it stopped, failed requests are retried on the next run.
+    packages marked in stale_scores by the incremental refresh are fetched again
+    '''
+    create_refresh_tables(conn)
     dncur = conn.cursor()
-    dncur.execute(''' SELECT name FROM packages; ''')
+    dncur.execute(''' SELECT name FROM packages WHERE name NOT IN (SELECT name FROM scores) 
+        OR name IN (SELECT name FROM stale_scores); ''')
     name_list = [x[0] for x in dncur.fetchall()]
+    session = create_session(max_inflight)
+    bucket = TokenBucket(rate)
     count = 0
-    for index, pname in enumerate(name_list):
-        response = get_api_data(npm_registry_api.format(name=pname))
-        scores = [None, None, None, None] # final, popularity,quality, maintenance
-        if response and response.status_code == 200:
-            data = response.json()
-            if is_valid_key(data=data, key='objects'):
-                objects = data['objects']
-                if len(objects) > 0:
-                    pdata = objects[0]
-                    if is_valid_key(data=pdata, key='package'):
-                        package = pdata['package']
-                        if package['name'] == pname or \
-                            (is_valid_key(package, 'keywords') and pname in package['keywords']):
-                            if is_valid_key(pdata, 'score'):
-                                score = pdata['score']
-                                count += 1
-                                if is_valid_key(score, 'final'):
-                                    scores[0] = score['final']
-                                if is_valid_key(score, 'detail'):
-                                    detail = score['detail']
-                                    scores[1] = detail['popularity'] if is_valid_key(detail, 'popularity') else 0
-                                    scores[2] = detail['quality'] if is_valid_key(detail, 'quality') else 0
-                                    scores[3] = detail['maintenance'] if is_valid_key(detail, 'maintenance') else 0
-        dncur.execute(''' INSERT INTO scores VALUES (?, ?, ?, ?, ?); ''', [pname] + scores)
-        print("updating npm search criteria scores on NPM packages [({}){}/{}]".format(count, index+1, len(name_list)), end='\r')
+    failed = 0
+    done = 0
+    pending_rows = []
+    start = time.monotonic()
+
+    def flush():
+        names = [(row[0],) for row in pending_rows]
+        dncur.executemany(''' DELETE FROM scores WHERE name = ?; ''', names)
+        dncur.executemany(''' DELETE FROM stale_scores WHERE name = ?; ''', names)
+        dncur.executemany(''' INSERT INTO scores VALUES (?, ?, ?, ?, ?); ''', pending_rows)
+        conn.commit()
+        pending_rows.clear()
+
+    names = iter(name_list)
+    with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+        in_flight = set()
+        try:
+            while True:
+                # keep at most max_inflight requests queued or running
+                for pname in names:
+                    in_flight.add(executor.submit(fetch_npm_search_scores, session, bucket, registry, pname))
+                    if len(in_flight) >= max_inflight:
+                        break
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pname, scores, found = future.result()
+                    done += 1
+                    if scores is None:
+                        failed += 1
+                        continue
+                    count += 1 if found else 0
+                    pending_rows.append([pname] + scores)
+                if len(pending_rows) >= checkpoint:
+                    flush()
+                rate_now = done / max(time.monotonic() - start, 1e-9)
+                print("updating npm search criteria scores on NPM packages [({}){}/{}] [{:.1f} pkg/s]"
+                    .format(count, done, len(name_list), rate_now), end='\r')
+        except KeyboardInterrupt:
+            for future in in_flight:
+                future.cancel()
+            flush()
+            print()
+            sys.exit('interrupted, rerun with --resume-scores to continue')
+    flush()
     print()
+    if failed > 0:
+        print(f'{failed:,} packages failed and will be retried with --resume-scores')
     return count
 
 
@@ -344,22 +752,71 @@ def update_scores_table_from_npmsio(conn: sqlite3.Connection) -> int:
 
 
 def main():
-    if len(sys.argv) < 3:
-        sys.exit("Usage: python3 preprocess.py <doc_file> <out_db_file>")
+    argv = sys.argv[1:]
+    registry = pop_option(argv, '--registry', NPM_REGISTRY_URL)
+    workers = int(pop_option(argv, '--workers', INGEST_WORKERS or 0))
+    # stage timings and memory, see rem_profile.py
+    profile_path = pop_option(argv, '--profile')
+    if profile_path:
+        enable_profile(profile_path)
+    if pop_flag(argv, '--resume-scores'):
+        if len(argv) != 1:
+            sys.exit("Usage: python3 preprocess.py [--registry <url>] [--profile <trace_file>] --resume-scores <out_db_file>")
+        dnconn = sqlite3.connect(argv[0])
+        drop_subtree_minimums(dnconn)
+        with stage('scores') as record:
+            num_scores = update_scores_table_from_npm_search_criteria(dnconn, registry=registry)
+            record.set(scores=num_scores)
+        with stage('subtree_minimums'):
+            update_subtree_minimums(dnconn)
+        print('{} scores'.format(num_scores))
+        dnconn.close()
+        return
+
+    changes = pop_option(argv, '--changes')
+    if changes is not None:
+        since = pop_option(argv, '--since')
+        if len(argv) != 1:
+            sys.exit("Usage: python3 preprocess.py [--registry <url>] [--profile <trace_file>] --changes <changes_file|url> [--since <seq>] <out_db_file>")
+        dnconn = sqlite3.connect(argv[0])
+        drop_subtree_minimums(dnconn)
+        with stage('changes') as record:
+            num_updated, num_deleted = update_tables_from_changes(changes, dnconn, since=since)
+            record.set(updated=num_updated, deleted=num_deleted)
+        invalidate_npm_graph(argv[0])
+        with stage('scores') as record:
+            num_scores = update_scores_table_from_npm_search_criteria(dnconn, registry=registry)
+            record.set(scores=num_scores)
+        with stage('subtree_minimums'):
+            update_subtree_minimums(dnconn)
+        print('{} NPM packages updated, {} deleted, {} scores'.format(num_updated, num_deleted, num_scores))
+        dnconn.close()
+        return
+
+    if len(argv) < 2:
+        sys.exit("Usage: python3 preprocess.py [--registry <url>] [--workers <n>] [--profile <trace_file>] <doc_file> <out_db_file>")
     
-    raw_npm_doc = sys.argv[1] # raw npm data
-    out_db = sys.argv[2] # ouput database
+    raw_npm_doc = argv[0] # raw npm data
+    out_db = argv[1] # ouput database
     dnconn = sqlite3.connect(out_db) # 'dep_network.db'
 
     # create tables: packages, depend, scores
     create_tables(dnconn)
-    # updates packages table
-    num_packages = update_packages_table(raw_npm_doc, dnconn)
-    # update depend table
-    num_depends = update_depend_table(dnconn)
+    # updates packages and depend tables
+    with stage('ingest', workers=workers) as record:
+        num_packages, num_depends = update_packages_and_depend_tables(raw_npm_doc, dnconn, workers=workers)
+        record.set(packages=num_packages, dependencies=num_depends)
+    with stage('indexes'):
+        create_indexes(dnconn)
+    invalidate_npm_graph(out_db)
     # update scores table
     # num_scores = update_scores_table_from_npmsio(dnconn)
-    num_scores = update_scores_table_from_npm_search_criteria(dnconn)
+    with stage('scores') as record:
+        num_scores = update_scores_table_from_npm_search_criteria(dnconn, registry=registry)
+        record.set(scores=num_scores)
+    # subtree minimums table
+    with stage('subtree_minimums'):
+        update_subtree_minimums(dnconn)
     # print stats
     print('All updates finished')
     print('{} NPM packages, {} NPM dependency relationships, {} scores'
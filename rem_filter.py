@@ -5,6 +5,7 @@ Zhe Chen (zkchen@uvic.ca)
 '''
 
 import networkx as nx
+from collections import deque # popleft
 from utils import is_valid_key
 
 
@@ -52,54 +53,71 @@ def filter_pre_order(G: nx.Graph, ripples: set, root: str, keyword: str):
     return G.subgraph(list(temp_G.subgraph(list(nx.descendants(temp_G, root))+[root]).nodes())).copy()
 
 
-def clean_cycles(G: nx.DiGraph, source: str):
-    contains_cycle = True
-    while (contains_cycle):
-        try:
-            cycle = nx.find_cycle(G, source)
-            G.remove_edge(cycle[-1][0], cycle[-1][1])
-        except:
-            contains_cycle = False
-
+def subgraph_minimums(G: nx.DiGraph, keywords: list) -> dict:
+    '''
+    compute minimum metric node in the subgraph below every node, for every keyword
+    returns {keyword: {node: minimum}}, minimum is None for nodes without a score
 
-def minimum_in_subgraph_rec(minimum: dict, G: nx.DiGraph, node: str, keyword: str):
+    the graph is condensed into strongly connected components (every node in a cycle
+    reaches the same nodes) and the minimums are propagated in one reverse 
+    topological pass over the condensation, G is not modified
     '''
-    compute minimum metric node in a subgraph
+    condensed_G = nx.condensation(G)
+    nodes = G.nodes()
+    reachable_min = {k: {} for k in keywords} # minimum over every node a component reaches
+    minimum = {k: {} for k in keywords}
+    for c in reversed(list(nx.topological_sort(condensed_G))):
+        members = condensed_G.nodes()[c]['members']
+        successors = condensed_G.succ[c]
+        for k in keywords:
+            k_reach, k_min = reachable_min[k], minimum[k]
+            scores = [(n, nodes[n].get(k) or None) for n in members]
+            candidates = [v for n, v in scores if v]
+            candidates += [k_reach[sc] for sc in successors if k_reach[sc]]
+            reach = min(candidates) if candidates else None
+            k_reach[c] = reach
+            for n, score in scores:
+                k_min[n] = min(score, reach) if score else None
+    return minimum
+
+
+def stored_subtree_minimums(G: nx.DiGraph, keywords: list) -> dict:
     '''
-    meta = G.nodes()[node]
-    score = meta[keyword] if keyword in meta and meta[keyword] else None
-    for n in nx.descendants(G, node):
-        clean_cycles(G, n)
-        if n in minimum:
-            min_n = minimum[n]
-        else:
-            min_n = minimum_in_subgraph_rec(minimum, G, n, keyword)
-        if min_n and score:
-            score = min(score, min_n)
-    minimum[node] = score
-    return score
+    subtree minimums materialised for the whole NPM graph (min_<keyword> node attributes),
+    the sub-graph of an application holds every package reachable from its packages, so 
+    they are the same as subgraph_minimums(G, keywords)
+    returns None if a package of G does not carry them
+    '''
+    minimum = {k: {} for k in keywords}
+    for n, meta in G.nodes(data=True):
+        for k in keywords:
+            if meta.get('type') == 'NPM' and 'min_'+k not in meta:
+                return None
+            minimum[k][n] = meta.get('min_'+k)
+    return minimum
 
 
 def is_collapsed(a, b) -> bool:
     return a >= (0.9 * b) # difference threshold of 90%
 
 
-def filter_post_order_minimum(G: nx.Graph, ripples: set, root: str, keyword: str):
+def filter_post_order_minimum(G: nx.Graph, ripples: set, root: str, keyword: str, minimum: dict = None):
     '''
     minimize graph size
     a bottom-up approach
     if an successor node has higher or equal <keyword> score than its parent
     -> 
     filter by removing edge with minimum
+    minimum: precomputed subgraph_minimums(G, ...)[keyword], optional
     '''
     temp_G = G.copy() # copy of original graph
-    minimum = {}
-    minimum_in_subgraph_rec(minimum, G.copy(), root, keyword) # minumum metric in each subgraph
+    if minimum is None:
+        minimum = subgraph_minimums(G, [keyword])[keyword] # minumum metric in each subgraph
     visited = {n: False for n in list(temp_G.nodes())}
-    queue = [x for x in temp_G.nodes() if temp_G.out_degree(x)==0]
+    queue = deque([x for x in temp_G.nodes() if temp_G.out_degree(x)==0])
 
     while len(queue) > 0:
-        name = queue.pop(0)
+        name = queue.popleft()
         if visited[name]:
             continue
         visited[name] = True
@@ -121,23 +139,24 @@ def filter_post_order_minimum(G: nx.Graph, ripples: set, root: str, keyword: str
     return G.subgraph(list(temp_G.subgraph(list(nx.descendants(temp_G, root))+[root]).nodes())).copy()
 
 
-def filter_pre_order_minimum(G: nx.Graph, ripples: set, root: str, keyword: str):
+def filter_pre_order_minimum(G: nx.Graph, ripples: set, root: str, keyword: str, minimum: dict = None):
     '''
     minimize graph size
     a top-down(BFS) approach
     if a successor node has higher or equal <keyword> score than its parent
     -> 
     filter by removing edge with minimum
+    minimum: precomputed subgraph_minimums(G, ...)[keyword], optional
     '''
     temp_G = G.copy() # copy of original graph
-    minimum = {}
-    minimum_in_subgraph_rec(minimum, G.copy(), root, keyword)
+    if minimum is None:
+        minimum = subgraph_minimums(G, [keyword])[keyword]
     
     visited = {n: False for n in list(temp_G.nodes())}
-    queue = [root]
+    queue = deque([root])
 
     while len(queue) > 0:
-        name = queue.pop(0)
+        name = queue.popleft()
         if visited[name]:
             continue
         visited[name] = True
@@ -162,17 +181,29 @@ def gray_out_non_problematics(G: nx.Graph, root: str, keyword: str):
     '''
     in a filtered REM, non-problematic nodes will be grayed-out to emphasize problematic transitive
     dependencies
+
+    a node is non-problematic if its score is not lower than the best scored direct dependency
+    above it, the best score is propagated from the direct dependencies in one topological pass
+    over the condensation (members of a cycle are above each other)
     '''
-    dir_dependencies = list(G.neighbors(root))
+    dir_dependencies = set(G.neighbors(root))
+    condensed_G = nx.condensation(G)
+    mapping = condensed_G.graph['mapping']
+    nodes = G.nodes()
+    above = {} # maximum score of the direct dependencies reaching a component
+    for c in nx.topological_sort(condensed_G):
+        scores = [nodes[n][keyword] for n in condensed_G.nodes()[c]['members'] \
+            if n in dir_dependencies and is_valid_key(nodes[n], keyword)]
+        scores += [above[p] for p in condensed_G.pred[c] if above[p] is not None]
+        above[c] = max(scores) if scores else None
     for node in G.nodes():
         if is_valid_key(G.nodes()[node], 'deprecated') and G.nodes()[node]['deprecated'] == True:
             continue
-        if (node in dir_dependencies+[root]):
+        if node in dir_dependencies or node == root:
             continue
         if not is_valid_key(G.nodes()[node], keyword):
             continue
-        predecessors_in_dir = [G.nodes()[n][keyword] for n in nx.ancestors(G, node) \
-            if n in dir_dependencies and is_valid_key(G.nodes()[n], keyword)]
-        if predecessors_in_dir and round(G.nodes()[node][keyword], 1) >= round(max(predecessors_in_dir), 1):
+        max_dir_score = above[mapping[node]]
+        if max_dir_score is not None and round(G.nodes()[node][keyword], 1) >= round(max_dir_score, 1):
             G.nodes()[node]['non_problematic'] = True
     return
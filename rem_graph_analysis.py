@@ -8,13 +8,49 @@ Zhe Chen (zkchen@uvic.ca)
 import networkx as nx # DiGraph
 import sys
 import json # dump()
-from configs import JSONMODE
+from configs import JSONMODE, JSONMODE_FORMAT, JSONMODE_GZIP
 from rem_filter import *
+from rem_ripple import ripple_effect
+from rem_layout import graph_layout
+from rem_lod import lod_graph_to_html
+from rem_profile import stage
 from rem_graphics import *
 from utils import *
 
 
-def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str, keyword: str, filter_flag: bool):
+def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str, keyword: str, filter_flag: bool) -> dict:
+    '''
+    run the REM pipeline on an application sub-graph and write the REM graphs
+    returns a summary of the analysis and the paths of the written files
+    '''
+    analysis = prepare_project_analysis(G=G, pname=pname, keywords=[keyword] if filter_flag else [])
+    return render_project_analysis(analysis=analysis, outfile=outfile, outfolder=outfolder, 
+        keyword=keyword, filter_flag=filter_flag)
+
+
+def project_graph_analysis_multi(G: nx.Graph, pname: str, outfile: str, outfolder: str, keywords: list, filter_flag: bool) -> list:
+    '''
+    REM graphs for several keywords, the keyword-independent stages (sub-graphs, deprecated 
+    packages, ripple effect, layout and subgraph minimums) are computed once
+    outfile: prefix, REM graphs of each keyword are written to <outfile>_<keyword>
+    returns the list of per-keyword summaries
+    '''
+    analysis = prepare_project_analysis(G=G, pname=pname, keywords=keywords if filter_flag else [])
+    return [render_project_analysis(analysis=analysis, outfile=f'{outfile}_{keyword}', outfolder=outfolder, 
+        keyword=keyword, filter_flag=filter_flag) for keyword in keywords]
+
+
+def prepare_project_analysis(G: nx.Graph, pname: str, keywords: list, reuse: dict = None) -> dict:
+    '''
+    keyword-independent stages of the REM pipeline
+    keywords: metrics the subgraph minimums are computed for (used by the filter)
+    reuse: results of an earlier analysis of identical sub-graphs, taken over instead of 
+        recomputed (see rem_incremental.py): {'runtime'|'development': {'ripple_nodes', 
+        'ripple_edges', 'minimum', 'filtered'}, 'pos': layout of an identical G}
+    '''
+    reuse = reuse or {}
+    rt_reuse = reuse.get('runtime', {})
+    dev_reuse = reuse.get('development', {})
     print('NPM software:', pname)
 
     ''' pre. check if exists '''
@@ -42,17 +78,20 @@ def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str
     project_rt_sub_G = nx.DiGraph()
     # DEVELOPMENT
     project_dev_sub_G = nx.DiGraph()
-    project_rt_sub_G.add_node(pname, **G.nodes()[pname])
-    project_dev_sub_G.add_node(pname, **G.nodes()[pname])
-    for u,v,m in G.edges(data=True):
-        if 'runtime' in m and m['runtime'] is True:
-            project_rt_sub_G.add_node(u, **G.nodes()[u])
-            project_rt_sub_G.add_node(v, **G.nodes()[v])
-            project_rt_sub_G.add_edge(u,v, **m)
-        if 'development' in m and m['development'] is True:
-            project_dev_sub_G.add_node(u, **G.nodes()[u])
-            project_dev_sub_G.add_node(v, **G.nodes()[v])
-            project_dev_sub_G.add_edge(u,v, **m)
+    with stage('split', application=pname) as record:
+        project_rt_sub_G.add_node(pname, **G.nodes()[pname])
+        project_dev_sub_G.add_node(pname, **G.nodes()[pname])
+        for u,v,m in G.edges(data=True):
+            if 'runtime' in m and m['runtime'] is True:
+                project_rt_sub_G.add_node(u, **G.nodes()[u])
+                project_rt_sub_G.add_node(v, **G.nodes()[v])
+                project_rt_sub_G.add_edge(u,v, **m)
+            if 'development' in m and m['development'] is True:
+                project_dev_sub_G.add_node(u, **G.nodes()[u])
+                project_dev_sub_G.add_node(v, **G.nodes()[v])
+                project_dev_sub_G.add_edge(u,v, **m)
+        record.graph(project_rt_sub_G, 'runtime_')
+        record.graph(project_dev_sub_G, 'development_')
     
     # print graph shape
     print()
@@ -108,13 +147,13 @@ def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str
     # RUNTIME
     if len(rt_sub_g_deprecated_list) > 0:
         print('\nRUNTIME:')
-        for deprecated_name, meta in rt_sub_g_deprecated_list:  
-            path_list = list(nx.all_simple_paths(project_rt_sub_G, source=pname, target=deprecated_name))
-            for path in path_list:
-                for i in range(len(path)-1):
-                    rt_ripple_effect_nodes.add(path[i])
-                    rt_ripple_effect_nodes.add(path[i + 1])
-                    rt_ripple_effect_edges.add((path[i], path[i + 1]))
+        if 'ripple_edges' in rt_reuse:
+            rt_ripple_effect_nodes, rt_ripple_effect_edges = rt_reuse['ripple_nodes'], rt_reuse['ripple_edges']
+        else:
+            with stage('ripple', dependency='runtime', deprecated=len(rt_sub_g_deprecated_list)) as record:
+                rt_ripple_effect_nodes, rt_ripple_effect_edges = ripple_effect(project_rt_sub_G, pname, 
+                    [name for name, meta in rt_sub_g_deprecated_list])
+                record.graph(project_rt_sub_G)
     
         print(\
     '**{:,}** nodes ({:.2f}%) affected by ripple effect by the deprecation of {:,} packages in the graph.'
@@ -130,13 +169,13 @@ def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str
     # DEVELOPMENT
     if len(dev_sub_g_deprecated_list) > 0: 
         print('\nDEVELOPMENT:')
-        for deprecated_name, meta in dev_sub_g_deprecated_list:  
-            path_list = list(nx.all_simple_paths(project_dev_sub_G, source=pname, target=deprecated_name))
-            for path in path_list:
-                for i in range(len(path)-1):
-                    dev_ripple_effect_nodes.add(path[i])
-                    dev_ripple_effect_nodes.add(path[i + 1])
-                    dev_ripple_effect_edges.add((path[i], path[i + 1]))
+        if 'ripple_edges' in dev_reuse:
+            dev_ripple_effect_nodes, dev_ripple_effect_edges = dev_reuse['ripple_nodes'], dev_reuse['ripple_edges']
+        else:
+            with stage('ripple', dependency='development', deprecated=len(dev_sub_g_deprecated_list)) as record:
+                dev_ripple_effect_nodes, dev_ripple_effect_edges = ripple_effect(project_dev_sub_G, pname, 
+                    [name for name, meta in dev_sub_g_deprecated_list])
+                record.graph(project_dev_sub_G)
     
         print(\
     '**{:,}** nodes ({:.2f}%) affected by ripple effect by the deprecation of {:,} packages in the graph.'
@@ -158,48 +197,219 @@ def project_graph_analysis(G: nx.Graph, pname: str, outfile: str, outfolder: str
         project_dev_sub_G.edges()[pair]['color'] = 'lightgrey'\
         if pair not in dev_ripple_effect_edges else '#8b0000'
 
-    ''' 3.d(pre-4.b) graph filter that reduces node number '''
     project_sub_G = nx.compose(project_rt_sub_G, project_dev_sub_G)
     # using dot diagram which shows the hierarchy of the graph
-    pos = nx.nx_pydot.graphviz_layout(project_sub_G, prog='dot', root=pname)
+    if 'pos' in reuse:
+        pos = reuse['pos']
+    else:
+        with stage('layout') as record:
+            pos = graph_layout(project_sub_G, root=pname, prog='dot')
+            record.graph(project_sub_G)
     # pos = nx.nx_agraph.graphviz_layout(project_sub_G,prog="twopi", root=pname)
-    filtered_project_sub_G = nx.DiGraph()
-    if filter_flag:
-        print('\nbefore filter: {:,} nodes, {:,} edges'
-                .format(project_sub_G.number_of_nodes(), project_sub_G.number_of_edges()))
-        # version 2 filter
-        # RUNTIME
-        temp_rt_G = filter_post_order_minimum(G=project_rt_sub_G, 
-        ripples=rt_ripple_effect_edges, root=pname, keyword=keyword)
+
+    # minimum metric in each subgraph, used by the filter of every keyword
+    # looked up from the NPM graph when available, computed otherwise
+    with stage('minimums', keywords=keywords):
+        if all(k in rt_reuse.get('minimum', {}) for k in keywords):
+            rt_minimum = {k: rt_reuse['minimum'][k] for k in keywords}
+        else:
+            rt_minimum = stored_subtree_minimums(project_rt_sub_G, keywords) \
+                or subgraph_minimums(project_rt_sub_G, keywords) if keywords else {}
+        if all(k in dev_reuse.get('minimum', {}) for k in keywords):
+            dev_minimum = {k: dev_reuse['minimum'][k] for k in keywords}
+        else:
+            dev_minimum = stored_subtree_minimums(project_dev_sub_G, keywords) \
+                or subgraph_minimums(project_dev_sub_G, keywords) if keywords else {}
+
+    return {
+        'name': pname,
+        'rt_G': project_rt_sub_G,
+        'dev_G': project_dev_sub_G,
+        'G': project_sub_G,
+        'pos': pos,
+        'rt_deprecated': rt_sub_g_deprecated_list,
+        'dev_deprecated': dev_sub_g_deprecated_list,
+        'rt_ripple_nodes': rt_ripple_effect_nodes,
+        'rt_ripple_edges': rt_ripple_effect_edges,
+        'dev_ripple_nodes': dev_ripple_effect_nodes,
+        'dev_ripple_edges': dev_ripple_effect_edges,
+        'rt_minimum': rt_minimum,
+        'dev_minimum': dev_minimum,
+        # filtered runtime and development graphs of every keyword, see filter_project_graph
+        'rt_filtered': dict(rt_reuse.get('filtered', {})),
+        'dev_filtered': dict(dev_reuse.get('filtered', {}))
+    }
+
+
+def filter_project_graph(analysis: dict, keyword: str) -> nx.DiGraph:
+    '''
+    filtered REM graph of a keyword, non-problematic nodes are grayed out
+    '''
+    pname = analysis['name']
+    # version 2 filter
+    # RUNTIME
+    temp_rt_G = analysis['rt_filtered'].get(keyword)
+    if temp_rt_G is None:
+        with stage('filter', keyword=keyword, dependency='runtime') as record:
+            temp_rt_G = filter_post_order_minimum(G=analysis['rt_G'], 
+            ripples=analysis['rt_ripple_edges'], root=pname, keyword=keyword, 
+            minimum=analysis['rt_minimum'].get(keyword))
+            record.graph(temp_rt_G)
         for u,v,m in temp_rt_G.edges(data=True):
             if 'development' in m:
                 del m['development']
-        # DEVELOPMENT
-        temp_dev_G = filter_post_order_minimum(G=project_dev_sub_G, 
-        ripples=dev_ripple_effect_edges, root=pname, keyword=keyword)
+        analysis['rt_filtered'][keyword] = temp_rt_G
+    # DEVELOPMENT
+    temp_dev_G = analysis['dev_filtered'].get(keyword)
+    if temp_dev_G is None:
+        with stage('filter', keyword=keyword, dependency='development') as record:
+            temp_dev_G = filter_post_order_minimum(G=analysis['dev_G'], 
+            ripples=analysis['dev_ripple_edges'], root=pname, keyword=keyword, 
+            minimum=analysis['dev_minimum'].get(keyword))
+            record.graph(temp_dev_G)
         for u,v,m in temp_dev_G.edges(data=True):
             if 'runtime' in m:
                 del m['runtime']
-        # COMBINED
-        filtered_project_sub_G = nx.compose(temp_rt_G, temp_dev_G)
+        analysis['dev_filtered'][keyword] = temp_dev_G
+    # COMBINED
+    filtered_project_sub_G = nx.compose(temp_rt_G, temp_dev_G)
+    with stage('gray_out', keyword=keyword) as record:
         gray_out_non_problematics(G=filtered_project_sub_G, root=pname, keyword=keyword)
-        print('after filter: {:,} nodes, {:,} edges'
-                .format(filtered_project_sub_G.number_of_nodes(), filtered_project_sub_G.number_of_edges()))
-    
-    ''' 4. node link diagram of the dependency graph '''
-    assign_graph_node_symbol(project_sub_G, filtered_project_sub_G)
+        record.graph(filtered_project_sub_G)
+    return filtered_project_sub_G
+
+
+def render_project_analysis(analysis: dict, outfile: str, outfolder: str, keyword: str, filter_flag: bool) -> dict:
+    '''
+    keyword-specific stages of the REM pipeline: filtering and rendering
+    returns a summary of the analysis and the paths of the written files
+    '''
+    pname = analysis['name']
+    project_sub_G = analysis['G']
+    pos = analysis['pos']
+
+    filtered_project_sub_G = filter_project_analysis(analysis, keyword, filter_flag)
+    outputs = {}
     
     if filter_flag:
         if JSONMODE:
-            dump_graph_json(G=filtered_project_sub_G, filepath=join('d3_test', outfile+'_filtered.json'))
+            outputs['filtered'] = dump_project_json(G=filtered_project_sub_G, pos=pos, 
+                filepath=join('d3_test', outfile+'_filtered.json'), 
+                title='filtered REM dependency graph for {}'.format(pname), key=keyword)
         else:
+            outputs['filtered'] = join(outfolder, outfile+'_min.html')
             plotly_graph_to_html(G=filtered_project_sub_G, pos=pos, 
-                title='filtered REM dependency graph for {}'.format(pname), key=keyword, outfile=join(outfolder, outfile+'_min.html'))
+                title='filtered REM dependency graph for {}'.format(pname), key=keyword, outfile=outputs['filtered'])
             
     if JSONMODE:
-        dump_graph_json(G=filtered_project_sub_G, filepath=join('d3_test', outfile+'_full.json'))
-        with open(join('d3_test', outfile+'_pos.json'), 'w') as dfile:
-            json.dump(pos, dfile)
+        outputs['full'] = dump_project_json(G=project_sub_G, pos=pos, filepath=join('d3_test', outfile+'_full.json'), 
+            title='full REM dependency graph for {}'.format(pname), key=keyword)
+        if JSONMODE_FORMAT == 'node_link':
+            with open(join('d3_test', outfile+'_pos.json'), 'w') as dfile:
+                json.dump(pos, dfile)
     else:            
+        outputs['full'] = join(outfolder,outfile+'_full.html')
         plotly_graph_to_html(G=project_sub_G, pos=pos, 
-            title='full REM dependency graph for {}'.format(pname), key=keyword, outfile=join(outfolder,outfile+'_full.html'))
+            title='full REM dependency graph for {}'.format(pname), key=keyword, outfile=outputs['full'])
+
+    return summarize_project_analysis(analysis, keyword, filtered_project_sub_G, filter_flag, outputs)
+
+
+def dump_project_json(G: nx.Graph, pos: dict, filepath: str, title: str, key: str) -> str:
+    '''
+    JSONMODE output of a REM graph, columnar with the positions (d3_test/canvas.html) 
+    or networkx node_link_data (d3_test/index.html), see JSONMODE_FORMAT
+    returns the path of the written file
+    '''
+    if JSONMODE_FORMAT == 'node_link':
+        dump_graph_json(G=G, filepath=filepath)
+        return filepath
+    return dump_graph_columnar(G=G, pos=pos, filepath=filepath, title=title, key=key, compress=JSONMODE_GZIP)
+
+
+def project_graph_analysis_combined(G: nx.Graph, pname: str, outfile: str, outfolder: str, keywords: list, filter_flag: bool) -> list:
+    '''
+    REM graphs of every keyword (filtered and full) in a single html file <outfile>.html,
+    the graph is switched in the browser with a dropdown
+    returns the list of per-keyword summaries
+    '''
+    analysis = prepare_project_analysis(G=G, pname=pname, keywords=keywords if filter_flag else [])
+    views = []
+    filtered_graphs = {}
+    for keyword in keywords:
+        filtered_graphs[keyword] = filter_project_analysis(analysis, keyword, filter_flag)
+        if filter_flag:
+            views.append((f'{keyword}: filtered', filtered_graphs[keyword], 
+                'filtered REM dependency graph for {}'.format(pname), keyword))
+        views.append((f'{keyword}: full', analysis['G'], 'full REM dependency graph for {}'.format(pname), keyword))
+    outputs = {'combined': join(outfolder, outfile+'.html')}
+    plotly_views_to_html(views, analysis['pos'], outfile=outputs['combined'])
+    return [summarize_project_analysis(analysis, keyword, filtered_graphs[keyword], filter_flag, outputs) 
+        for keyword in keywords]
+
+
+def project_graph_analysis_lod(G: nx.Graph, pname: str, outfile: str, outfolder: str, keywords: list, filter_flag: bool) -> list:
+    '''
+    level-of-detail viewer <outfile>_lod.html of the full REM graph, the dependencies of every
+    direct dependency are loaded in the browser when it is expanded, see rem_lod.py
+    the viewer is not filtered, filter_flag is ignored
+    returns the list of per-keyword summaries
+    '''
+    analysis = prepare_project_analysis(G=G, pname=pname, keywords=[])
+    outputs = {'lod': join(outfolder, outfile+'_lod.html')}
+    lod_graph_to_html(G=analysis['G'], pos=analysis['pos'], root=pname, 
+        ripple_edges=analysis['rt_ripple_edges'] | analysis['dev_ripple_edges'], 
+        title='REM dependency graph for {}'.format(pname), keywords=keywords, outfile=outputs['lod'])
+    return [summarize_project_analysis(analysis, keyword, nx.DiGraph(), False, outputs) for keyword in keywords]
+
+
+def filter_project_analysis(analysis: dict, keyword: str, filter_flag: bool) -> nx.DiGraph:
+    '''
+    filtered REM graph of a keyword (empty if filtering is disabled), 
+    nodes are marked with the symbols used in the node link diagram
+    '''
+    project_sub_G = analysis['G']
+    ''' 3.d(pre-4.b) graph filter that reduces node number '''
+    filtered_project_sub_G = nx.DiGraph()
+    if filter_flag:
+        print('\nbefore filter: {:,} nodes, {:,} edges'
+                .format(project_sub_G.number_of_nodes(), project_sub_G.number_of_edges()))
+        filtered_project_sub_G = filter_project_graph(analysis, keyword)
+        print('after filter: {:,} nodes, {:,} edges'
+                .format(filtered_project_sub_G.number_of_nodes(), filtered_project_sub_G.number_of_edges()))
+    
+    ''' 4. node link diagram of the dependency graph '''
+    assign_graph_node_symbol(project_sub_G, filtered_project_sub_G)
+    return filtered_project_sub_G
+
+
+def summarize_project_analysis(analysis: dict, keyword: str, filtered_G: nx.Graph, filter_flag: bool, outputs: dict) -> dict:
+    '''
+    json-friendly summary of the REM analysis of a keyword
+    '''
+    return {
+        'name': analysis['name'],
+        'keyword': keyword,
+        'runtime': summarize_dependency_graph(analysis['rt_G'], analysis['rt_deprecated'], 
+            analysis['rt_ripple_nodes'], analysis['rt_ripple_edges']),
+        'development': summarize_dependency_graph(analysis['dev_G'], analysis['dev_deprecated'], 
+            analysis['dev_ripple_nodes'], analysis['dev_ripple_edges']),
+        'filtered': {
+            'nodes': filtered_G.number_of_nodes(),
+            'edges': filtered_G.number_of_edges()
+        } if filter_flag else None,
+        'outputs': outputs
+    }
+
+
+def summarize_dependency_graph(G: nx.Graph, deprecated_list: list, ripple_nodes: set, ripple_edges: set) -> dict:
+    '''
+    json-friendly summary of a runtime or development sub-graph
+    '''
+    return {
+        'nodes': G.number_of_nodes(),
+        'edges': G.number_of_edges(),
+        'deprecated': sorted(name for name, meta in deprecated_list),
+        'ripple_effect_nodes': sorted(ripple_nodes),
+        'ripple_effect_edges': sorted(list(e) for e in ripple_edges)
+    }
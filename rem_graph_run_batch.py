@@ -0,0 +1,201 @@
+'''
+run all REMs for many applications, the NPM graph is loaded once and shared
+copy-on-write with a pool of forked workers
+
+input is either a directory of <name>_package.json files (same layout as
+data/gh_app_graph_metric.py) or a text file with one github url per line.
+with --lockfile, the graphs are built from <name>_package-lock.json, 
+<name>_npm-shrinkwrap.json or <name>_yarn.lock next to <name>_package.json, or
+from the lockfile of the github repo; applications without one fall back to the
+latest versions in the NPM graph.
+every application is written to <out_folder> like rem_graph_run_all.py, the
+output of its analysis to <out_folder>/logs/<name>.log, and one row per
+application (status, graph sizes and timings) to the summary csv.
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import contextlib # redirect_stdout
+import csv
+import json
+import os # cpu_count, path, makedirs
+import re
+import sys # exit, argv
+import time
+import traceback
+from rem_graph_analysis import project_graph_analysis_multi, project_graph_analysis_combined, project_graph_analysis_lod
+from utils import *
+from configs import KEYWORDS
+from rem_profile import enable_profile, stage
+
+SUMMARY_FIELDS = ['name', 'source', 'lockfile', 'status', 'runtime_nodes', 'runtime_edges', 'development_nodes',
+    'development_edges', 'runtime_deprecated', 'development_deprecated', 'dependencies_seconds',
+    'graph_seconds', 'analysis_seconds', 'total_seconds', 'worker']
+
+# resident NPM graph, set by main() before the worker pool is created
+_npm_G = None
+
+
+def read_applications(source: str) -> list:
+    '''
+    returns [(application name, file name prefix, package.json path | github url)]
+    '''
+    applications = []
+    if os.path.isdir(source):
+        for fi in sorted(os.listdir(source)):
+            if not fi.endswith('package.json') or not os.path.isfile(os.path.join(source, fi)):
+                continue
+            name = fi[:len(fi)-13] # len('_package.json') = 13
+            applications.append(('{}(local)'.format(name), name, os.path.join(source, fi)))
+        return applications
+    with open(source, 'r') as ufile:
+        for line in ufile:
+            repo_url = line.strip()
+            if not repo_url or repo_url.startswith('#'):
+                continue
+            github_repo = parse_github_url(repo_url)
+            if github_repo is None:
+                print(f'skipped [{repo_url}], not a github url')
+                continue
+            owner, repo, branch = github_repo
+            applications.append(('{owner}:{repo}({branch})'.format(owner=owner, repo=repo, branch=branch),
+                f'{owner}-{repo}-{branch}', repo_url))
+    return applications
+
+
+def application_dependencies(source: str) -> tuple:
+    '''
+    (runtime dependencies, development dependencies) of a package.json file or github url
+    '''
+    if os.path.isfile(source):
+        try:
+            with open(source, 'r', encoding='utf-8') as pfile:
+                return package_json_deps(json.load(pfile))
+        except (OSError, ValueError):
+            return (None, None)
+    owner, repo, branch = parse_github_url(source)
+    return retrieve_package_json_deps(owner, repo, branch)
+
+
+def application_lockfile(source: str) -> tuple:
+    '''
+    (lockfile path | github url, Lockfile) of a package.json file or github url, (None, None) if there is none
+    '''
+    if os.path.isfile(source):
+        prefix = source[:len(source)-len('package.json')]
+        for filename in LOCKFILE_NAMES:
+            if os.path.isfile(prefix+filename):
+                try:
+                    return (prefix+filename, read_lockfile(prefix+filename))
+                except (OSError, ValueError, KeyError, AttributeError):
+                    print(f'lockfile [{prefix+filename}] could not be read')
+        return (None, None)
+    lock = retrieve_lockfile(*parse_github_url(source))
+    return ('github', lock) if lock is not None else (None, None)
+
+
+def run_application(job: tuple) -> dict:
+    '''
+    runs in a worker: dependencies, sub-graph and every REM graph of one application
+    returns a row of the summary csv
+    '''
+    application_name, outfile, source, out_folder, mode, lockfile = job
+    outfile = re.sub(r'[^\w.-]+', '-', outfile)
+    row = {'name': application_name, 'source': source, 'status': 'ok', 'worker': os.getpid()}
+    start = time.perf_counter()
+    log_path = os.path.join(out_folder, 'logs', outfile+'.log')
+    try:
+        with open(log_path, 'w') as log, contextlib.redirect_stdout(log), \
+            stage('application', application=application_name):
+            rt_deps, dev_deps = application_dependencies(source)
+            lock = None
+            if lockfile:
+                row['lockfile'], lock = application_lockfile(source)
+            row['dependencies_seconds'] = round(time.perf_counter()-start, 3)
+            if not rt_deps and not dev_deps:
+                row['status'] = 'no dependencies'
+            else:
+                t = time.perf_counter()
+                application_sub_G = create_application_graph(_npm_G, application_name, rt_deps, dev_deps, lock)
+                row['graph_seconds'] = round(time.perf_counter()-t, 3)
+                t = time.perf_counter()
+                analysis = {'combined': project_graph_analysis_combined, 'lod': project_graph_analysis_lod}.get(mode,
+                    project_graph_analysis_multi)
+                summary = analysis(G=application_sub_G, pname=application_name, outfile=outfile,
+                    outfolder=out_folder, keywords=KEYWORDS, filter_flag=True)[0]
+                row['analysis_seconds'] = round(time.perf_counter()-t, 3)
+                for dep_type in ['runtime', 'development']:
+                    row[dep_type+'_nodes'] = summary[dep_type]['nodes']
+                    row[dep_type+'_edges'] = summary[dep_type]['edges']
+                    row[dep_type+'_deprecated'] = len(summary[dep_type]['deprecated'])
+    except Exception as e:
+        row['status'] = 'error: {!r}'.format(e)
+        with open(log_path, 'a') as log:
+            traceback.print_exc(file=log)
+    row['total_seconds'] = round(time.perf_counter()-start, 3)
+    return row
+
+
+def run_batch(applications: list, out_folder: str, summary_path: str, workers: int, mode: str, lockfile: bool = False) -> list:
+    '''
+    mode: multi (html files per metric) | combined (one html file) | lod (level-of-detail viewer)
+    lockfile: build the graphs from the lockfiles of the applications
+    '''
+    os.makedirs(os.path.join(out_folder, 'logs'), exist_ok=True)
+    jobs = [(name, outfile, source, out_folder, mode, lockfile) for name, outfile, source in applications]
+    rows = []
+    start = time.perf_counter()
+    pool = create_worker_pool(workers)
+    try:
+        with open(summary_path, 'w', newline='') as sfile:
+            writer = csv.DictWriter(sfile, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            for row in pool.imap_unordered(run_application, jobs):
+                rows.append(row)
+                writer.writerow(row)
+                sfile.flush()
+                print('[{}/{}] {} {} [{:.1f}s]'.format(len(rows), len(jobs), row['name'], row['status'],
+                    row['total_seconds']))
+    finally:
+        pool.terminate()
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for row in rows if row['status'] != 'ok')
+    print('{:,} applications ({:,} not rendered) in {:.1f}s with {} workers [{:.2f} applications/s]'
+        .format(len(rows), failed, elapsed, workers, len(rows) / max(elapsed, 1e-9)))
+    print(f'summary stored at {summary_path}')
+    return rows
+
+
+def main():
+    global _npm_G
+    argv = sys.argv[1:]
+    workers = int(pop_option(argv, '--workers', os.cpu_count()))
+    summary_path = pop_option(argv, '--summary')
+    # all REM graphs of an application in one html file
+    combined = pop_flag(argv, '--combined')
+    # level-of-detail viewer of every application, see rem_lod.py
+    lod = pop_flag(argv, '--lod')
+    # stage timings and memory of every application, see rem_profile.py
+    profile_path = pop_option(argv, '--profile')
+    # installed dependency trees instead of the latest versions, see npm_lockfile.py
+    lockfile = pop_flag(argv, '--lockfile')
+    if len(argv) not in [1, 2] or (combined and lod):
+        sys.exit('Usage: python3 rem_graph_run_batch.py [--workers <n>] [--summary <csv>] [--combined|--lod] '
+            '[--profile <trace_file>] [--lockfile] <package_json_folder|url_list_file> [<out_folder>(htmls/)]')
+    out_folder = argv[1] if len(argv) == 2 else 'htmls'
+    summary_path = summary_path or os.path.join(out_folder, 'rem_batch_summary.csv')
+
+    applications = read_applications(argv[0])
+    if not applications:
+        sys.exit(f'no applications found in {argv[0]}')
+    print(f'{len(applications):,} applications')
+    if profile_path:
+        enable_profile(profile_path)
+
+    prepare_npm_graph()
+    _npm_G = load_npm_graph()
+    run_batch(applications, out_folder, summary_path, workers, 'lod' if lod else 'combined' if combined else 'multi', lockfile)
+
+
+if __name__ == '__main__':
+    main()
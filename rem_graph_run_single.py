@@ -9,70 +9,58 @@ import sqlite3 # database connection
 import sys # exit, argv
 import os # path.join, isfile
 from rem_graph_analysis import project_graph_analysis
+from rem_incremental import incremental_graph_analysis
 from plain_graph_run import draw_plain_dependency_graph
 from utils import *
-from configs import NPMJSON, FILTER_ENABLE
+from configs import FILTER_ENABLE
+from rem_profile import enable_profile
 
 
 def main():
-    if len(sys.argv) < 3:
-        sys.exit('Usage: python3 rem_graph_run_single.py <keyword> <github_url> [<out_folder>(htmls/)]')
+    argv = list(sys.argv)
+    # stage timings and memory, see rem_profile.py
+    profile_path = pop_option(argv, '--profile')
+    # only what changed since the last run of the application, see rem_incremental.py
+    incremental = pop_flag(argv, '--incremental')
+    # installed dependency tree instead of the latest versions, see npm_lockfile.py
+    lockfile_source = pop_option(argv, '--lockfile')
+    if len(argv) < 3:
+        sys.exit('Usage: python3 rem_graph_run_single.py [--incremental] [--profile <trace_file>] [--lockfile <lockfile|github>] <keyword> <github_url> [<out_folder>(htmls/)]')
     
-    keyword = sys.argv[1]
+    keyword = argv[1]
 
-    if len(sys.argv) == 5:
-        out_folder = sys.argv[3]
+    if len(argv) == 5:
+        out_folder = argv[3]
     else:
         out_folder = 'htmls'
 
     # parse github repo and split into owner, repo, and branch 
-    repo_url = sys.argv[2]
-    # naive check if input is github address
-    if 'github' not in repo_url:
+    repo_url = argv[2]
+    github_repo = parse_github_url(repo_url)
+    if github_repo is None:
         sys.exit('input must be a github url, example: github.com/<owner>/<repo>')
-    url_tokens = repo_url.split('/')
-    # if input url has specified branch, otherwise will be master
-    if 'tree' in url_tokens:
-        owner, repo, tree, branch = url_tokens[-4:]
-        del tree
-    else:
-        owner, repo, branch = url_tokens[-2:]+['master']
+    owner, repo, branch = github_repo
+    if profile_path:
+        enable_profile(profile_path)
     
     prepare_npm_graph()
-    npm_G = read_graph_json(NPMJSON)
+    npm_G = load_npm_graph()
 
     # fetch github application package.json
     # runtime and development dependencies
     rt_deps, dev_deps = retrieve_package_json_deps(owner, repo, branch)
     if not rt_deps and not dev_deps: 
         sys.exit('application does not have any runtime and development dependencies')
+    lock = load_lockfile(lockfile_source, owner, repo, branch) if lockfile_source else None
 
     # add github application to the NPM network
     application_name = '{owner}:{repo}({branch})'.format(owner=owner, repo=repo, branch=branch)
-    npm_G.add_node(application_name, type='GITHUB')
-    temp_G = npm_G.copy()
-    if rt_deps is not None:
-        for k, v in rt_deps.items():
-            temp_G.add_edge(application_name, str(k), runtime_constraint=str(v))
-    application_rt_sub_G = temp_G.subgraph(list(nx.descendants(temp_G, application_name))+[application_name]).copy()
-    for ed in application_rt_sub_G.edges():
-        application_rt_sub_G.edges()[ed]['runtime'] = True
-    temp_G = npm_G.copy()
-    if dev_deps is not None:
-        for k, v in dev_deps.items():
-            temp_G.add_edge(application_name, str(k), dev_constraint=str(v))
-    application_dev_sub_G = temp_G.subgraph(list(nx.descendants(temp_G, application_name))+[application_name]).copy()
-    for ed in application_dev_sub_G.edges():
-        application_dev_sub_G.edges()[ed]['development'] = True
-    npm_G.clear()
-    temp_G.clear()
-
-    # create github application sub graph
-    application_sub_G = nx.compose(application_rt_sub_G, application_dev_sub_G).copy()
-    application_rt_sub_G.clear()
-    application_dev_sub_G.clear()
-    print('created sub-graph for {}. [{:,}] nodes, [{:,}] edges'
-    .format(application_name, application_sub_G.number_of_nodes(), application_sub_G.number_of_edges()))
+    if incremental:
+        incremental_graph_analysis(npm_G, application_name, rt_deps, dev_deps, outfile=f'{owner}-{repo}-{branch}', 
+            outfolder=out_folder, keywords=[keyword], filter_flag=FILTER_ENABLE, lock=lock)
+        return
+    application_sub_G = create_application_graph(npm_G, application_name, rt_deps, dev_deps, lock)
+    del npm_G
 
     # export dependency graph to HTML file
     # draw_plain_dependency_graph(G=application_sub_G, pname=application_name, outfile=os.path.join(out_folder, f'{application_name}_plain_graph.html'))
@@ -5,10 +5,14 @@ Zhe Chen (zkchen@uvic.ca)
 '''
 
 from utils import is_valid_key
+from configs import WEBGL_NODE_THRESHOLD
+from rem_profile import stage
 import plotly.graph_objects as go # create figure
 import plotly.express as px # colorscale
 import math # ceil
+import json
 import networkx as nx
+from plotly.utils import PlotlyJSONEncoder
 
 
 def dict_to_text(node: tuple, key: str) -> str:
@@ -86,6 +90,43 @@ def set_node_line_width(node: tuple) -> int:
     return 3 if is_valid_key(meta, 'deprecated') and meta['deprecated'] else 1
 
 
+def scatter_type(G: nx.Graph):
+    '''
+    WebGL traces for graphs with more than WEBGL_NODE_THRESHOLD nodes, svg otherwise
+    '''
+    return go.Scattergl if G.number_of_nodes() > WEBGL_NODE_THRESHOLD else go.Scatter
+
+
+def edge_traces(edges: list, pos: dict, legendgroup: str, name: str, width: float, scatter=go.Scatter) -> list:
+    '''
+    one line trace per edge color, edges are separated by None gaps
+    edges: list of (u, v, color)
+    the legend entry belongs to the color of the last edge and is drawn last
+    '''
+    if not edges:
+        return []
+    groups = {} # color: (x, y), in order of first appearance
+    for u, v, color in edges:
+        Xed, Yed = groups.setdefault(color, ([], []))
+        Xed += [pos[u][0], pos[v][0], None]
+        Yed += [pos[u][1], pos[v][1], None]
+    legend_color = edges[-1][2]
+    colors = [c for c in groups if c != legend_color] + [legend_color]
+    traces = []
+    for color in colors:
+        Xed, Yed = groups[color]
+        traces.append(scatter(
+            x=Xed[:-1],
+            y=Yed[:-1],
+            mode='lines',
+            legendgroup=legendgroup,
+            showlegend=(color == legend_color),
+            name=name if color == legend_color else None,
+            line=dict(color=color, width=width)
+        ))
+    return traces
+
+
 def plain_plotly_graph_to_html(G: nx.Graph, pname: str, pos: dict, title: str = '', outfile: str = 'plain_temp.html'):
     rt_sub_G = nx.DiGraph()
     # DEVELOPMENT
@@ -105,71 +146,22 @@ def plain_plotly_graph_to_html(G: nx.Graph, pname: str, pos: dict, title: str =
     Xv_gh_dev=[pos[n][0] for n in list(dev_sub_G.nodes())]
     Yv_gh_dev=[pos[n][1] for n in list(dev_sub_G.nodes())]
 
-    # edges
-    Xed_github_rt=[] # RUNTIME
-    Yed_github_rt=[]
-    Xed_github_dev=[] # DEVELOPMENT
-    Yed_github_dev=[]
-
-    # GITHUB RUNTIME
-    for u, v, m in list(rt_sub_G.edges(data=True)):
-        Xed_github_rt+=[pos[u][0],pos[v][0]]
-        Yed_github_rt+=[pos[u][1],pos[v][1]]
-        
-    # GITHUB DEVELOPMENT
-    for u, v, m in list(dev_sub_G.edges(data=True)):
-        Xed_github_dev+=[pos[u][0],pos[v][0]]
-        Yed_github_dev+=[pos[u][1],pos[v][1]]
-
     # vertice node color based on dependency type (filling)
     dir_list = list(G.neighbors(pname))
     v_scores_gh_rt=[set_plain_node_color(n, dir_list) for n in list(rt_sub_G.nodes(data=True))]
     v_scores_gh_dev=[set_plain_node_color(n, dir_list) for n in list(dev_sub_G.nodes(data=True))]
 
     # edge traces
+    scatter = scatter_type(G)
     data=[]
-    for i in range(0, len(Xed_github_rt)-2, 2):
-        data+=[go.Scatter(
-                x=Xed_github_rt[i:i+2],
-                y=Yed_github_rt[i:i+2],
-                mode='lines',
-                legendgroup="gh_rt",
-                showlegend=False,
-                line=dict(color='lightgrey', width=0.8)
-        )]
-
-    if len(Xed_github_rt) > 0:
-        data+=[go.Scatter(
-                x=Xed_github_rt[len(Xed_github_rt)-2:],
-                y=Yed_github_rt[len(Yed_github_rt)-2:],
-                mode='lines',
-                legendgroup="gh_rt",
-                name="runtime dependency relationships",
-                line=dict(color='lightgrey', width=0.8)
-        )]
-    for i in range(0, len(Xed_github_dev)-2, 2):
-        data+=[go.Scatter(
-            x=Xed_github_dev[i:i+2],
-            y=Yed_github_dev[i:i+2],
-            mode='lines',
-            legendgroup="gh_dev",
-            showlegend=False,
-            line=dict(color='lightgrey', width=3.2)
-        )]
-        
-    if len(Xed_github_dev) > 0:
-        data+=[go.Scatter(
-                x=Xed_github_dev[len(Xed_github_dev)-2:],
-                y=Yed_github_dev[len(Yed_github_dev)-2:],
-                mode='lines',
-                legendgroup="gh_dev",
-                name="development dependency relationships",
-                line=dict(color='lightgrey', width=3.2)
-        )]
+    data+=edge_traces([(u, v, 'lightgrey') for u, v in rt_sub_G.edges()], pos, 
+        legendgroup="gh_rt", name="runtime dependency relationships", width=0.8, scatter=scatter)
+    data+=edge_traces([(u, v, 'lightgrey') for u, v in dev_sub_G.edges()], pos, 
+        legendgroup="gh_dev", name="development dependency relationships", width=3.2, scatter=scatter)
 
     # node traces
     if len(Xv_gh_rt) > 0:
-        data+=[go.Scatter(x=Xv_gh_rt,
+        data+=[scatter(x=Xv_gh_rt,
                y=Yv_gh_rt,
                mode='markers',
                legendgroup="gh_rt",               
@@ -182,7 +174,7 @@ def plain_plotly_graph_to_html(G: nx.Graph, pname: str, pos: dict, title: str =
                              ),
                )]
     if len(Xv_gh_dev) > 0:
-        data+=[go.Scatter(x=Xv_gh_dev,
+        data+=[scatter(x=Xv_gh_dev,
                y=Yv_gh_dev,
                mode='markers',
                legendgroup="gh_dev",               
@@ -195,7 +187,14 @@ def plain_plotly_graph_to_html(G: nx.Graph, pname: str, pos: dict, title: str =
                              ),
                )]
     fig=go.Figure(data=data)
-    
+    set_graph_layout(fig, pos, title)
+    return fig.write_html(outfile)
+
+
+def set_graph_layout(fig: go.Figure, pos: dict, title: str):
+    '''
+    title, legend, hidden axes and axis ranges covering every node position
+    '''
     fig.update_layout(
         title=title,
         title_x=0.5,
@@ -213,8 +212,6 @@ def plain_plotly_graph_to_html(G: nx.Graph, pname: str, pos: dict, title: str =
     yoffset = (max(y_pos_list) - min(y_pos_list)) * 0.05
     fig.update_xaxes(range=[min(x_pos_list)-xoffset, max(x_pos_list)+xoffset])
     fig.update_yaxes(range=[min(y_pos_list)-yoffset, max(y_pos_list)+yoffset])
-    
-    return fig.write_html(outfile)
 
 
 def plotly_graph_to_html(G: nx.Graph, pos: dict, title: str = '', key: str = 'final', outfile: str = 'temp.html'):
@@ -225,6 +222,19 @@ def plotly_graph_to_html(G: nx.Graph, pos: dict, title: str = '', key: str = 'fi
     key       : display of nodes based on scores (final(default)|popularity|quality|maintenance)
     outfile   : output path for html file
     '''
+    with stage('render', file=outfile) as record:
+        fig=go.Figure(data=rem_graph_traces(G, pos, key))
+        set_graph_layout(fig, pos, title)
+        record.graph(G)
+    print(f'exporting REM dependency graph to {outfile}.')
+    with stage('write', file=outfile):
+        return fig.write_html(outfile)
+
+
+def rem_graph_traces(G: nx.Graph, pos: dict, key: str = 'final') -> list:
+    '''
+    edge and node traces of a REM graph, see plotly_graph_to_html
+    '''
     # separating runtime and development dependency networks
     # github software subgraph
     # RUNTIME
@@ -261,72 +271,19 @@ def plotly_graph_to_html(G: nx.Graph, pos: dict, title: str = '', key: str = 'fi
     v_text_gh_rt=[dict_to_text(n, key) for n in list(rt_sub_G.nodes(data=True))]
     v_text_gh_dev=[dict_to_text(n, key) for n in list(dev_sub_G.nodes(data=True))]
     
-    # edges
-    Xed_github_rt=[] # RUNTIME
-    Yed_github_rt=[]
-    Xed_github_dev=[] # DEVELOPMENT
-    Yed_github_dev=[]
-    # edge color lists
-    ed_color_github_rt=[]
-    ed_color_github_dev=[]
-    
-    # GITHUB RUNTIME
-    for u, v, m in list(rt_sub_G.edges(data=True)):
-        Xed_github_rt+=[pos[u][0],pos[v][0]]
-        Yed_github_rt+=[pos[u][1],pos[v][1]]
-        ed_color_github_rt+=[m['color']]*2
-        
-    # GITHUB DEVELOPMENT
-    for u, v, m in list(dev_sub_G.edges(data=True)):
-        Xed_github_dev+=[pos[u][0],pos[v][0]]
-        Yed_github_dev+=[pos[u][1],pos[v][1]]
-        ed_color_github_dev+=[m['color']]*2
-        
-    # edge traces
+    # edge traces, one per color
+    scatter = scatter_type(G)
     data=[]
-    for i in range(0, len(Xed_github_rt)-2, 2):
-        data+=[go.Scatter(
-                x=Xed_github_rt[i:i+2],
-                y=Yed_github_rt[i:i+2],
-                mode='lines',
-                legendgroup="gh_rt",
-                showlegend=False,
-                line=dict(color=ed_color_github_rt[i], width=0.8)
-        )]
-        
-    if len(Xed_github_rt) > 0:
-        data+=[go.Scatter(
-                x=Xed_github_rt[len(Xed_github_rt)-2:],
-                y=Yed_github_rt[len(Yed_github_rt)-2:],
-                mode='lines',
-                legendgroup="gh_rt",
-                name="runtime dependency relationships (dark-red means is affected by package deprecation)",
-                line=dict(color=ed_color_github_rt[len(ed_color_github_rt)-1], width=0.8)
-        )]
-    
-    for i in range(0, len(Xed_github_dev)-2, 2):
-        data+=[go.Scatter(
-            x=Xed_github_dev[i:i+2],
-            y=Yed_github_dev[i:i+2],
-            mode='lines',
-            legendgroup="gh_dev",
-            showlegend=False,
-            line=dict(color=ed_color_github_dev[i], width=3.2)
-        )]
-        
-    if len(Xed_github_dev) > 0:
-        data+=[go.Scatter(
-                x=Xed_github_dev[len(Xed_github_dev)-2:],
-                y=Yed_github_dev[len(Yed_github_dev)-2:],
-                mode='lines',
-                legendgroup="gh_dev",
-                name="development dependency relationships (dark-red means is affected by library deprecation)",
-                line=dict(color=ed_color_github_dev[len(ed_color_github_dev)-1], width=3.2)
-        )]
+    data+=edge_traces([(u, v, m['color']) for u, v, m in rt_sub_G.edges(data=True)], pos, legendgroup="gh_rt", 
+        name="runtime dependency relationships (dark-red means is affected by package deprecation)", 
+        width=0.8, scatter=scatter)
+    data+=edge_traces([(u, v, m['color']) for u, v, m in dev_sub_G.edges(data=True)], pos, legendgroup="gh_dev", 
+        name="development dependency relationships (dark-red means is affected by library deprecation)", 
+        width=3.2, scatter=scatter)
     
     # node traces
     if len(Xv_gh_rt) > 0:
-        data+=[go.Scatter(x=Xv_gh_rt,
+        data+=[scatter(x=Xv_gh_rt,
                y=Yv_gh_rt,
                mode='markers',
                legendgroup="gh_rt",               
@@ -349,7 +306,7 @@ def plotly_graph_to_html(G: nx.Graph, pos: dict, title: str = '', key: str = 'fi
                hovertemplate = '%{text}'
                )]
     if len(Xv_gh_dev) > 0:
-        data+=[go.Scatter(x=Xv_gh_dev,
+        data+=[scatter(x=Xv_gh_dev,
                y=Yv_gh_dev,
                mode='markers',
                legendgroup="gh_dev",               
@@ -372,29 +329,105 @@ def plotly_graph_to_html(G: nx.Graph, pos: dict, title: str = '', key: str = 'fi
                hovertemplate = '%{text}'
                )]
 
-    fig=go.Figure(data=data)
-    
-    fig.update_layout(
-        title=title,
-        title_x=0.5,
-        legend=dict(orientation="h", 
-                    font=dict(size=12)),
-        xaxis=go.layout.XAxis(showticklabels=False),
-        yaxis=go.layout.YAxis(showticklabels=False),
-        paper_bgcolor='white',
-        plot_bgcolor='white'
-    )
+    return data
+
+
+# draws the view selected in the dropdown from the shared positions and string table
+REM_VIEWS_SCRIPT = '''
+var gd = document.getElementById('{plot_id}');
+var rem = REM_VIEWS_DATA;
+var base = JSON.parse(JSON.stringify(gd.layout));
+function unpack(v) {
+    if (Array.isArray(v)) return v.map(unpack);
+    if (v === null || typeof v !== 'object') return v;
+    if ('_strings' in v) return v._strings.map(function(i) { return rem.strings[i]; });
+    var out = {};
+    for (var k in v) out[k] = unpack(v[k]);
+    return out;
+}
+function render(i) {
+    var traces = rem.views[i].traces.map(function(t) {
+        var trace = unpack(t);
+        trace.x = t.ids.map(function(j) { return j === null ? null : rem.x[j]; });
+        trace.y = t.ids.map(function(j) { return j === null ? null : rem.y[j]; });
+        delete trace.ids;
+        return trace;
+    });
+    var layout = JSON.parse(JSON.stringify(base));
+    layout.title.text = rem.views[i].title;
+    layout.updatemenus[0].active = i;
+    return Plotly.react(gd, traces, layout);
+}
+gd.on('plotly_buttonclicked', function(e) { render(e.active); });
+return render(0);
+'''
 
-    x_pos_list = [v[0] for v in pos.values()]
-    y_pos_list = [v[1] for v in pos.values()]
-    xoffset = (max(x_pos_list) - min(x_pos_list)) * 0.05
-    yoffset = (max(y_pos_list) - min(y_pos_list)) * 0.05
-    fig.update_xaxes(range=[min(x_pos_list)-xoffset, max(x_pos_list)+xoffset])
-    fig.update_yaxes(range=[min(y_pos_list)-yoffset, max(y_pos_list)+yoffset])
-    
-    print(f'exporting REM dependency graph to {outfile}.')
 
-    return fig.write_html(outfile)
+def _pack_strings(value, strings: dict):
+    '''
+    replace every list of strings in a trace by indices into a shared string table
+    '''
+    if isinstance(value, dict):
+        return {k: _pack_strings(v, strings) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, str) for v in value):
+            return {'_strings': [strings.setdefault(v, len(strings)) for v in value]}
+        return [_pack_strings(v, strings) for v in value]
+    return value
+
+
+def plotly_views_to_html(views: list, pos: dict, outfile: str = 'temp.html'):
+    '''
+    one html file showing several REM graphs of the same application, switched with a dropdown
+    views : list of (label, G, title, key), see plotly_graph_to_html
+    pos   : positions of every node of the graphs
+    positions are embedded once, the traces of each view reference nodes by index and
+    share a table of hover texts and colors
+    '''
+    index = {}
+    for n in pos:
+        index[n] = len(index)
+    # traces drawn on node indices, mapped to positions in the browser
+    index_pos = {n: (i, i) for n, i in index.items()}
+    strings = {}
+    packed_views = []
+    for label, G, title, key in views:
+        traces = []
+        with stage('render', file=outfile, view=label) as record:
+            for trace in rem_graph_traces(G, index_pos, key):
+                trace = trace.to_plotly_json()
+                ids = list(trace.pop('x'))
+                trace.pop('y')
+                trace = _pack_strings(trace, strings)
+                trace['ids'] = ids
+                traces.append(trace)
+            record.graph(G)
+        packed_views.append({'title': title, 'traces': traces})
+    data = {
+        'x': [pos[n][0] for n in index],
+        'y': [pos[n][1] for n in index],
+        'strings': list(strings),
+        'views': packed_views
+    }
+
+    fig=go.Figure()
+    set_graph_layout(fig, pos, views[0][2])
+    fig.update_layout(
+        uirevision='rem', # keep zoom and legend state when switching views
+        updatemenus=[dict(
+            buttons=[dict(label=label, method='skip', args=[None]) for label, G, title, key in views],
+            active=0,
+            direction='down',
+            x=0,
+            xanchor='left',
+            y=1.1,
+            yanchor='top'
+        )]
+    )
+    print(f'exporting {len(views)} REM dependency graphs to {outfile}.')
+    with stage('write', file=outfile):
+        data_json = json.dumps(data, cls=PlotlyJSONEncoder).replace('</', '<\\/')
+        return fig.write_html(outfile, post_script=REM_VIEWS_SCRIPT.replace('REM_VIEWS_DATA', data_json))
 
 
 def assign_graph_node_symbol(full_G: nx.Graph, filtered_G: nx.Graph):
@@ -0,0 +1,286 @@
+'''
+incremental REM analysis of an application whose package.json changes between runs
+
+the state of the last run of every application is kept in INCREMENTAL_STATE_DIR:
+    packages            : the packages of the closure and their dependency relationships,
+                          the closure of a new run only reads the added direct dependencies
+                          from the NPM graph
+    runtime/development : signature of the sub-graph, ripple effect nodes and edges,
+                          subgraph minimums and filtered graphs of every keyword
+    graph, pos          : signature of the application graph and its layout
+    summaries, outputs  : what was written, and the size and mtime of every output file
+
+a sub-graph (runtime or development) with the same signature as in the last run is
+identical, its ripple effect, minimums and filtered graphs are taken over instead of
+recomputed. e.g. a new devDependency only recomputes the development side. the layout
+and the rendering are of the whole graph, they are reused only if the graph did not change
+(REM graphs of a keyword are written again if they were removed or modified).
+the output is the same as project_graph_analysis_multi on the same graph.
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import networkx as nx
+from collections import deque
+from configs import (INCREMENTAL_STATE_DIR, JSONMODE, JSONMODE_FORMAT, JSONMODE_GZIP, LAYOUT_ENGINE,
+    NPMDB, NPMGRAPH_BACKEND, NPMJSON, NPMSNAPSHOT, WEBGL_NODE_THRESHOLD)
+from npm_snapshot import NPMSnapshot, db_fingerprint
+from npm_sqlite import NPMDatabase
+from npm_lockfile import Lockfile
+from rem_graph_analysis import prepare_project_analysis, render_project_analysis
+from rem_profile import stage
+from utils import create_application_graph, graph_accessors
+
+STATE_VERSION = 1
+DEPENDENCY_FLAGS = {'runtime': 'rt', 'development': 'dev'}
+# constraints of the direct dependencies are only written by the node_link json,
+# a new constraint does not change the closure (latest versions) or any other output
+CONSTRAINT_KEYS = [] if JSONMODE and JSONMODE_FORMAT == 'node_link' else ['runtime_constraint', 'dev_constraint']
+
+
+def state_path(application_name: str, state_dir: str = INCREMENTAL_STATE_DIR) -> str:
+    safe_name = re.sub(r'[^\w.-]+', '_', application_name)
+    digest = hashlib.sha1(application_name.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(state_dir, f'{safe_name}-{digest}.pickle')
+
+
+def read_state(application_name: str, state_dir: str = INCREMENTAL_STATE_DIR):
+    '''
+    state of the last run, None if there is none or it can not be used
+    '''
+    path = state_path(application_name, state_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as sfile:
+            state = pickle.load(sfile)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        print(f'incremental state [{path}] can not be read, running a full analysis')
+        return None
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION \
+        or state.get('application') != application_name:
+        print(f'incremental state [{path}] is outdated, running a full analysis')
+        return None
+    return state
+
+
+def write_state(state: dict, state_dir: str = INCREMENTAL_STATE_DIR) -> str:
+    os.makedirs(state_dir, exist_ok=True)
+    path = state_path(state['application'], state_dir)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as sfile:
+        pickle.dump(state, sfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return path
+
+
+def npm_fingerprint(npm_G):
+    '''
+    backend and size and mtime of the file the NPM graph was loaded from,
+    None if it is not known (the package cache is not used)
+    '''
+    if isinstance(npm_G, NPMDatabase):
+        path = npm_G.db_path
+    elif isinstance(npm_G, NPMSnapshot):
+        path = {'snapshot': NPMSNAPSHOT, 'sqlite': NPMDB, 'json': NPMJSON}.get(NPMGRAPH_BACKEND)
+    else:
+        return None
+    if path is None or not os.path.isfile(path):
+        return None
+    return dict(db_fingerprint(path), backend=NPMGRAPH_BACKEND, path=os.path.abspath(path))
+
+
+def _signature(items) -> str:
+    # json instead of pickle, whose output depends on which objects are shared
+    return hashlib.sha1(json.dumps(items, default=repr).encode('utf-8')).hexdigest()
+
+
+def _edge_meta(u, m: dict, pname: str) -> dict:
+    if u != pname or not CONSTRAINT_KEYS:
+        return m
+    return {k: val for k, val in m.items() if k not in CONSTRAINT_KEYS}
+
+
+def graph_signature(G: nx.Graph, pname: str) -> str:
+    '''
+    nodes and edges with their attributes, in insertion order, see CONSTRAINT_KEYS
+    '''
+    return _signature((list(G.nodes(data=True)), [(u, v, _edge_meta(u, m, pname)) for u, v, m in G.edges(data=True)]))
+
+
+def dependency_signature(G: nx.Graph, pname: str, flag: str) -> str:
+    '''
+    signature of the runtime or development sub-graph split from G (see prepare_project_analysis),
+    equal signatures give sub-graphs with the same REM analysis
+    '''
+    nodes = G.nodes()
+    return _signature((nodes[pname], [(u, nodes[u], v, nodes[v], _edge_meta(u, m, pname))
+        for u, v, m in G.edges(data=True) if m.get(flag) is True]))
+
+
+def output_stats(summaries: list) -> dict:
+    '''
+    {path: (size, mtime)} of the files written by an analysis, None for missing files
+    '''
+    stats = {}
+    for summary in summaries:
+        for path in summary['outputs'].values():
+            try:
+                st = os.stat(path)
+                stats[path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                stats[path] = None
+    return stats
+
+
+def package_graph(G: nx.Graph, pname: str) -> nx.DiGraph:
+    '''
+    packages of an application graph and their dependency relationships, as in the NPM graph
+    '''
+    packages_G = nx.DiGraph()
+    for n, meta in G.nodes(data=True):
+        if n != pname:
+            packages_G.add_node(n, **meta)
+    for u, v, m in G.edges(data=True):
+        if u != pname:
+            packages_G.add_edge(u, v, **{k: val for k, val in m.items() if k not in DEPENDENCY_FLAGS})
+    return packages_G
+
+
+def package_closure(npm_G, names: list) -> nx.DiGraph:
+    '''
+    packages reachable from names in the NPM graph, see utils.dependency_closure
+    '''
+    if isinstance(npm_G, NPMDatabase):
+        npm_G = NPMSnapshot.from_rows(*npm_G.closure_rows(names))
+    key_of, name_of, node_attributes, successor_items = graph_accessors(npm_G)
+    packages_G = nx.DiGraph()
+    queue = deque()
+    for name in names:
+        if name in packages_G:
+            continue
+        key = key_of(name)
+        if key is None:
+            packages_G.add_node(name) # not an NPM package
+        else:
+            packages_G.add_node(name, **node_attributes(key))
+            queue.append((name, key))
+    while queue:
+        name, key = queue.popleft()
+        for dep_key, meta in successor_items(key):
+            dep_name = name_of(dep_key)
+            if dep_name not in packages_G:
+                packages_G.add_node(dep_name, **node_attributes(dep_key))
+                queue.append((dep_name, dep_key))
+            packages_G.add_edge(name, dep_name, **meta)
+    return packages_G
+
+
+def print_dependency_changes(label: str, old: dict, new: dict):
+    added = [n for n in new if n not in old]
+    removed = [n for n in old if n not in new]
+    changed = [n for n in new if n in old and str(old[n]) != str(new[n])]
+    print('{} dependencies: {:,} added, {:,} removed, {:,} changed'
+        .format(label, len(added), len(removed), len(changed)))
+    for n in added:
+        print(f'  + {n} : {new[n]}')
+    for n in removed:
+        print(f'  - {n} : {old[n]}')
+    for n in changed:
+        print(f'  ~ {n} : {old[n]} -> {new[n]}')
+
+
+def incremental_graph_analysis(npm_G, application_name: str, rt_deps: dict, dev_deps: dict, outfile: str,
+    outfolder: str, keywords: list, filter_flag: bool, lock: Lockfile = None) -> list:
+    '''
+    same as create_application_graph followed by project_graph_analysis_multi, the parts of the
+    last run of the application that did not change are taken over, see the module docstring
+    outfile: prefix, REM graphs of each keyword are written to <outfile>_<keyword>
+    returns the list of per-keyword summaries
+    '''
+    rt_deps, dev_deps = dict(rt_deps or {}), dict(dev_deps or {})
+    state = read_state(application_name)
+    fingerprint = npm_fingerprint(npm_G)
+    settings = {'keywords': list(keywords), 'filter_flag': filter_flag, 'outfile': outfile, 'outfolder': outfolder,
+        'jsonmode': (JSONMODE, JSONMODE_FORMAT, JSONMODE_GZIP), 'layout_engine': LAYOUT_ENGINE,
+        'webgl_node_threshold': WEBGL_NODE_THRESHOLD}
+
+    ''' 1. application graph, the closure of unchanged direct dependencies is not read again '''
+    if state is None:
+        print('no incremental state of {}, running a full analysis'.format(application_name))
+        state = {}
+    else:
+        print_dependency_changes('runtime', state['rt_deps'], rt_deps)
+        print_dependency_changes('development', state['dev_deps'], dev_deps)
+    cached_G = state.get('packages') if state.get('npm') == fingerprint and fingerprint is not None else None
+    if lock is not None or cached_G is None:
+        G = create_application_graph(npm_G, application_name, rt_deps, dev_deps, lock)
+    else:
+        new_names = [n for n in map(str, list(rt_deps) + list(dev_deps)) if n not in cached_G]
+        print('{:,} packages of the last run, {:,} new direct dependencies read from the NPM graph'
+            .format(cached_G.number_of_nodes(), len(new_names)))
+        packages_G = nx.compose(cached_G, package_closure(npm_G, new_names)) if new_names else cached_G
+        G = create_application_graph(packages_G, application_name, rt_deps, dev_deps)
+
+    with stage('signature') as record:
+        signatures = {flag: dependency_signature(G, application_name, flag) for flag in DEPENDENCY_FLAGS}
+        signature = graph_signature(G, application_name)
+        record.graph(G)
+
+    ''' 2. nothing changed, only the REM graphs that were removed or modified are written again '''
+    rendered = {}
+    if state.get('graph') == signature and state.get('settings') == settings:
+        stats = output_stats(state['summaries'])
+        rendered = {summary['keyword']: summary for summary in state['summaries'] 
+            if all(stats[path] is not None and stats[path] == state['outputs'][path] for path in summary['outputs'].values())}
+    if len(rendered) == len(keywords):
+        print('REM graphs of {} are up to date'.format(application_name))
+        state['rt_deps'], state['dev_deps'] = rt_deps, dev_deps
+        write_state(state)
+        return state['summaries']
+
+    ''' 3. REM pipeline, unchanged runtime or development sub-graphs are taken over '''
+    reuse = {}
+    for flag in DEPENDENCY_FLAGS:
+        if flag in state and state[flag]['signature'] == signatures[flag]:
+            print(f'{flag} dependencies are unchanged, reusing their ripple effect, minimums and filters')
+            reuse[flag] = state[flag]
+    if state.get('graph') == signature and state.get('layout_engine') == LAYOUT_ENGINE:
+        reuse['pos'] = state['pos']
+    analysis = prepare_project_analysis(G=G, pname=application_name,
+        keywords=keywords if filter_flag else [], reuse=reuse)
+    summaries = [rendered[keyword] if keyword in rendered else 
+        render_project_analysis(analysis=analysis, outfile=f'{outfile}_{keyword}', outfolder=outfolder,
+        keyword=keyword, filter_flag=filter_flag) for keyword in keywords]
+
+    ''' 4. state of this run '''
+    new_state = {
+        'version': STATE_VERSION,
+        'application': application_name,
+        'rt_deps': rt_deps,
+        'dev_deps': dev_deps,
+        'npm': fingerprint,
+        'packages': package_graph(G, application_name) if lock is None else None,
+        'settings': settings,
+        'graph': signature,
+        'layout_engine': LAYOUT_ENGINE,
+        'pos': analysis['pos'],
+        'summaries': summaries,
+        'outputs': output_stats(summaries)
+    }
+    for flag, prefix in DEPENDENCY_FLAGS.items():
+        new_state[flag] = {
+            'signature': signatures[flag],
+            'ripple_nodes': analysis[prefix+'_ripple_nodes'],
+            'ripple_edges': analysis[prefix+'_ripple_edges'],
+            'minimum': analysis[prefix+'_minimum'],
+            'filtered': analysis[prefix+'_filtered']
+        }
+    with stage('write', file=state_path(application_name)):
+        print('incremental state written to [{}]'.format(write_state(new_state)))
+    return summaries
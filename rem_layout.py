@@ -0,0 +1,492 @@
+'''
+graph layouts for REM graphs with a persistent content-addressed cache
+
+LAYOUT_ENGINE selects how layouts are computed: 'layered' is an in-process
+hierarchical (sugiyama) layout rooted at the application, 'pydot' runs graphviz
+through pydot. layered layout steps:
+    1. cycle breaking: edges against the greedy order of eades, lin and smyth are reversed
+    2. layer assignment: longest path from the root
+    3. crossing reduction: barycentre sweeps down and up the layers
+    4. coordinate assignment: every node is placed at the barycentre of its
+       neighbours, overlapping nodes of a layer are pushed apart
+long edges to the same node share a chain of dummy nodes, which take space in the
+layers they cross.
+
+layouts are keyed by a hash of the graph's node and edge sets, the root and
+the layout engine, and stored as one json file per layout in LAYOUT_CACHE_DIR.
+the least recently used layouts are evicted when the cache grows beyond
+LAYOUT_CACHE_MAX_BYTES.
+
+Usage: python3 rem_layout.py [stats|clear]
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import hashlib
+import heapq
+import json
+import os
+import sys
+import networkx as nx
+import numpy as np
+from configs import LAYOUT_CACHE_DIR, LAYOUT_CACHE_ENABLE, LAYOUT_CACHE_MAX_BYTES, LAYOUT_ENGINE
+
+STATS_FILE = 'stats.json'
+LAYOUT_ENGINES = ['layered', 'pydot']
+# distances of the layered layout, in points like graphviz dot (0.75in wide nodes, 0.5in rank separation)
+LAYER_SEP = 72
+NODE_SEP = 72
+LAYERED_SWEEPS = 6 # barycentre sweeps of the crossing reduction, alternately down and up
+LAYERED_PLACEMENT_SWEEPS = 4 # sweeps of the coordinate assignment
+
+# counters of the current process
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def layout_cache_key(G: nx.Graph, root: str, prog: str) -> str:
+    '''
+    canonical hash of the graph structure, independent of node and edge insertion order
+    '''
+    h = hashlib.sha256()
+    h.update(json.dumps([prog, str(root)]).encode('utf-8'))
+    for n in sorted(str(n) for n in G.nodes()):
+        h.update(b'n')
+        h.update(n.encode('utf-8'))
+        h.update(b'\0')
+    for u, v in sorted((str(u), str(v)) for u, v in G.edges()):
+        h.update(b'e')
+        h.update(u.encode('utf-8'))
+        h.update(b'\0')
+        h.update(v.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _cache_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key+'.json')
+
+
+def cache_get(key: str, cache_dir: str = LAYOUT_CACHE_DIR):
+    path = _cache_path(key, cache_dir)
+    try:
+        with open(path, 'r') as lfile:
+            pos = {n: tuple(p) for n, p in json.load(lfile).items()}
+    except (OSError, ValueError):
+        return None
+    # mark as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return pos
+
+
+def cache_put(key: str, pos: dict, cache_dir: str = LAYOUT_CACHE_DIR, max_bytes: int = LAYOUT_CACHE_MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(key, cache_dir)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as lfile:
+        json.dump(pos, lfile)
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str = LAYOUT_CACHE_DIR, max_bytes: int = LAYOUT_CACHE_MAX_BYTES) -> int:
+    '''
+    remove least recently used layouts until the cache fits in max_bytes
+    returns the number of evicted layouts
+    '''
+    entries = []
+    total = 0
+    for fi in os.listdir(cache_dir):
+        if not fi.endswith('.json') or fi == STATS_FILE:
+            continue
+        try:
+            st = os.stat(os.path.join(cache_dir, fi))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fi))
+        total += st.st_size
+    evicted = 0
+    for mtime, size, fi in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, fi))
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    _stats['evictions'] += evicted
+    return evicted
+
+
+def _record(event: str, cache_dir: str = LAYOUT_CACHE_DIR):
+    '''
+    update the process and the persistent hit/miss counters
+    '''
+    _stats[event] += 1
+    path = os.path.join(cache_dir, STATS_FILE)
+    stats = read_cache_stats(cache_dir)
+    stats[event] = stats.get(event, 0) + 1
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'w') as sfile:
+            json.dump(stats, sfile)
+    except OSError:
+        pass
+
+
+def read_cache_stats(cache_dir: str = LAYOUT_CACHE_DIR) -> dict:
+    '''
+    persistent statistics of the cache: hits, misses, number of layouts and size
+    '''
+    stats = {'hits': 0, 'misses': 0}
+    try:
+        with open(os.path.join(cache_dir, STATS_FILE), 'r') as sfile:
+            stats.update(json.load(sfile))
+    except (OSError, ValueError):
+        pass
+    return stats
+
+
+def layout_cache_stats() -> dict:
+    '''
+    hits, misses and evictions in the current process
+    '''
+    return dict(_stats)
+
+
+def _preorder(indptr: list, targets: list, root: int) -> list:
+    '''
+    depth-first preorder from root, then from the nodes not reached yet
+    '''
+    n = len(indptr) - 1
+    visited = [False] * n
+    preorder = []
+    for start in [root] + list(range(n)):
+        if visited[start]:
+            continue
+        stack = [start]
+        while stack:
+            u = stack.pop()
+            if visited[u]:
+                continue
+            visited[u] = True
+            preorder.append(u)
+            stack.extend(v for v in reversed(targets[indptr[u]:indptr[u+1]]) if not visited[v])
+    return preorder
+
+
+def _feedback_order(indptr: list, targets: list, root: int) -> list:
+    '''
+    greedy node order of eades, lin and smyth, few edges point backwards: sinks are taken
+    from the end, sources and then the node with the most outgoing over incoming edges from the start
+    '''
+    n = len(indptr) - 1
+    predecessors = [[] for _ in range(n)]
+    for u in range(n):
+        for v in targets[indptr[u]:indptr[u+1]]:
+            predecessors[v].append(u)
+    outdeg = [indptr[u+1] - indptr[u] for u in range(n)]
+    indeg = [len(p) for p in predecessors]
+    removed = [False] * n
+    sinks = [u for u in range(n) if outdeg[u] == 0]
+    sources = [u for u in range(n) if indeg[u] == 0 and outdeg[u] > 0 and u != root]
+    if indeg[root] == 0 and outdeg[root] > 0:
+        sources.append(root) # taken first
+    heap = [(indeg[u] - outdeg[u], u) for u in range(n) if indeg[u] > 0 and outdeg[u] > 0]
+    heapq.heapify(heap)
+    head, tail = [], []
+    while len(head) + len(tail) < n:
+        if sinks:
+            u = sinks.pop()
+            if removed[u]:
+                continue
+            tail.append(u)
+        elif sources:
+            u = sources.pop()
+            if removed[u]:
+                continue
+            head.append(u)
+        else:
+            delta, u = heapq.heappop(heap)
+            if removed[u] or delta != indeg[u] - outdeg[u]:
+                continue # outdated entry
+            head.append(u)
+        removed[u] = True
+        for v in targets[indptr[u]:indptr[u+1]]:
+            if not removed[v]:
+                indeg[v] -= 1
+                if indeg[v] == 0:
+                    sources.append(v)
+                else:
+                    heapq.heappush(heap, (indeg[v] - outdeg[v], v))
+        for v in predecessors[u]:
+            if not removed[v]:
+                outdeg[v] -= 1
+                if outdeg[v] == 0:
+                    sinks.append(v)
+                else:
+                    heapq.heappush(heap, (indeg[v] - outdeg[v], v))
+    return head + tail[::-1]
+
+
+def _place(desired: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    '''
+    positions of the nodes of a layer, in order, closest to the desired positions without
+    overlapping their widths: the average of pushing overlapping nodes right and left
+    '''
+    offset = np.concatenate(([0], np.cumsum((widths[:-1] + widths[1:]) / 2)))
+    right = np.maximum.accumulate(desired - offset) + offset
+    left = np.minimum.accumulate((desired - offset)[::-1])[::-1] + offset
+    return (right + left) / 2
+
+
+def _inversions(values: np.ndarray, bits: int) -> int:
+    '''
+    number of pairs i < j with values[i] > values[j], values sorted by their bits above <bits>
+    the values are partitioned by one more bit at a time, stable within groups of equal higher bits
+    '''
+    m = len(values)
+    total = 0
+    position = np.arange(m)
+    for k in range(bits-1, -1, -1):
+        group = values >> (k+1)
+        start = np.ones(m, dtype=bool)
+        start[1:] = group[1:] != group[:-1]
+        starts = np.flatnonzero(start)
+        first = np.maximum.accumulate(np.where(start, position, 0))
+        bit = (values >> k) & 1
+        # pairs of the group where the earlier value has bit k set and the later not
+        ones = np.cumsum(bit) - bit
+        ones_before = ones - ones[first]
+        total += int(ones_before[bit == 0].sum())
+        zeros_before = position - first - ones_before
+        num_zeros = np.add.reduceat(1 - bit, starts)[np.cumsum(start) - 1]
+        partitioned = np.empty_like(values)
+        partitioned[np.where(bit == 0, first + zeros_before, first + num_zeros + ones_before)] = values
+        values = partitioned
+    return total
+
+
+def _crossings(src: np.ndarray, dst: np.ndarray, layer: np.ndarray, order: np.ndarray) -> int:
+    '''
+    edge crossings between adjacent layers, edges go from layer l to l+1
+    '''
+    if len(src) < 2:
+        return 0
+    bits = int(order.max()).bit_length()
+    upper = (layer[src] << bits) | order[src]
+    values = np.sort((upper << bits) | order[dst])
+    return _inversions((values >> (2*bits) << bits) | (values & ((1 << bits) - 1)), bits)
+
+
+def _layered_graph(G: nx.Graph, root: str) -> tuple:
+    '''
+    (node names, edge sources, edge targets, layers, depth-first ranks) of the layered graph:
+    cycles broken, layers assigned and long edges split by dummy nodes numbered after the nodes of G
+    '''
+    names = sorted(G.nodes(), key=str)
+    n = len(names)
+    ids = {name: i for i, name in enumerate(names)}
+    edges = np.array([(ids[u], ids[v]) for u, v in G.edges() if u != v], dtype=np.int64).reshape(-1, 2)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    src, dst = edges[:, 0], edges[:, 1]
+    indptr = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+    root_id = ids[root] if root in ids else 0
+    indptr, targets = indptr.tolist(), dst.tolist()
+    preorder = _preorder(indptr, targets, root_id)
+
+    # 1. cycle breaking, edges pointing backwards in the feedback order are reversed
+    order = _feedback_order(indptr, targets, root_id)
+    position = np.empty(n, dtype=np.int64)
+    position[np.array(order, dtype=np.int64)] = np.arange(n)
+    back = position[src] > position[dst]
+    src, dst = np.where(back, dst, src), np.where(back, src, dst)
+    by_src = np.argsort(src, kind='stable')
+    dag_indptr = np.zeros(n+1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=dag_indptr[1:])
+    dag_indptr, dag_dst = dag_indptr.tolist(), dst[by_src].tolist()
+
+    # 2. layer assignment, longest path from the sources in the feedback order (a topological order)
+    layer = [0] * n
+    for u in order:
+        lu = layer[u] + 1
+        for v in dag_dst[dag_indptr[u]:dag_indptr[u+1]]:
+            if layer[v] < lu:
+                layer[v] = lu
+    layer = np.array(layer, dtype=np.int64)
+    rank = np.empty(n, dtype=np.float64)
+    rank[np.array(preorder, dtype=np.int64)] = np.arange(n)
+
+    # long edges to the same node are split by a shared chain of dummy nodes, one in every layer
+    # they cross, like the concentrated edges of graphviz
+    long = layer[dst] - layer[src] > 1
+    long_src, long_dst = src[long], dst[long]
+    targets, chain_of = np.unique(long_dst, return_inverse=True)
+    top = layer[targets].copy()
+    np.minimum.at(top, chain_of, layer[long_src] + 1)
+    dummies = layer[targets] - top
+    first = n + np.cumsum(dummies) - dummies
+    chain = np.repeat(np.arange(len(targets)), dummies)
+    step = np.arange(n, n + int(dummies.sum())) - first[chain] # 0.. in every chain
+    inner = (first[chain] + step)[step < dummies[chain] - 1]
+    src = np.concatenate((src[~long], long_src, inner, first + dummies - 1))
+    dst = np.concatenate((dst[~long], first[chain_of] + layer[long_src] + 1 - top[chain_of], inner + 1, targets))
+    layer = np.concatenate((layer, top[chain] + step))
+    # dummy nodes start next to the node their chain leads to
+    rank = np.concatenate((rank, rank[targets][chain]))
+    return (names, src, dst, layer, rank)
+
+
+def _by_layer(keys: np.ndarray, num_layers: int) -> tuple:
+    '''
+    (indices sorted by layer, start of every layer) of the layer keys
+    '''
+    indices = np.argsort(keys, kind='stable')
+    return (indices, np.searchsorted(keys[indices], np.arange(num_layers+1)))
+
+
+def _sweeps(layers: list, src: np.ndarray, dst: np.ndarray, layer: np.ndarray, sweeps: int):
+    '''
+    alternately down and up the layers: (layer nodes, neighbours, adjacent) of every layer and
+    None after every sweep, neighbours[i] in the previous layer of the sweep is adjacent to adjacent[i]
+    '''
+    num_layers = len(layers)
+    down, down_bounds = _by_layer(layer[dst], num_layers)
+    up, up_bounds = _by_layer(layer[src], num_layers)
+    for sweep in range(sweeps):
+        if sweep % 2 == 0:
+            for l in range(1, num_layers):
+                e = down[down_bounds[l]:down_bounds[l+1]]
+                yield (layers[l], src[e], dst[e])
+        else:
+            for l in range(num_layers-2, -1, -1):
+                e = up[up_bounds[l]:up_bounds[l+1]]
+                yield (layers[l], dst[e], src[e])
+        yield None # end of the sweep
+
+
+def _barycentres(nodes: np.ndarray, neighbours: np.ndarray, adjacent: np.ndarray, slot: np.ndarray,
+    values: np.ndarray) -> np.ndarray:
+    '''
+    mean value of the neighbours of every node of a layer, its own value without neighbours
+    '''
+    count = np.bincount(slot[adjacent], minlength=len(nodes))
+    total = np.bincount(slot[adjacent], weights=values[neighbours], minlength=len(nodes))
+    return np.where(count > 0, total / np.maximum(count, 1), values[nodes])
+
+
+def layered_layout(G: nx.Graph, root: str, layer_sep: float = LAYER_SEP, node_sep: float = NODE_SEP,
+    sweeps: int = LAYERED_SWEEPS) -> dict:
+    '''
+    hierarchical layout of G with root on top, see the module docstring
+    the layout only depends on the node and edge sets of G
+    '''
+    if G.number_of_nodes() == 0:
+        return {}
+    names, src, dst, layer, rank = _layered_graph(G, root)
+    n = len(names)
+    num_layers = int(layer.max()) + 1
+    # nodes of every layer, slot: index of a node in its layer
+    by_layer = np.lexsort((rank, layer))
+    bounds = np.searchsorted(layer[by_layer], np.arange(num_layers+1))
+    layers = [by_layer[bounds[l]:bounds[l+1]] for l in range(num_layers)]
+    slot = np.empty(len(layer), dtype=np.int64)
+    for nodes in layers:
+        slot[nodes] = np.arange(len(nodes))
+
+    # 3. crossing reduction, order: position of a node in its layer, starting in depth-first order
+    order = slot.astype(np.float64)
+    best, fewest = order.copy(), _crossings(src, dst, layer, slot)
+    for step in _sweeps(layers, src, dst, layer, sweeps):
+        if step is None:
+            crossings = _crossings(src, dst, layer, order.astype(np.int64))
+            if crossings < fewest:
+                best, fewest = order.copy(), crossings
+            continue
+        nodes, neighbours, adjacent = step
+        barycentre = _barycentres(nodes, neighbours, adjacent, slot, order)
+        order[nodes[np.lexsort((order[nodes], barycentre))]] = np.arange(len(nodes))
+
+    # 4. coordinate assignment, nodes move towards the barycentre of their neighbours in the best order
+    # dummy nodes are narrower than nodes, like graphviz
+    widths = np.full(len(layer), node_sep / 4)
+    widths[:n] = node_sep
+    x = np.empty(len(layer), dtype=np.float64)
+    for l, nodes in enumerate(layers):
+        nodes = nodes[np.argsort(best[nodes], kind='stable')]
+        layers[l] = nodes
+        slot[nodes] = np.arange(len(nodes))
+        x[nodes] = _place(np.zeros(len(nodes)), widths[nodes])
+    for step in _sweeps(layers, src, dst, layer, LAYERED_PLACEMENT_SWEEPS):
+        if step is None:
+            continue
+        nodes, neighbours, adjacent = step
+        x[nodes] = _place(_barycentres(nodes, neighbours, adjacent, slot, x), widths[nodes])
+
+    # graphviz coordinates: positive, y grows upwards
+    x = x[:n] - x[:n].min() + node_sep / 2
+    y = (num_layers - 1 - layer[:n]) * layer_sep + layer_sep / 2
+    return {name: (float(x[i]), float(y[i])) for i, name in enumerate(names)}
+
+
+def compute_layout(G: nx.Graph, root: str, prog: str = 'dot', engine: str = LAYOUT_ENGINE) -> dict:
+    '''
+    node positions of G by the layout engine, prog is the graphviz program of the pydot engine
+    '''
+    if engine == 'pydot':
+        return nx.nx_pydot.graphviz_layout(G, prog=prog, root=root)
+    if engine == 'layered':
+        return layered_layout(G, root)
+    raise ValueError(f'unknown layout engine [{engine}], one of {LAYOUT_ENGINES}')
+
+
+def graph_layout(G: nx.Graph, root: str, prog: str = 'dot', engine: str = LAYOUT_ENGINE) -> dict:
+    '''
+    node positions of G, computed by the layout engine or read from the layout cache
+    '''
+    if not LAYOUT_CACHE_ENABLE:
+        return compute_layout(G, root, prog, engine)
+    # layouts of the pydot engine keep their keys of earlier versions
+    key = layout_cache_key(G, root, prog if engine == 'pydot' else engine)
+    pos = cache_get(key)
+    if pos is not None and all(n in pos for n in G.nodes()):
+        _record('hits')
+        print(f'layout cache hit [{key[:12]}]')
+        return pos
+    _record('misses')
+    pos = compute_layout(G, root, prog, engine)
+    try:
+        cache_put(key, pos)
+    except OSError as e:
+        print(f'layout cache not updated: {e}')
+    return pos
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command not in ['stats', 'clear']:
+        sys.exit('Usage: python3 rem_layout.py [stats|clear]')
+    if not os.path.isdir(LAYOUT_CACHE_DIR):
+        print(f'layout cache [{LAYOUT_CACHE_DIR}] is empty')
+        return
+    layouts = [fi for fi in os.listdir(LAYOUT_CACHE_DIR) if fi.endswith('.json') and fi != STATS_FILE]
+    if command == 'clear':
+        for fi in os.listdir(LAYOUT_CACHE_DIR):
+            os.remove(os.path.join(LAYOUT_CACHE_DIR, fi))
+        print(f'removed {len(layouts):,} layouts from [{LAYOUT_CACHE_DIR}]')
+        return
+    stats = read_cache_stats()
+    size = sum(os.path.getsize(os.path.join(LAYOUT_CACHE_DIR, fi)) for fi in layouts)
+    lookups = stats['hits'] + stats['misses']
+    print('layout cache [{}]: {:,} layouts, {:,} bytes (limit {:,})'.format(LAYOUT_CACHE_DIR, len(layouts), size, LAYOUT_CACHE_MAX_BYTES))
+    print('hits: {:,}, misses: {:,}, hit rate: {:.1f}%'
+        .format(stats['hits'], stats['misses'], 100 * stats['hits'] / lookups if lookups else 0))
+
+
+if __name__ == '__main__':
+    main()
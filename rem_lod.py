@@ -0,0 +1,381 @@
+'''
+level-of-detail REM viewer for large dependency graphs
+
+the html file only holds the core of the REM graph: the application, its direct
+dependencies and the ripple effect paths of deprecated packages. the dependencies
+of every direct dependency are written to a separate chunk <outfile>_lod/<i>.js,
+loaded as a script (works from file://) when the direct dependency is clicked and
+drawn at its position in the layout of the application. the time to first paint
+depends on the size of the core, not of the whole graph.
+
+graphs are drawn on a canvas, the metric of health is selected in the viewer.
+parts (core and chunks) are columnar:
+    nodes, x, y, version  : one entry per node
+    deprecated            : indices of deprecated nodes
+    scores                : {metric: one score per node}
+    edges                 : flat [u, v, flags, ...] with node indices, flags
+                            1: runtime, 2: development, 4: ripple effect of deprecation
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import html
+import json
+import os
+import networkx as nx
+import plotly.express as px # colorscale
+from configs import KEYWORDS
+from rem_profile import stage
+
+RUNTIME, DEVELOPMENT, RIPPLE = 1, 2, 4
+
+
+def lod_part(G: nx.Graph, pos: dict, nodes: list, edges: list, ripple_edges: set, keywords: list = KEYWORDS) -> dict:
+    '''
+    columnar nodes and edges of a part of the viewer, see the module docstring
+    '''
+    index = {n: i for i, n in enumerate(nodes)}
+    meta = [G.nodes()[n] for n in nodes]
+    flat_edges = []
+    for u, v in edges:
+        m = G.edges()[u, v]
+        flags = (RUNTIME if m.get('runtime') is True else 0) | (DEVELOPMENT if m.get('development') is True else 0) \
+            | (RIPPLE if (u, v) in ripple_edges else 0)
+        flat_edges += [index[u], index[v], flags]
+    return {
+        'nodes': [str(n) for n in nodes],
+        'x': [round(pos[n][0], 1) for n in nodes],
+        'y': [round(pos[n][1], 1) for n in nodes],
+        'version': [m.get('version') for m in meta],
+        'deprecated': [i for i, m in enumerate(meta) if m.get('deprecated')],
+        'scores': {k: [m.get(k) for m in meta] for k in keywords},
+        'edges': flat_edges
+    }
+
+
+def lod_core_nodes(G: nx.Graph, root: str, ripple_edges: set) -> tuple:
+    '''
+    (nodes, edges) shown before anything is expanded: the application, its direct
+    dependencies and the ripple effect paths
+    '''
+    direct = sorted(G.successors(root), key=str)
+    ripples = sorted(ripple_edges, key=lambda e: (str(e[0]), str(e[1])))
+    nodes = [root] + direct
+    seen = set(nodes)
+    for n in (n for e in ripples for n in e):
+        if n not in seen:
+            seen.add(n)
+            nodes.append(n)
+    edges = [(root, v) for v in direct] + [(u, v) for u, v in ripples if u != root]
+    return (nodes, edges)
+
+
+def lod_chunk_nodes(G: nx.Graph, dependency: str) -> tuple:
+    '''
+    (nodes, edges) of the chunk of a direct dependency: everything it depends on
+    '''
+    nodes = [dependency] + sorted(nx.descendants(G, dependency), key=str)
+    edges = [(u, v) for u in nodes for v in G.successors(u)]
+    return (nodes, edges)
+
+
+def _write_js(filepath: str, text: str):
+    with open(filepath, 'w', encoding='utf-8') as jfile:
+        jfile.write(text)
+
+
+def lod_graph_to_html(G: nx.Graph, pos: dict, root: str, ripple_edges: set, title: str = '',
+    keywords: list = KEYWORDS, outfile: str = 'temp_lod.html') -> dict:
+    '''
+    G            : REM graph (runtime and development)
+    pos          : positions of graph node
+    root         : application node
+    ripple_edges : edges affected by package deprecation
+    outfile      : output path for html file, chunks are written to <outfile without .html>/
+    returns the number of core nodes and chunks
+    '''
+    folder = os.path.splitext(outfile)[0]
+    os.makedirs(folder, exist_ok=True)
+    ripple_edges = set(ripple_edges)
+    with stage('render', file=outfile, view='lod') as record:
+        core_nodes, core_edges = lod_core_nodes(G, root, ripple_edges)
+        core = lod_part(G, pos, core_nodes, core_edges, ripple_edges, keywords)
+        core.update(root=str(root), title=title, keywords=keywords, folder=os.path.basename(folder), chunks={})
+        record.graph(G)
+        record.set(core_nodes=len(core_nodes))
+    print(f'exporting level-of-detail REM dependency graph to {outfile}.')
+    with stage('write', file=outfile, view='lod') as record:
+        chunk_id = 0
+        for dependency in sorted(G.successors(root), key=str):
+            if G.out_degree(dependency) == 0:
+                continue
+            chunk_nodes, chunk_edges = lod_chunk_nodes(G, dependency)
+            chunk = lod_part(G, pos, chunk_nodes, chunk_edges, ripple_edges, keywords)
+            _write_js(os.path.join(folder, f'{chunk_id}.js'), 'REM_LOD.loaded({}, {});\n'.format(chunk_id,
+                json.dumps(chunk, separators=(',', ':'))))
+            core['chunks'][str(dependency)] = [chunk_id, len(chunk_nodes)]
+            chunk_id += 1
+        record.set(chunks=chunk_id)
+        viewer = LOD_VIEWER_HTML.replace('REM_LOD_TITLE', html.escape(title)) \
+            .replace('REM_LOD_SCALE', json.dumps(px.colors.diverging.RdYlGn)) \
+            .replace('REM_LOD_CORE', json.dumps(core, separators=(',', ':')).replace('</', '<\\/'))
+        _write_js(outfile, viewer)
+    return {'core_nodes': len(core_nodes), 'chunks': chunk_id}
+
+
+# canvas viewer, node colors and hover texts follow rem_graphics.py
+LOD_VIEWER_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>REM_LOD_TITLE</title>
+<style>
+body { margin: 0; font-family: sans-serif; overflow: hidden; }
+#bar { position: absolute; top: 0; left: 0; right: 0; padding: 6px 10px; font-size: 13px; background: rgba(255,255,255,0.9); }
+#tip { position: absolute; display: none; pointer-events: none; padding: 4px 6px; font-size: 12px; background: white; border: 1px solid #999; white-space: nowrap; }
+canvas { display: block; }
+</style>
+</head>
+<body>
+<canvas id="rem"></canvas>
+<div id="bar"><b>REM_LOD_TITLE</b> &nbsp; metric of health: <select id="key"></select> &nbsp; <span id="status"></span><br>
+<small>click a circle-cross node to show its dependencies, dark-red edges are affected by package deprecation, thick edges are development dependencies, red outline means deprecation</small></div>
+<div id="tip"></div>
+<script>
+var REM_LOD = (function() {
+    var core = REM_LOD_CORE;
+    var scale = REM_LOD_SCALE;
+    var canvas = document.getElementById('rem'), ctx = canvas.getContext('2d');
+    var tip = document.getElementById('tip'), status = document.getElementById('status');
+    var select = document.getElementById('key');
+    var key = core.keywords[0];
+    // nodes and edges of every loaded part, shown while referenced by the core or an expanded chunk
+    var nodes = {}, nodeList = [], edges = {}, edgeList = [];
+    var chunks = {}, expanded = {};
+    var view = {x: 0, y: 0, k: 1}, width = 0, height = 0;
+    var hover = null, drag = null;
+
+    function add(part, sign) {
+        var i, n;
+        for (i = 0; i < part.nodes.length; i++) {
+            n = nodes[part.nodes[i]];
+            if (!n) {
+                n = nodes[part.nodes[i]] = {name: part.nodes[i], x: part.x[i], y: part.y[i],
+                    version: part.version[i], deprecated: false, scores: {}, refs: 0};
+                for (var k in part.scores) n.scores[k] = part.scores[k][i];
+                nodeList.push(n);
+            }
+            n.refs += sign;
+        }
+        part.deprecated.forEach(function(i) { nodes[part.nodes[i]].deprecated = true; });
+        for (i = 0; i < part.edges.length; i += 3) {
+            var u = part.nodes[part.edges[i]], v = part.nodes[part.edges[i+1]], id = u + '\\0' + v;
+            var e = edges[id];
+            if (!e) {
+                e = edges[id] = {u: nodes[u], v: nodes[v], flags: part.edges[i+2], refs: 0};
+                edgeList.push(e);
+            }
+            e.refs += sign;
+        }
+    }
+
+    function fill(n) {
+        if (n.name === core.root) return '#6959CD';
+        var s = n.scores[key];
+        return s === null || s === undefined ? 'black' : scale[Math.ceil(s * 10)];
+    }
+
+    function outline(n) {
+        if (n.name === core.root) return '#6959CD';
+        return n.deprecated ? 'red' : 'green';
+    }
+
+    function screen(n) {
+        return [(n.x - view.x) * view.k + width / 2, height / 2 - (n.y - view.y) * view.k];
+    }
+
+    function world(sx, sy) {
+        return [view.x + (sx - width / 2) / view.k, view.y - (sy - height / 2) / view.k];
+    }
+
+    function expandable(n) {
+        var c = core.chunks[n.name];
+        return c && !expanded[c[0]];
+    }
+
+    function draw() {
+        ctx.clearRect(0, 0, width, height);
+        // development edges are drawn wider and first, ripple effect edges over the others
+        [[2, 3.2, false], [2, 3.2, true], [1, 0.8, false], [1, 0.8, true]].forEach(function(style) {
+            ctx.beginPath();
+            edgeList.forEach(function(e) {
+                if (e.refs <= 0 || !(e.flags & style[0]) || !!(e.flags & 4) !== style[2]) return;
+                var a = screen(e.u), b = screen(e.v);
+                ctx.moveTo(a[0], a[1]);
+                ctx.lineTo(b[0], b[1]);
+            });
+            ctx.lineWidth = style[1];
+            ctx.strokeStyle = style[2] ? '#8b0000' : 'lightgrey';
+            ctx.stroke();
+        });
+        var shown = 0;
+        nodeList.forEach(function(n) {
+            if (n.refs <= 0) return;
+            shown++;
+            var p = screen(n), r = n.deprecated ? 7.5 : 5;
+            if (p[0] < -r || p[1] < -r || p[0] > width + r || p[1] > height + r) return;
+            ctx.beginPath();
+            ctx.arc(p[0], p[1], r, 0, 2 * Math.PI);
+            ctx.fillStyle = fill(n);
+            ctx.fill();
+            ctx.lineWidth = n.deprecated ? 3 : 1;
+            ctx.strokeStyle = outline(n);
+            ctx.stroke();
+            if (expandable(n)) {
+                ctx.beginPath();
+                ctx.moveTo(p[0] - r, p[1]);
+                ctx.lineTo(p[0] + r, p[1]);
+                ctx.moveTo(p[0], p[1] - r);
+                ctx.lineTo(p[0], p[1] + r);
+                ctx.lineWidth = 1;
+                ctx.stroke();
+            }
+        });
+        var loading = Object.keys(chunks).filter(function(i) { return chunks[i] === 'loading'; }).length;
+        status.textContent = shown.toLocaleString() + ' packages shown' + (loading ? ', loading..' : '');
+    }
+
+    function fit() {
+        var shown = nodeList.filter(function(n) { return n.refs > 0; });
+        var xs = shown.map(function(n) { return n.x; }), ys = shown.map(function(n) { return n.y; });
+        var x0 = Math.min.apply(null, xs), x1 = Math.max.apply(null, xs);
+        var y0 = Math.min.apply(null, ys), y1 = Math.max.apply(null, ys);
+        view.x = (x0 + x1) / 2;
+        view.y = (y0 + y1) / 2;
+        view.k = Math.min(width / ((x1 - x0) * 1.1 || 1), (height - 60) / ((y1 - y0) * 1.1 || 1), 2);
+    }
+
+    function resize() {
+        var ratio = window.devicePixelRatio || 1;
+        width = window.innerWidth;
+        height = window.innerHeight;
+        canvas.width = width * ratio;
+        canvas.height = height * ratio;
+        canvas.style.width = width + 'px';
+        canvas.style.height = height + 'px';
+        ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    }
+
+    function escape(s) {
+        return String(s).replace(/[&<>"]/g, function(c) { return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]; });
+    }
+
+    function text(n) {
+        var fields = {deprecated: n.deprecated, type: n.name === core.root ? 'GITHUB' : 'NPM', version: n.version};
+        for (var k in n.scores) fields[k] = n.scores[k];
+        var s = '<b>' + escape(n.name) + '</b>';
+        Object.keys(fields).sort().forEach(function(k) {
+            if (n.name === core.root && k !== 'type') return;
+            var v = fields[k] === null || fields[k] === undefined ? 'None' : fields[k];
+            s += k === key ? '<br><b><i>' + k + '</i></b>: ' + escape(v) : '<br><b>' + k + '</b>: ' + escape(v);
+        });
+        var c = core.chunks[n.name];
+        if (c) s += '<br><i>click to ' + (expanded[c[0]] ? 'hide' : 'show') + ' ' + c[1].toLocaleString() + ' packages</i>';
+        return s;
+    }
+
+    function nearest(sx, sy) {
+        var best = null, bestDistance = 100;
+        nodeList.forEach(function(n) {
+            if (n.refs <= 0) return;
+            var p = screen(n), d = (p[0] - sx) * (p[0] - sx) + (p[1] - sy) * (p[1] - sy);
+            if (d < bestDistance) {
+                best = n;
+                bestDistance = d;
+            }
+        });
+        return best;
+    }
+
+    function toggle(n) {
+        var i = core.chunks[n.name][0];
+        if (chunks[i] === 'loading') return;
+        if (chunks[i] === undefined) {
+            chunks[i] = 'loading';
+            var script = document.createElement('script');
+            script.src = core.folder + '/' + i + '.js';
+            script.onerror = function() {
+                delete chunks[i];
+                status.textContent = 'could not load ' + script.src;
+            };
+            document.head.appendChild(script);
+        } else {
+            add(chunks[i], expanded[i] ? -1 : 1);
+            expanded[i] = !expanded[i];
+        }
+        draw();
+    }
+
+    function loaded(i, chunk) {
+        chunks[i] = chunk;
+        add(chunk, 1);
+        expanded[i] = true;
+        draw();
+    }
+
+    core.keywords.forEach(function(k) {
+        var option = document.createElement('option');
+        option.value = option.textContent = k;
+        select.appendChild(option);
+    });
+    select.onchange = function() { key = select.value; draw(); };
+    canvas.addEventListener('mousedown', function(ev) {
+        drag = {x: ev.clientX, y: ev.clientY, vx: view.x, vy: view.y, moved: false};
+    });
+    window.addEventListener('mouseup', function(ev) {
+        if (drag && !drag.moved) {
+            var n = nearest(ev.clientX, ev.clientY);
+            if (n && core.chunks[n.name]) toggle(n);
+        }
+        drag = null;
+    });
+    canvas.addEventListener('mousemove', function(ev) {
+        if (drag) {
+            if (Math.abs(ev.clientX - drag.x) + Math.abs(ev.clientY - drag.y) > 3) drag.moved = true;
+            view.x = drag.vx - (ev.clientX - drag.x) / view.k;
+            view.y = drag.vy + (ev.clientY - drag.y) / view.k;
+            tip.style.display = 'none';
+            draw();
+            return;
+        }
+        hover = nearest(ev.clientX, ev.clientY);
+        canvas.style.cursor = hover && core.chunks[hover.name] ? 'pointer' : 'default';
+        if (!hover) {
+            tip.style.display = 'none';
+            return;
+        }
+        tip.innerHTML = text(hover);
+        tip.style.left = (ev.clientX + 12) + 'px';
+        tip.style.top = (ev.clientY + 12) + 'px';
+        tip.style.display = 'block';
+    });
+    canvas.addEventListener('wheel', function(ev) {
+        ev.preventDefault();
+        var p = world(ev.clientX, ev.clientY);
+        view.k *= Math.exp(-ev.deltaY * 0.002);
+        view.x = p[0] - (ev.clientX - width / 2) / view.k;
+        view.y = p[1] + (ev.clientY - height / 2) / view.k;
+        draw();
+    }, {passive: false});
+    window.addEventListener('resize', function() { resize(); draw(); });
+
+    add(core, 1);
+    resize();
+    fit();
+    draw();
+    return {loaded: loaded};
+})();
+</script>
+</body>
+</html>
+'''
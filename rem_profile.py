@@ -0,0 +1,157 @@
+'''
+stage timing and memory instrumentation, written as an NDJSON trace
+
+    with stage('closure', application=name) as record:
+        G = create_application_graph(...)
+        record.graph(G)
+
+every stage appends one line to the trace when it ends: wall and cpu seconds,
+current and peak RSS, the peak of python allocations during the stage (if
+PROFILE_TRACEMALLOC is enabled, it slows down the run), the enclosing stage and
+the fields set on the record, e.g. graph sizes. stages are no-ops until
+enable_profile() is called by the --profile option of the scripts.
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from configs import PROFILE_TRACEMALLOC
+try:
+    import resource # not available on windows
+except ImportError:
+    resource = None
+
+_trace = None # trace file, None when profiling is disabled
+_start = None
+_stack = [] # open stages of this process
+
+
+def enable_profile(filepath: str, tracemalloc_enable: bool = PROFILE_TRACEMALLOC):
+    '''
+    start writing stages to filepath, lines are appended so forked workers can share the file
+    '''
+    global _trace, _start
+    _trace = open(filepath, 'a', buffering=1)
+    _start = time.perf_counter()
+    if tracemalloc_enable and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _write({'event': 'profile', 'argv': sys.argv, 'pid': os.getpid(), 'time': time.time(),
+        'tracemalloc': tracemalloc.is_tracing()})
+    print(f'profiling stages to {filepath}')
+
+
+def disable_profile():
+    global _trace
+    if _trace is not None:
+        _trace.close()
+    _trace = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def profile_enabled() -> bool:
+    return _trace is not None
+
+
+def _write(data: dict):
+    _trace.write(json.dumps(data, default=str) + '\n')
+
+
+def _rss_mb() -> tuple:
+    '''
+    (current, peak) resident set size of the process in MB, None if unknown
+    '''
+    current = peak = None
+    try:
+        with open('/proc/self/statm', 'r') as sfile:
+            current = int(sfile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macos
+        peak = maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+    return (current, peak)
+
+
+class _Stage:
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+        self.py_peak = 0
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def graph(self, G, prefix: str = ''):
+        '''
+        record the number of nodes and edges of a graph
+        '''
+        self.fields[prefix+'nodes'] = G.number_of_nodes()
+        self.fields[prefix+'edges'] = G.number_of_edges()
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            if _stack:
+                # the enclosing stage keeps the peak reached so far
+                _stack[-1].py_peak = max(_stack[-1].py_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _stack.append(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        _stack.pop()
+        record = {'event': 'stage', 'stage': self.name, 'parent': _stack[-1].name if _stack else None,
+            'pid': os.getpid(), 'start': round(self.wall - _start, 6), 'wall': round(wall, 6), 'cpu': round(cpu, 6)}
+        record['rss_mb'], record['rss_peak_mb'] = _rss_mb()
+        if tracemalloc.is_tracing():
+            self.py_peak = max(self.py_peak, tracemalloc.get_traced_memory()[1])
+            record['py_peak_mb'] = round(self.py_peak / 2**20, 3)
+            if _stack:
+                _stack[-1].py_peak = max(_stack[-1].py_peak, self.py_peak)
+            tracemalloc.reset_peak()
+        if exc_type is not None:
+            record['error'] = repr(exc)
+        record.update(self.fields)
+        if _trace is not None:
+            _write(record)
+        return False
+
+
+class _NullStage:
+    '''
+    shared stage used while profiling is disabled
+    '''
+
+    def set(self, **fields):
+        pass
+
+    def graph(self, G, prefix: str = ''):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, **fields):
+    '''
+    context manager timing a stage of the run, see the module docstring
+    '''
+    if _trace is None:
+        return _NULL_STAGE
+    return _Stage(name, fields)
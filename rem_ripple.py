@@ -0,0 +1,132 @@
+'''
+ripple effect of deprecated packages in a REM graph
+
+an edge is affected by the ripple effect if it lies on a simple path from the
+application root to a deprecated package.
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import networkx as nx
+
+# upper bound on dfs steps spent inside a single strongly connected component
+SCC_SEARCH_LIMIT = 100000
+
+
+def ripple_effect_simple_paths(G: nx.DiGraph, root: str, targets: list) -> tuple:
+    '''
+    reference implementation, enumerates every simple path from root to each target
+    exponential on large dependency graphs, kept for verification and benchmarks
+    '''
+    ripple_nodes = set()
+    ripple_edges = set()
+    for target in targets:
+        for path in nx.all_simple_paths(G, source=root, target=target):
+            for i in range(len(path)-1):
+                ripple_nodes.add(path[i])
+                ripple_nodes.add(path[i + 1])
+                ripple_edges.add((path[i], path[i + 1]))
+    return (ripple_nodes, ripple_edges)
+
+
+def _reachable(adj, sources) -> set:
+    seen = set(sources)
+    stack = list(seen)
+    while stack:
+        node = stack.pop()
+        for nxt in adj[node]:
+            if nxt not in seen:
+                seen.add(nxt)
+                stack.append(nxt)
+    return seen
+
+
+def _component_ripple_edges(G: nx.DiGraph, comp: set, entries: set, exits: set) -> set:
+    '''
+    edges inside a strongly connected component that lie on a simple path
+    from one of its entries to one of its exits, None if the search budget is exceeded
+    '''
+    edges = set()
+    steps = 0
+    for entry in entries:
+        path = [entry]
+        on_path = {entry}
+        stack = [iter([v for v in G.successors(entry) if v in comp])]
+        while stack:
+            nxt = next(stack[-1], None)
+            if nxt is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            if nxt in on_path:
+                continue
+            steps += 1
+            if steps > SCC_SEARCH_LIMIT:
+                return None
+            path.append(nxt)
+            on_path.add(nxt)
+            if nxt in exits:
+                for i in range(len(path)-1):
+                    edges.add((path[i], path[i + 1]))
+            stack.append(iter([v for v in G.successors(nxt) if v in comp]))
+    return edges
+
+
+def ripple_effect(G: nx.DiGraph, root: str, targets: list) -> tuple:
+    '''
+    same (nodes, edges) sets as ripple_effect_simple_paths, for all targets in one pass
+
+    relevant nodes are reachable from root (forward) and reach a target (reverse).
+    a simple path visits each strongly connected component in one contiguous
+    segment, so an edge between two relevant components is always on some simple path.
+    edges inside a component are on a simple path iff they lie on a simple path
+    between an entry (root, or head of an edge coming from outside) and an exit
+    (a target, or tail of an edge leaving the component), which is searched
+    within the (usually tiny) component only.
+    '''
+    targets = set(t for t in targets if t in G and t != root)
+    if root not in G or not targets:
+        return (set(), set())
+    forward = _reachable(G.succ, [root])
+    reverse = _reachable(G.pred, targets)
+    relevant = forward & reverse
+    if root not in relevant:
+        return (set(), set())
+    R = G.subgraph(relevant)
+
+    component_of = {}
+    components = []
+    for comp in nx.strongly_connected_components(R):
+        for node in comp:
+            component_of[node] = len(components)
+        components.append(comp)
+
+    ripple_edges = set()
+    entries = {}
+    exits = {}
+    for u, v in R.edges():
+        cu, cv = component_of[u], component_of[v]
+        if cu != cv:
+            ripple_edges.add((u, v))
+            exits.setdefault(cu, set()).add(u)
+            entries.setdefault(cv, set()).add(v)
+
+    for c, comp in enumerate(components):
+        if len(comp) < 2:
+            continue
+        comp_entries = entries.get(c, set())
+        if root in comp:
+            comp_entries = comp_entries | {root}
+        comp_exits = exits.get(c, set()) | (targets & comp)
+        comp_edges = _component_ripple_edges(R, comp, comp_entries, comp_exits)
+        if comp_edges is None:
+            # pathological component, every inner edge is kept
+            print('ripple effect: search limit reached in a cycle of {:,} packages'.format(len(comp)))
+            comp_edges = set((u, v) for u, v in R.subgraph(comp).edges() if u != v)
+        ripple_edges |= comp_edges
+
+    ripple_nodes = set()
+    for u, v in ripple_edges:
+        ripple_nodes.add(u)
+        ripple_nodes.add(v)
+    return (ripple_nodes, ripple_edges)
@@ -0,0 +1,197 @@
+'''
+long-running REM analysis service that keeps the NPM graph resident
+
+the NPM graph is loaded once, then analysis requests are handed to a bounded
+pool of workers (forked after the graph is loaded, so the graph is shared
+copy-on-write). requests that cannot be queued are rejected with 503, requests
+that take longer than REM_SERVER_TIMEOUT are answered with 504.
+
+endpoints:
+    GET  /health   service status
+    POST /rem      run REM for an application, json body:
+        {
+            "package_json": {...} | "repo": "https://github.com/<owner>/<repo>[/tree/<branch>]",
+            "name": "<application name>" (package_json only, optional),
+            "keyword": "final" | "popularity" | "quality" | "maintenance" (default final),
+            "filter": true | false (default FILTER_ENABLE),
+            "format": "json" | "html" (default json),
+            "view": "filtered" | "full" (html only, default filtered when filtering)
+        }
+
+Zhe Chen (zkchen@uvic.ca)
+'''
+
+import json
+import multiprocessing
+import re
+import sys # exit, argv
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from configs import FILTER_ENABLE, KEYWORDS, REM_SERVER_HOST, REM_SERVER_PORT, \
+    REM_SERVER_WORKERS, REM_SERVER_QUEUE, REM_SERVER_TIMEOUT
+from rem_graph_analysis import project_graph_analysis
+from utils import *
+
+# resident NPM graph, set by serve() before the worker pool is created
+_npm_G = None
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def request_dependencies(payload: dict) -> tuple:
+    '''
+    returns (application name, runtime dependencies, development dependencies) of a request
+    '''
+    if is_valid_key(payload, 'package_json'):
+        package_json = payload['package_json']
+        if not isinstance(package_json, dict):
+            raise RequestError(400, 'package_json must be a json object')
+        name = payload.get('name') or package_json.get('name') or 'application'
+        rt_deps, dev_deps = package_json_deps(package_json)
+        return ('{}(local)'.format(name), rt_deps, dev_deps)
+    if is_valid_key(payload, 'repo'):
+        github_repo = parse_github_url(str(payload['repo']))
+        if github_repo is None:
+            raise RequestError(400, 'repo must be a github url, example: github.com/<owner>/<repo>')
+        owner, repo, branch = github_repo
+        rt_deps, dev_deps = retrieve_package_json_deps(owner, repo, branch)
+        return ('{owner}:{repo}({branch})'.format(owner=owner, repo=repo, branch=branch), rt_deps, dev_deps)
+    raise RequestError(400, 'request must contain package_json or repo')
+
+
+def analyze_request(payload: dict) -> tuple:
+    '''
+    runs in a worker: same pipeline as the rem_graph_run_* scripts
+    returns (http status, content type, body)
+    '''
+    try:
+        keyword = payload.get('keyword', 'final')
+        if keyword not in KEYWORDS:
+            raise RequestError(400, 'keyword must be one of {}'.format(', '.join(KEYWORDS)))
+        filter_flag = bool(payload.get('filter', FILTER_ENABLE))
+        out_format = payload.get('format', 'json')
+        if out_format not in ['json', 'html']:
+            raise RequestError(400, 'format must be json or html')
+
+        application_name, rt_deps, dev_deps = request_dependencies(payload)
+        if not rt_deps and not dev_deps:
+            raise RequestError(422, 'application does not have any runtime and development dependencies')
+        application_sub_G = create_application_graph(_npm_G, application_name, rt_deps, dev_deps)
+
+        outfile = re.sub(r'[^\w.-]+', '-', application_name) + '_' + keyword
+        with tempfile.TemporaryDirectory() as out_folder:
+            result = project_graph_analysis(G=application_sub_G, pname=application_name, outfile=outfile,
+                outfolder=out_folder, keyword=keyword, filter_flag=filter_flag)
+            if out_format == 'html':
+                view = payload.get('view', 'filtered' if filter_flag else 'full')
+                if view not in result['outputs']:
+                    raise RequestError(400, f'view {view} was not rendered')
+                with open(result['outputs'][view], 'r', encoding='utf-8') as hfile:
+                    return (200, 'text/html; charset=utf-8', hfile.read())
+        del result['outputs']
+        return (200, 'application/json', json.dumps(result))
+    except RequestError as e:
+        return (e.status, 'application/json', json.dumps({'error': str(e)}))
+    except Exception as e:
+        return (500, 'application/json', json.dumps({'error': repr(e)}))
+
+
+class REMRequestHandler(BaseHTTPRequestHandler):
+
+    def send_body(self, status: int, content_type: str, body: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status: int, data: dict):
+        self.send_body(status, 'application/json', json.dumps(data))
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.send_json(404, {'error': 'not found'})
+        self.send_json(200, {
+            'status': 'ok',
+            'nodes': _npm_G.number_of_nodes(),
+            'edges': _npm_G.number_of_edges(),
+            'workers': self.server.workers,
+            'in_flight': self.server.in_flight
+        })
+
+    def do_POST(self):
+        if self.path != '/rem':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(payload, dict):
+                raise ValueError
+        except ValueError:
+            return self.send_json(400, {'error': 'request body must be a json object'})
+
+        # bounded request queue: running + waiting requests
+        if not self.server.slots.acquire(blocking=False):
+            return self.send_json(503, {'error': 'server busy, try again later'})
+        self.server.track(1)
+        def release(_):
+            self.server.track(-1)
+            self.server.slots.release()
+        async_result = self.server.pool.apply_async(analyze_request, (payload,),
+            callback=release, error_callback=release)
+        try:
+            status, content_type, body = async_result.get(timeout=self.server.timeout)
+        except multiprocessing.TimeoutError:
+            return self.send_json(504, {'error': f'analysis did not finish within {self.server.timeout}s'})
+        self.send_body(status, content_type, body)
+
+
+class REMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool, workers: int, queue_size: int, timeout: int):
+        super().__init__(address, REMRequestHandler)
+        self.pool = pool
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def track(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+
+
+def serve(host: str = REM_SERVER_HOST, port: int = REM_SERVER_PORT, workers: int = REM_SERVER_WORKERS,
+    queue_size: int = REM_SERVER_QUEUE, timeout: int = REM_SERVER_TIMEOUT):
+    global _npm_G
+    prepare_npm_graph()
+    _npm_G = load_npm_graph()
+    pool = create_worker_pool(workers)
+    server = REMServer((host, port), pool, workers, queue_size, timeout)
+    print(f'REM service listening on http://{host}:{port} [{workers} workers, queue {queue_size}]')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+
+
+def main():
+    if len(sys.argv) > 2:
+        sys.exit('Usage: python3 rem_server.py [<port>(8000)]')
+    port = int(sys.argv[1]) if len(sys.argv) == 2 else REM_SERVER_PORT
+    serve(port=port)
+
+
+if __name__ == '__main__':
+    main()
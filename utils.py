@@ -4,14 +4,22 @@ utility functions
 Zhe Chen (zkchen@uvic.ca)
 '''
 
+import gzip
 import networkx as nx
 from networkx.classes import graph
 import requests # get
 import json
+import multiprocessing
 import sqlite3
 import sys
+from collections import deque # popleft
+from multiprocessing.pool import ThreadPool
 from os.path import join, isfile
-from configs import NPMDB, NPMJSON, NPMGRAPH_LOAD
+from configs import NPMDB, NPMJSON, NPMSNAPSHOT, NPMGRAPH_LOAD, NPMGRAPH_BACKEND, KEYWORDS
+from npm_snapshot import MINIMUM_KEYS, NPMSnapshot, db_fingerprint, is_snapshot_stale, read_snapshot, write_snapshot
+from npm_sqlite import NPMDatabase, create_indexes, has_subtree_minimums, update_subtree_minimums
+from npm_lockfile import LOCKFILE_NAMES, Lockfile, parse_lockfile, read_lockfile
+from rem_profile import stage
 from networkx.readwrite import json_graph
 
 
@@ -22,6 +30,57 @@ def is_valid_key(data: dict, key: str) -> bool:
     return data and key and (key in data) and (data[key])
 
 
+def pop_flag(argv: list, flag: str) -> bool:
+    '''
+    remove a command line flag from argv, returns whether it was given
+    '''
+    if flag in argv:
+        argv.remove(flag)
+        return True
+    return False
+
+
+def pop_option(argv: list, option: str, default=None):
+    '''
+    remove a command line option and its value from argv, returns the value
+    '''
+    if option in argv:
+        i = argv.index(option)
+        if i+1 >= len(argv):
+            sys.exit(f'missing value for {option}')
+        value = argv[i+1]
+        del argv[i:i+2]
+        return value
+    return default
+
+
+def parse_github_url(repo_url: str) -> tuple:
+    '''
+    split github.com/<owner>/<repo>[/tree/<branch>] into (owner, repo, branch)
+    branch defaults to master, returns None if input is not a github url
+    '''
+    # naive check if input is github address
+    if 'github' not in repo_url:
+        return None
+    url_tokens = repo_url.rstrip('/').split('/')
+    # if input url has specified branch, otherwise will be master
+    if 'tree' in url_tokens:
+        owner, repo, tree, branch = url_tokens[-4:]
+        del tree
+    else:
+        owner, repo, branch = url_tokens[-2:]+['master']
+    return (owner, repo, branch)
+
+
+def package_json_deps(data: dict) -> tuple:
+    '''
+    returns tuple of dict: (dependencies: dict, devDependencies: dict) of a package.json 
+    '''
+    runtime_dep = data['dependencies'] if is_valid_key(data, 'dependencies') else None
+    dev_dep = data['devDependencies'] if is_valid_key(data, 'devDependencies') else None
+    return (runtime_dep, dev_dep)
+
+
 def retrieve_package_json_deps(owner, repo, branch) -> tuple:
     '''
     extract runtime and development dependencies from 
@@ -40,9 +99,7 @@ def retrieve_package_json_deps(owner, repo, branch) -> tuple:
             print('failed, please make sure the github repo is not valid and public.')
             return (None, None)
         else:
-            data = resp.json()
-            runtime_dep = data['dependencies'] if is_valid_key(data, 'dependencies') else None
-            dev_dep = data['devDependencies'] if is_valid_key(data, 'devDependencies') else None
+            runtime_dep, dev_dep = package_json_deps(resp.json())
             print('done.')
             return (runtime_dep, dev_dep)
     except:
@@ -50,11 +107,52 @@ def retrieve_package_json_deps(owner, repo, branch) -> tuple:
         return (None, None)
 
 
+def retrieve_lockfile(owner, repo, branch):
+    '''
+    package-lock.json, npm-shrinkwrap.json or yarn.lock next to the package.json of
+    github.com/owner/repo/branch, the first one found
+    returns a Lockfile, or None if the repo has none of them
+    '''
+    for filename in LOCKFILE_NAMES:
+        lock_file_path = 'https://raw.github.com/{owner}/{repo}/{branch}/{filename}'\
+            .format(owner=owner, repo=repo, branch=branch, filename=filename)
+        print('retrieving {} file from [{}]..'.format(filename, lock_file_path), end='')
+        try:
+            resp = requests.get(lock_file_path)
+            if resp.status_code != 200:
+                print('not found.')
+                continue
+            lock = parse_lockfile(filename, resp.text)
+            print('done. [{:,}] packages'.format(lock.number_of_packages()))
+            return lock
+        except Exception:
+            print('request failed.')
+    return None
+
+
+def load_lockfile(source: str, owner, repo, branch) -> Lockfile:
+    '''
+    lockfile of the --lockfile option: a local file, or github to retrieve it next to package.json
+    exits if there is none
+    '''
+    if source == 'github':
+        lock = retrieve_lockfile(owner, repo, branch)
+        if lock is None:
+            sys.exit('the github repo does not have a {}'.format(', '.join(LOCKFILE_NAMES)))
+        return lock
+    if not isfile(source):
+        sys.exit(f'lockfile [{source}] not found')
+    try:
+        return read_lockfile(source)
+    except (ValueError, KeyError, AttributeError) as e:
+        sys.exit(f'lockfile [{source}] could not be read: {e!r}')
+
+
 def create_graph(node_list: list, dep_rel_list: list) -> nx.DiGraph:
     npm_G = nx.DiGraph()
     # add every package as node in the network
     for pkg in node_list:
-        name, latest, deprecated, final, popularity, quality, maintenance = pkg
+        name, latest, deprecated, final, popularity, quality, maintenance = pkg[:7]
         deprecated = True if (deprecated == 1) else False
         # round scores to 2 decimal place
         final = round(final, 2) if final else final
@@ -63,6 +161,9 @@ def create_graph(node_list: list, dep_rel_list: list) -> nx.DiGraph:
         quality = round(quality, 2) if quality else quality
         npm_G.add_node(name, version=latest, deprecated=deprecated, final=final, 
                    popularity=popularity, quality=quality, maintenance=maintenance, type='NPM')
+        # subtree minimums, rows of fetch_npm_rows and NPMDatabase.closure_rows
+        for k, val in zip(MINIMUM_KEYS, pkg[7:11]):
+            npm_G.nodes()[name][k] = round(val, 2) if val else val
     # connect packages according to their dependency relationships
     for deps in dep_rel_list:
         name, ver, dep_name, dep_cons = deps
@@ -70,7 +171,203 @@ def create_graph(node_list: list, dep_rel_list: list) -> nx.DiGraph:
     return npm_G
 
 
+def graph_accessors(npm_G) -> tuple:
+    '''
+    read-only accessors shared by a networkx NPM graph and an NPMSnapshot
+    returns (key_of(name), name_of(key), node_attributes(key), successor_items(key))
+    key_of returns None if the package is not in the graph
+    '''
+    if isinstance(npm_G, NPMSnapshot):
+        def key_of(name):
+            i = npm_G.node_id(name)
+            return i if i >= 0 else None
+        return (key_of, npm_G.name, npm_G.node_attributes, npm_G.successor_items)
+    return (lambda name: name if name in npm_G else None, 
+            lambda name: name, 
+            lambda name: npm_G.nodes()[name], 
+            lambda name: npm_G.adj[name].items())
+
+
+def dependency_closure(npm_G, application_name: str, deps: dict, constraint_key: str, flag: str) -> nx.DiGraph:
+    '''
+    BFS from the direct dependencies of an application in the shared NPM graph,
+    only the reachable packages and the edges between them are materialised
+    deps: {package: constraint}
+    constraint_key: edge attribute for the direct dependency constraints
+    flag: edge attribute set to True on every edge (runtime|development)
+    '''
+    if isinstance(npm_G, NPMDatabase):
+        # only the closure of the direct dependencies is read from the database
+        npm_G = NPMSnapshot.from_rows(*npm_G.closure_rows(deps.keys() if deps else []))
+    key_of, name_of, node_attributes, successor_items = graph_accessors(npm_G)
+    sub_G = nx.DiGraph()
+    sub_G.add_node(application_name, type='GITHUB')
+    if deps is None:
+        return sub_G
+    queue = deque()
+    for k, v in deps.items():
+        name = str(k)
+        if name not in sub_G:
+            key = key_of(name)
+            if key is None:
+                sub_G.add_node(name) # not an NPM package
+            else:
+                sub_G.add_node(name, **node_attributes(key))
+                queue.append((name, key))
+        sub_G.add_edge(application_name, name, **{constraint_key: str(v), flag: True})
+    while queue:
+        name, key = queue.popleft()
+        for dep_key, meta in successor_items(key):
+            dep_name = name_of(dep_key)
+            if dep_name not in sub_G:
+                sub_G.add_node(dep_name, **node_attributes(dep_key))
+                queue.append((dep_name, dep_key))
+            sub_G.add_edge(name, dep_name, **meta)
+            sub_G.edges()[name, dep_name][flag] = True
+    return sub_G
+
+
+def lockfile_closure(npm_G, lock: Lockfile, application_name: str, deps: dict, constraint_key: str, flag: str) -> nx.DiGraph:
+    '''
+    same as dependency_closure, over the packages a lockfile installs instead of the latest 
+    versions in the NPM graph, the NPM graph is only used for deprecation and scores by name
+    version: installed version(s) of a package
+    the subtree minimums of the NPM graph (min_* attributes) do not hold in the installed tree 
+    and are left out, the filter computes them for the application
+    '''
+    if isinstance(npm_G, NPMDatabase):
+        npm_G = NPMSnapshot.from_rows(npm_G.package_rows(lock.names()), [])
+    key_of, name_of, node_attributes, successor_items = graph_accessors(npm_G)
+    sub_G = nx.DiGraph()
+    sub_G.add_node(application_name, type='GITHUB')
+    if deps is None:
+        return sub_G
+    versions = {}
+    def add_package(name, lock_key):
+        version = lock.packages[lock_key][1]
+        if name in versions:
+            if version not in versions[name]:
+                versions[name].append(version)
+                sub_G.nodes()[name]['version'] = ', '.join(versions[name])
+            return
+        key = key_of(name)
+        meta = node_attributes(key) if key is not None else {}
+        if not meta:
+            sub_G.add_node(name) # not an NPM package
+            return
+        sub_G.add_node(name, **{k: v for k, v in meta.items() if k not in MINIMUM_KEYS})
+        versions[name] = [version]
+        sub_G.nodes()[name]['version'] = version
+    queue = deque()
+    visited = set()
+    for k, v in deps.items():
+        name = str(k)
+        lock_key = lock.resolve(name, v)
+        if lock_key is None:
+            print(f'{name} is not in the lockfile, the lockfile may be out of date')
+            if name not in sub_G:
+                sub_G.add_node(name)
+        else:
+            name = lock.packages[lock_key][0]
+            add_package(name, lock_key)
+            if lock_key not in visited:
+                visited.add(lock_key)
+                queue.append(lock_key)
+        sub_G.add_edge(application_name, name, **{constraint_key: str(v), flag: True})
+    while queue:
+        lock_key = queue.popleft()
+        name = lock.packages[lock_key][0]
+        for dep_name, constraint, dep_key in lock.dependencies[lock_key]:
+            dep_name = lock.packages[dep_key][0]
+            add_package(dep_name, dep_key)
+            if dep_key not in visited:
+                visited.add(dep_key)
+                queue.append(dep_key)
+            if dep_name != name: # another version of the same package
+                sub_G.add_edge(name, dep_name, dep_constraint=constraint)
+                sub_G.edges()[name, dep_name][flag] = True
+    return sub_G
+
+
+def create_application_graph(npm_G, application_name: str, rt_deps: dict, dev_deps: dict, lock: Lockfile = None) -> nx.DiGraph:
+    '''
+    sub-graph of an application and its transitive runtime and development dependencies,
+    runtime edges are marked with runtime=True and development edges with development=True
+    npm_G: networkx graph, NPMSnapshot or NPMDatabase, never copied or modified
+    lock: resolved dependency tree of the application, see npm_lockfile.py
+    '''
+    with stage('closure', application=application_name, lockfile=lock is not None) as record:
+        if lock is None:
+            application_rt_sub_G = dependency_closure(npm_G, application_name, rt_deps, 'runtime_constraint', 'runtime')
+            application_dev_sub_G = dependency_closure(npm_G, application_name, dev_deps, 'dev_constraint', 'development')
+        else:
+            application_rt_sub_G = lockfile_closure(npm_G, lock, application_name, rt_deps, 'runtime_constraint', 'runtime')
+            application_dev_sub_G = lockfile_closure(npm_G, lock, application_name, dev_deps, 'dev_constraint', 'development')
+
+        # create github application sub graph
+        application_sub_G = nx.compose(application_rt_sub_G, application_dev_sub_G)
+        record.graph(application_sub_G)
+    print('created sub-graph for {}. [{:,}] nodes, [{:,}] edges'
+    .format(application_name, application_sub_G.number_of_nodes(), application_sub_G.number_of_edges()))
+    return application_sub_G
+
+
+def fetch_npm_rows(conn: sqlite3.Connection) -> tuple:
+    '''
+    returns (package metadata rows, dependency relationship rows) from NPMDB
+    the subtree minimums are computed first if the database does not have them yet
+    '''
+    if not has_subtree_minimums(conn):
+        with stage('subtree_minimums'):
+            update_subtree_minimums(conn)
+    c = conn.cursor()
+    # npm metadata list
+    npm_meta_query = ''' 
+        SELECT n.name, n.latest, n.deprecated, 
+        s.final, s.popularity, s.quality, s.maintenance,
+        m.final, m.popularity, m.quality, m.maintenance
+        FROM packages AS n
+        LEFT JOIN scores AS s
+        USING (name)
+        LEFT JOIN subtree_minimums AS m
+        USING (name); 
+    '''
+    with stage('fetch') as record:
+        print('fetching NPM metadata..', end='')
+        c.execute(npm_meta_query)
+        npm_with_deprecated_list = c.fetchall()
+        print('done. [{:,}]'.format(len(npm_with_deprecated_list)))
+
+        # npm dependency relationships list
+        npm_dep_query = ''' SELECT * FROM depend; '''
+        print('fetching NPM dependency relationships..', end='')
+        c.execute(npm_dep_query)
+        npm_dep_list = c.fetchall()
+        print('done. [{:,}]'.format(len(npm_dep_list)))
+        record.set(packages=len(npm_with_deprecated_list), dependencies=len(npm_dep_list))
+    return (npm_with_deprecated_list, npm_dep_list)
+
+
+def create_worker_pool(workers: int):
+    '''
+    forked processes share the resident NPM graph copy-on-write,
+    platforms without fork fall back to threads in this process
+    '''
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(processes=workers)
+    return ThreadPool(processes=workers)
+
+
 def prepare_npm_graph():
+    with stage('prepare', backend=NPMGRAPH_BACKEND):
+        if NPMGRAPH_BACKEND == 'snapshot':
+            return prepare_npm_snapshot()
+        if NPMGRAPH_BACKEND == 'sqlite':
+            return prepare_npm_database()
+        return prepare_npm_json()
+
+
+def prepare_npm_json():
     # skip if reload is false and json file exists
     if isfile(NPMJSON) and NPMGRAPH_LOAD is False:
         print(f'npm graph json file [{NPMJSON}] exists and reload is disabled')
@@ -82,27 +379,7 @@ def prepare_npm_graph():
     
     # establish database connection
     conn = sqlite3.connect(NPMDB)
-    c = conn.cursor()
-    
-    # npm metadata list
-    npm_meta_query = ''' 
-        SELECT n.name, n.latest, n.deprecated, 
-        s.final, s.popularity, s.quality, s.maintenance
-        FROM packages AS n
-        LEFT JOIN scores AS s
-        USING (name); 
-    '''
-    print('fetching NPM metadata..', end='')
-    c.execute(npm_meta_query)
-    npm_with_deprecated_list = c.fetchall()
-    print('done. [{:,}]'.format(len(npm_with_deprecated_list)))
-
-    # npm dependency relationships list
-    npm_dep_query = ''' SELECT * FROM depend; '''
-    print('fetching NPM dependency relationships..', end='')
-    c.execute(npm_dep_query)
-    npm_dep_list = c.fetchall()
-    print('done. [{:,}]'.format(len(npm_dep_list)))
+    npm_with_deprecated_list, npm_dep_list = fetch_npm_rows(conn)
 
     # create di-graph to store npm package network
     print('creating NPM dependency graph..', end='')
@@ -113,6 +390,62 @@ def prepare_npm_graph():
     conn.close()
 
 
+def prepare_npm_snapshot():
+    '''
+    write the binary NPM graph snapshot, rebuilt automatically when it is missing, 
+    has an older format version or was built from another NPMDB
+    '''
+    if not is_snapshot_stale(NPMSNAPSHOT, NPMDB) and NPMGRAPH_LOAD is False:
+        print(f'npm graph snapshot [{NPMSNAPSHOT}] is up to date and reload is disabled')
+        return
+
+    if not isfile(NPMDB):
+        sys.exit('NPM dependency database not found, please run preprocess.py fisrt')
+
+    conn = sqlite3.connect(NPMDB)
+    npm_with_deprecated_list, npm_dep_list = fetch_npm_rows(conn)
+    conn.close()
+
+    print('creating NPM dependency graph snapshot..', end='')
+    snap = NPMSnapshot.from_rows(npm_with_deprecated_list, npm_dep_list, db_fingerprint(NPMDB))
+    print('done. [{:,}] nodes, [{:,}] edges'
+    .format(snap.number_of_nodes(), snap.number_of_edges()))
+    with stage('write', file=NPMSNAPSHOT):
+        write_snapshot(snap, NPMSNAPSHOT)
+
+
+def prepare_npm_database():
+    '''
+    index NPMDB for the closure queries of the sqlite backend, nothing is loaded
+    '''
+    if not isfile(NPMDB):
+        sys.exit('NPM dependency database not found, please run preprocess.py fisrt')
+    print('indexing NPM dependency database..', end='')
+    conn = sqlite3.connect(NPMDB)
+    create_indexes(conn)
+    print('done.')
+    if not has_subtree_minimums(conn):
+        with stage('subtree_minimums'):
+            update_subtree_minimums(conn)
+    conn.close()
+
+
+def load_npm_graph():
+    '''
+    load the NPM graph prepared by prepare_npm_graph() from the configured backend
+    returns a memory-mapped NPMSnapshot, an out-of-core NPMDatabase (sqlite) or an in-memory NPMSnapshot (json)
+    '''
+    with stage('load', backend=NPMGRAPH_BACKEND) as record:
+        if NPMGRAPH_BACKEND == 'snapshot':
+            npm_G = read_snapshot(NPMSNAPSHOT)
+        elif NPMGRAPH_BACKEND == 'sqlite':
+            npm_G = NPMDatabase(NPMDB)
+        else:
+            npm_G = read_npm_json(NPMJSON)
+        record.graph(npm_G)
+    return npm_G
+
+
 def read_graph_json(filepath) -> nx.Graph:
     with open(filepath) as json_file:
         data = json.load(json_file)
@@ -120,8 +453,78 @@ def read_graph_json(filepath) -> nx.Graph:
     return json_graph.node_link_graph(data, directed=True)
 
 
+def read_npm_json(filepath) -> NPMSnapshot:
+    '''
+    the NPM graph json of the json backend in columnar form (interned names, score arrays, 
+    bit arrays, constraint pool) instead of a networkx graph with a dict per package and dependency
+    '''
+    with open(filepath) as json_file:
+        data = json.load(json_file)
+    print(f'read from {filepath}')
+    return NPMSnapshot.from_node_link(data)
+
+
 def dump_graph_json(G, filepath: str = 'temp.json'):
-    data = json_graph.node_link_data(G)
-    with open(filepath, 'w') as dfile:
-        json.dump(data, dfile)
+    with stage('write', file=filepath) as record:
+        data = json_graph.node_link_data(G)
+        with open(filepath, 'w') as dfile:
+            json.dump(data, dfile)
+        record.graph(G)
+    print(f'json file stored at {filepath}')
+
+
+# node and edge flags of the columnar graph format
+COLUMNAR_DEPRECATED, COLUMNAR_APPLICATION, COLUMNAR_NON_PROBLEMATIC, COLUMNAR_FILTERED = 1, 2, 4, 8
+COLUMNAR_RUNTIME, COLUMNAR_DEVELOPMENT, COLUMNAR_RIPPLE = 1, 2, 4
+
+
+def columnar_graph(G, pos: dict, keywords: list = KEYWORDS) -> dict:
+    '''
+    REM graph as parallel arrays, nodes are referenced by their index:
+        nodes, x, y, version : one entry per node
+        flags                : 1 deprecated, 2 application, 4 non-problematic (grayed out), 8 has filtered dependencies
+        scores               : {metric: one score per node, null if missing}
+        edges                : flat [u0, v0, u1, v1, ..]
+        edge_flags           : 1 runtime, 2 development, 4 ripple effect of deprecation
+    '''
+    nodes = list(G.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    meta = [G.nodes()[n] for n in nodes]
+    edges, edge_flags = [], []
+    for u, v, m in G.edges(data=True):
+        edges += [index[u], index[v]]
+        edge_flags.append((COLUMNAR_RUNTIME if m.get('runtime') is True else 0)
+            | (COLUMNAR_DEVELOPMENT if m.get('development') is True else 0)
+            | (COLUMNAR_RIPPLE if m.get('color') == '#8b0000' else 0))
+    return {
+        'format': 'rem-columnar',
+        'nodes': [str(n) for n in nodes],
+        'x': [round(pos[n][0], 1) for n in nodes],
+        'y': [round(pos[n][1], 1) for n in nodes],
+        'version': [m.get('version') for m in meta],
+        'flags': [(COLUMNAR_DEPRECATED if m.get('deprecated') else 0)
+            | (COLUMNAR_APPLICATION if m.get('type') == 'GITHUB' else 0)
+            | (COLUMNAR_NON_PROBLEMATIC if m.get('non_problematic') is True else 0)
+            | (COLUMNAR_FILTERED if m.get('symbol') == 'circle-cross' else 0) for m in meta],
+        'scores': {k: [m.get(k) for m in meta] for k in keywords},
+        'edges': edges,
+        'edge_flags': edge_flags
+    }
+
+
+def dump_graph_columnar(G, pos: dict, filepath: str, title: str = '', key: str = 'final', compress: bool = False) -> str:
+    '''
+    write a REM graph with its positions in the columnar format, see columnar_graph
+    compress: gzip the file, .gz is appended to filepath
+    returns the path of the written file
+    '''
+    filepath = filepath + '.gz' if compress else filepath
+    with stage('write', file=filepath) as record:
+        data = columnar_graph(G, pos)
+        data.update(title=title, key=key)
+        text = json.dumps(data, separators=(',', ':'))
+        with (gzip.open(filepath, 'wt', encoding='utf-8') if compress else open(filepath, 'w', encoding='utf-8')) as dfile:
+            dfile.write(text)
+        record.graph(G)
     print(f'json file stored at {filepath}')
+    return filepath